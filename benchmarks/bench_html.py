@@ -0,0 +1,200 @@
+"""
+Микробенчмарки подготовки HTML — того, что выполняется на каждом шаге агента.
+
+Функции прогоняются без браузера на корпусе сохранённых страниц
+(benchmarks/corpus/*.html.gz: Gmail-подобный ящик, длинная выдача магазина,
+статья). Для каждой пары (функция, страница):
+    * время: медиана и минимум по --repeat прогонам (после прогрева),
+      с базой сравнивается минимум;
+    * пик памяти: tracemalloc, отдельный прогон;
+    * размер результата в символах.
+Снимок страницы в BrowserController сбрасывается перед каждым вызовом —
+меряется полная стоимость, а не попадание в кэш снимка.
+
+Запуск:
+    python -m benchmarks.bench_html                         # таблица
+    python -m benchmarks.bench_html --save baseline.json    # сохранить базу
+    python -m benchmarks.bench_html --compare baseline.json # сравнить с базой
+При --compare код выхода 1, если время или память выросли больше --threshold.
+"""
+import argparse
+import gzip
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Callable, Optional
+
+from utils.assistant import AssistantAI
+from utils.browser import BrowserController
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), "corpus")
+
+
+class _PageSourceDriver:
+    """Минимальный драйвер для BrowserController: только page_source/url/title."""
+
+    def __init__(self, html: str, url: str, title: str):
+        self.page_source = html
+        self.current_url = url
+        self.title = title
+
+    def execute_script(self, *args, **kwargs):
+        # Нет observer'а — BrowserController.snapshot сравнивает page_source
+        raise RuntimeError("no browser")
+
+
+def load_corpus(names: Optional[list] = None) -> dict:
+    pages = {}
+    for file_name in sorted(os.listdir(CORPUS_DIR)):
+        if not file_name.endswith(".html.gz"):
+            continue
+        name = file_name[: -len(".html.gz")]
+        if names and name not in names:
+            continue
+        with gzip.open(os.path.join(CORPUS_DIR, file_name), "rt", encoding="utf-8") as file:
+            pages[name] = file.read()
+    return pages
+
+
+def make_cases(html: str, name: str) -> dict[str, Callable[[], str]]:
+    controller = BrowserController()
+    controller.driver = _PageSourceDriver(html, f"https://example.com/{name}", name)
+    budgeted = BrowserController(page_state_budget=6000)
+    budgeted.driver = controller.driver
+    # Для _clean_html/_extract_with_lxml клиент OpenAI не нужен
+    analyzer = AssistantAI.__new__(AssistantAI)
+    visible_html = controller.get_visible_html()
+
+    def fresh(call: Callable[[], str], owner: BrowserController = controller) -> Callable[[], str]:
+        def run():
+            owner._snapshot = None
+            return call()
+        return run
+
+    return {
+        "get_html": fresh(controller.get_html),
+        "get_html_budget": fresh(lambda: budgeted.get_html(query="спам корзина"), budgeted),
+        "get_visible_html": fresh(controller.get_visible_html),
+        "get_dom_chunk": fresh(lambda: controller.get_dom_chunk(mode="css", selector="body")),
+        "_extract_visible_text": lambda: controller._extract_visible_text(html),
+        "_summarize_interactive_elements": lambda: controller._summarize_interactive_elements(html),
+        "_clean_html": lambda: analyzer._clean_html(html),
+        "_extract_with_lxml": lambda: analyzer._extract_with_lxml(visible_html),
+    }
+
+
+def measure(call: Callable[[], str], repeat: int) -> dict:
+    output = call()  # прогрев
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    try:
+        call()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "median_ms": round(statistics.median(times) * 1000, 3),
+        "min_ms": round(min(times) * 1000, 3),
+        "peak_kb": round(peak / 1024, 1),
+        "output_chars": len(output or ""),
+    }
+
+
+def run(pages: dict, repeat: int, functions: Optional[list] = None) -> dict:
+    results = {}
+    for page, html in pages.items():
+        for function, call in make_cases(html, page).items():
+            if functions and function not in functions:
+                continue
+            results[f"{function}@{page}"] = measure(call, repeat)
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float, min_delta_ms: float = 1.0) -> list:
+    """
+    Печатает сравнение с базой и возвращает список регрессий.
+    Время сравнивается по минимуму (он шумит меньше медианы); прирост меньше
+    min_delta_ms регрессией не считается — на быстрых случаях это шум.
+    """
+    regressions = []
+    print(f"\n{'case':<52}{'min ms':>10}{'base':>10}{'Δ':>8}{'KB':>10}{'base':>10}{'Δ':>8}")
+    for key, current in results.items():
+        base = baseline.get(key)
+        if base is None:
+            print(f"{key:<52}{current['min_ms']:>10.1f}{'—':>10}{'':>8}{current['peak_kb']:>10.0f}{'—':>10}")
+            continue
+        time_delta = current["min_ms"] / base["min_ms"] - 1 if base["min_ms"] else 0.0
+        memory_delta = current["peak_kb"] / base["peak_kb"] - 1 if base["peak_kb"] else 0.0
+        slower = time_delta > threshold and current["min_ms"] - base["min_ms"] > min_delta_ms
+        flag = ""
+        if slower or memory_delta > threshold:
+            regressions.append(key)
+            flag = "  ⚠️"
+        print(
+            f"{key:<52}{current['min_ms']:>10.1f}{base['min_ms']:>10.1f}{time_delta:>+8.0%}"
+            f"{current['peak_kb']:>10.0f}{base['peak_kb']:>10.0f}{memory_delta:>+8.0%}{flag}"
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки подготовки HTML")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--pages", nargs="*", help="страницы корпуса (по умолчанию все)")
+    parser.add_argument("--functions", nargs="*", help="функции (по умолчанию все)")
+    parser.add_argument("--save", help="сохранить результаты как базу (JSON)")
+    parser.add_argument("--compare", help="сравнить с базой (JSON)")
+    parser.add_argument("--threshold", type=float, default=0.2, help="допустимый рост, доля (0.2 = +20%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="меньший прирост времени — шум")
+    args = parser.parse_args()
+
+    pages = load_corpus(args.pages)
+    for name, html in pages.items():
+        print(f"{name}: {len(html) / 1024:.0f} KB")
+    results = run(pages, args.repeat, args.functions)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as file:
+            baseline = json.load(file)["results"]
+        regressions = compare(results, baseline, args.threshold, args.min_delta_ms)
+    else:
+        regressions = []
+        print(f"\n{'case':<52}{'median ms':>10}{'min ms':>10}{'peak KB':>10}{'chars':>10}")
+        for key, item in results.items():
+            print(
+                f"{key:<52}{item['median_ms']:>10.1f}{item['min_ms']:>10.1f}"
+                f"{item['peak_kb']:>10.0f}{item['output_chars']:>10}"
+            )
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "repeat": args.repeat,
+                    "results": results,
+                },
+                file,
+                ensure_ascii=False,
+                indent=2,
+            )
+        print(f"\n💾 База сохранена: {args.save}")
+
+    if regressions:
+        print(f"\n⚠️ Регрессии (>{args.threshold:.0%}): {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
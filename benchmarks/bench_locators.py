@@ -0,0 +1,84 @@
+"""
+Бенчмарк генерации локаторов на широком списке (Gmail-подобный ящик).
+
+Сравнивает:
+- legacy: абсолютный путь для каждого элемента с пересборкой списка
+  соседей и siblings.index() на каждом уровне — O(ширина) на уровень;
+- index: LocatorIndex — один проход по дереву, затем O(глубина) на элемент.
+Для LocatorIndex дополнительно проверяется, что каждый локатор находит
+ровно один — нужный — элемент.
+
+Запуск: python -m benchmarks.bench_locators [--rows 5000]
+"""
+import argparse
+import time
+
+from benchmarks.bench_snapshot import make_inbox_html
+from utils.locators import LocatorIndex
+from utils.snapshot import PageSnapshot
+
+
+def legacy_absolute_xpath(el) -> str:
+    # Прежний _build_absolute_xpath: соседи пересобираются на каждом уровне
+    parts = []
+    current = el
+    while current is not None and getattr(current, "tag", None) is not None:
+        if current.get("id"):
+            parts.insert(0, f"//*[@id='{current.get('id')}']")
+            break
+        parent = current.getparent()
+        if parent is None:
+            parts.insert(0, f"/{current.tag}")
+        else:
+            siblings = [c for c in parent if c.tag == current.tag]
+            if len(siblings) == 1:
+                parts.insert(0, f"/{current.tag}")
+            else:
+                parts.insert(0, f"/{current.tag}[{siblings.index(current) + 1}]")
+        current = parent
+    return "".join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--verify", type=int, default=500, help="сколько локаторов проверить через xpath")
+    args = parser.parse_args()
+
+    tree = PageSnapshot(make_inbox_html(args.rows)).tree
+    targets = tree.xpath("//*[@role] | //a | //button | //input")
+    print(f"rows: {args.rows}, elements: {sum(1 for _ in tree.iter())}, targets: {len(targets)}")
+
+    started = time.perf_counter()
+    for el in targets:
+        legacy_absolute_xpath(el)
+    legacy = time.perf_counter() - started
+
+    started = time.perf_counter()
+    index = LocatorIndex(tree)
+    built = time.perf_counter() - started
+    locators = index.locators(targets)
+    total = time.perf_counter() - started
+
+    print(f"  legacy: {legacy * 1000:8.1f} ms ({legacy / len(targets) * 1e6:.1f} µs/element)")
+    print(
+        f"   index: {total * 1000:8.1f} ms (build {built * 1000:.1f} ms, "
+        f"{(total - built) / len(targets) * 1e6:.1f} µs/element)"
+    )
+    print(f"   kinds: {index.stats}")
+    print(f"  length: avg {sum(map(len, locators)) / len(locators):.0f} chars")
+
+    step = max(1, len(targets) // max(1, args.verify))
+    checked = bad = 0
+    roottree = tree.getroottree()
+    for el, locator in list(zip(targets, locators))[::step]:
+        matches = roottree.xpath(locator)
+        checked += 1
+        if len(matches) != 1 or matches[0] is not el:
+            bad += 1
+            print(f"  ❌ {locator} → {len(matches)} совпадений")
+    print(f"  verified: {checked - bad}/{checked} unique and correct")
+
+
+if __name__ == "__main__":
+    main()
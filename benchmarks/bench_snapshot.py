@@ -0,0 +1,180 @@
+"""
+Бенчмарк подготовки HTML за один шаг агента.
+
+Сравнивает два режима на синтетической странице в стиле Gmail:
+- bs4: копия прежнего кода (до PageSnapshot) — видимый текст, список
+  интерактивных элементов, видимый HTML и очистка HTML для get_details
+  парсят страницу BeautifulSoup(html.parser) каждый заново, список
+  элементов для get_details — отдельный разбор lxml (5 разборов за шаг);
+- snapshot: все представления выводятся из одного PageSnapshot.
+Сам разбор списка элементов для get_details в режиме bs4 — уже текущий
+(_extract_with_lxml на своём дереве): сравниваются разборы страницы и
+построение представлений, а не старый генератор xpath.
+
+Запуск: python -m benchmarks.bench_snapshot [--rows 3000]
+"""
+import argparse
+import re
+import time
+from typing import List
+
+from bs4 import BeautifulSoup, Comment, Tag
+from lxml import etree
+
+from utils.assistant import AssistantAI
+from utils.snapshot import PageSnapshot
+
+
+def make_inbox_html(rows: int) -> str:
+    parts = [
+        "<html><head><title>Inbox</title><script>var x = 1;</script>"
+        "<style>.a{color:red}</style></head><body>",
+        '<div role="navigation"><a href="#inbox" aria-label="Входящие">Входящие</a>'
+        '<a href="#spam" aria-label="Спам">Спам</a></div>',
+        '<div role="toolbar"><div role="checkbox" aria-label="Выбрать все"></div>'
+        '<div role="button" data-tooltip="Удалить навсегда">Удалить</div></div>',
+        '<table role="grid"><tbody>',
+    ]
+    for i in range(rows):
+        hidden = ' style="display:none"' if i % 17 == 0 else ""
+        parts.append(
+            f'<tr role="row" class="zA"{hidden}>'
+            f'<td><div role="checkbox" aria-label="Выбрать письмо {i}"></div></td>'
+            f'<td><span email="sender{i}@example.com">Отправитель {i}</span></td>'
+            f'<td><span>Тема письма номер {i}</span> - <span>Фрагмент текста письма {i}</span></td>'
+            f'<td><span title="{i} окт.">{i} окт.</span></td>'
+            "</tr>"
+        )
+    parts.append("</tbody></table><!-- footer --></body></html>")
+    return "".join(parts)
+
+
+# --- Прежний путь на BeautifulSoup (utils/browser.py, utils/assistant.py до PageSnapshot) ---
+
+_BS4_JUNK = ["script", "style", "noscript", "svg", "head"]
+_bs4_parses = [0]  # разборы страницы вне PageSnapshot
+
+
+def _bs4_parse(html: str) -> BeautifulSoup:
+    _bs4_parses[0] += 1
+    return BeautifulSoup(html, "html.parser")
+
+
+def _bs4_visible_soup(html: str) -> BeautifulSoup:
+    soup = _bs4_parse(html)
+    for tag in soup.find_all(_BS4_JUNK):
+        tag.decompose()
+    for comment in soup.find_all(string=lambda t: isinstance(t, Comment)):
+        comment.extract()
+    to_remove: List[Tag] = []
+    for tag in soup.find_all(True):
+        attrs = tag.attrs if isinstance(getattr(tag, "attrs", None), dict) else {}
+        style = (attrs.get("style") or "").lower().replace(" ", "")
+        if (
+            "hidden" in attrs
+            or attrs.get("aria-hidden") == "true"
+            or "display:none" in style
+            or "visibility:hidden" in style
+            or "opacity:0" in style
+        ):
+            to_remove.append(tag)
+    for tag in to_remove:
+        tag.decompose()
+    return soup
+
+
+def bs4_visible_text(html: str, max_chars: int) -> str:
+    text = " ".join(_bs4_visible_soup(html).get_text(separator=" ", strip=True).split())
+    return text[:max_chars]
+
+
+def bs4_visible_html(html: str, max_chars: int) -> str:
+    return " ".join(str(_bs4_visible_soup(html)).split())[:max_chars]
+
+
+def bs4_interactive_summary(html: str, max_items: int) -> str:
+    soup = _bs4_parse(html)
+    lines: List[str] = []
+
+    def add_line(prefix: str, tag):
+        text = (tag.get_text(strip=True) or "")[:80]
+        aria = (tag.get("aria-label") or "")[:80]
+        tooltip = (tag.get("data-tooltip") or "")[:80]
+        parts = [f"aria={aria}"] if aria else []
+        if tooltip:
+            parts.append(f"tooltip={tooltip}")
+        if text and text not in (aria, tooltip):
+            parts.append(f"text={text}")
+        if parts:
+            lines.append(f"{prefix}: {' | '.join(parts)}")
+
+    groups = [("LINK", soup.find_all("a")), ("BUTTON", soup.find_all("button"))]
+    for role in ("button", "link", "checkbox", "tab", "menuitem", "row", "option"):
+        groups.append((f"ROLE[{role}]", soup.find_all(attrs={"role": role})))
+    groups.append(("TOOLTIP", soup.find_all(attrs={"data-tooltip": True})))
+    groups.append(("LABEL", soup.find_all(attrs={"data-label": True})))
+    for prefix, tags in groups:
+        for tag in tags:
+            if len(lines) >= max_items:
+                break
+            add_line(prefix, tag)
+    return "\n".join(lines)
+
+
+def bs4_clean_html(html: str) -> str:
+    soup = _bs4_parse(html)
+    for tag in soup.find_all(_BS4_JUNK + ["meta", "link"]):
+        tag.decompose()
+    for comment in soup.find_all(string=lambda t: isinstance(t, Comment)):
+        comment.extract()
+    return re.sub(r"\s+", " ", str(soup))
+
+
+def step_bs4(html: str, analyzer: AssistantAI):
+    bs4_visible_text(html, max_chars=30000)
+    bs4_interactive_summary(html, max_items=80)
+    visible_html = bs4_visible_html(html, max_chars=150000)
+    # Прежний _extract_with_lxml сам разбирал видимый HTML через etree.HTMLParser
+    _bs4_parses[0] += 1
+    tree = etree.fromstring(visible_html.encode("utf-8", errors="ignore"), etree.HTMLParser())
+    analyzer._extract_with_lxml(visible_html, tree=tree)
+    bs4_clean_html(visible_html)
+
+
+def step_snapshot(html: str, analyzer: AssistantAI):
+    snapshot = PageSnapshot(html)
+    snapshot.visible_text(max_chars=30000)
+    snapshot.interactive_summary(max_items=80, max_chars=30000)
+    visible_html = snapshot.visible_html(max_chars=150000)
+    analyzer._extract_with_lxml(visible_html, tree=snapshot.visible_tree())
+    snapshot.visible_html(max_chars=60000)
+
+
+def measure(step, html: str, analyzer: AssistantAI, repeat: int):
+    PageSnapshot.parse_count = 0
+    _bs4_parses[0] = 0
+    started = time.perf_counter()
+    for _ in range(repeat):
+        step(html, analyzer)
+    elapsed = (time.perf_counter() - started) / repeat
+    return elapsed, (PageSnapshot.parse_count + _bs4_parses[0]) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=3000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    html = make_inbox_html(args.rows)
+    # Для _extract_with_lxml клиент OpenAI не нужен
+    analyzer = AssistantAI.__new__(AssistantAI)
+
+    print(f"page size: {len(html) / 1024:.0f} KB, rows: {args.rows}")
+    for name, step in (("bs4", step_bs4), ("snapshot", step_snapshot)):
+        elapsed, parses = measure(step, html, analyzer, args.repeat)
+        print(f"{name:>9}: {elapsed * 1000:8.1f} ms/step, parses/step: {parses:.0f}")
+
+
+if __name__ == "__main__":
+    main()
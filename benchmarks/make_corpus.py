@@ -0,0 +1,202 @@
+"""
+Генератор корпуса страниц для benchmarks.bench_html.
+
+Страницы повторяют структуру реальных сохранённых page_source (глубокая
+вложенность div, классы-хэши, inline-стили, svg-иконки, скрытые элементы,
+JSON в script), но детерминированы и без персональных данных.
+
+Запуск: python -m benchmarks.make_corpus  → benchmarks/corpus/*.html.gz
+"""
+import gzip
+import os
+import random
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), "corpus")
+
+_SENDERS = ["Анна Смирнова", "GitHub", "Ozon", "Иван Петров", "Google", "Tinkoff", "Jira", "Мария К."]
+_WORDS = (
+    "отчёт встреча заказ доставка счёт review pull request обновление проект "
+    "квартал бюджет договор согласование релиз задача сервер billing invoice"
+).split()
+_ICON = (
+    '<svg viewBox="0 0 24 24" width="20" height="20" focusable="false">'
+    '<path d="M12 2C6.48 2 2 6.48 2 12s4.48 10 10 10 10-4.48 10-10S17.52 2 12 2z'
+    'm0 18c-4.41 0-8-3.59-8-8s3.59-8 8-8 8 3.59 8 8-3.59 8-8 8z"></path></svg>'
+)
+
+
+def _cls(rng: random.Random, count: int = 3) -> str:
+    return " ".join("".join(rng.choice("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ") for _ in range(rng.randint(2, 6)))
+                    for _ in range(count))
+
+
+def _phrase(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(words))
+
+
+def _head(title: str, rng: random.Random) -> str:
+    scripts = "".join(
+        f'<script nonce="{_cls(rng, 1)}">(function(){{var d={rng.random()};window.__s{i}=d;}})();</script>'
+        for i in range(20)
+    )
+    styles = "".join(f".{_cls(rng, 1)}{{margin:{i}px;padding:0;color:#{rng.randint(0, 0xFFFFFF):06x}}}" for i in range(300))
+    return (
+        f'<!DOCTYPE html><html lang="ru"><head><meta charset="utf-8"><title>{title}</title>'
+        f"<style>{styles}</style>{scripts}</head>"
+    )
+
+
+def gmail_inbox(rows: int = 1200, seed: int = 1) -> str:
+    rng = random.Random(seed)
+    parts = [_head("Входящие (1 204) - user@example.com - Почта", rng), f'<body class="{_cls(rng)}">']
+    parts.append(
+        f'<div class="{_cls(rng)}" role="banner"><div class="{_cls(rng)}">'
+        f'<a href="#inbox" aria-label="Почта" class="{_cls(rng)}">{_ICON}</a>'
+        f'<form role="search"><input type="text" aria-label="Поиск в почте" placeholder="Поиск в почте" name="q"></form>'
+        f'<div role="button" aria-label="Настройки" data-tooltip="Настройки" tabindex="0">{_ICON}</div>'
+        f'<a aria-label="Аккаунт Google: user@example.com" href="https://accounts.example.com">{_ICON}</a>'
+        "</div></div>"
+    )
+    parts.append(f'<div class="{_cls(rng)}" role="navigation"><div role="button" class="{_cls(rng)}" tabindex="0">Написать</div>')
+    for label in ("Входящие", "Помеченные", "Отложенные", "Отправленные", "Черновики", "Спам", "Корзина", "Вся почта"):
+        parts.append(
+            f'<div class="{_cls(rng)}"><div class="{_cls(rng)}">{_ICON}<span class="{_cls(rng)}">'
+            f'<a href="#{label}" aria-label="{label}" tabindex="-1">{label}</a></span></div></div>'
+        )
+    parts.append("</div>")
+    parts.append(
+        f'<div role="main" class="{_cls(rng)}"><div role="toolbar" class="{_cls(rng)}">'
+        f'<div role="checkbox" aria-label="Выбрать" aria-checked="false" tabindex="0"></div>'
+        f'<div role="button" aria-label="Обновить" data-tooltip="Обновить">{_ICON}</div>'
+        f'<div role="button" aria-label="Ещё" data-tooltip="Ещё" style="display:none">{_ICON}</div>'
+        f'<span class="{_cls(rng)}">1–50 из 1 204</span></div>'
+        f'<table role="grid" class="{_cls(rng)}"><colgroup><col><col><col><col></colgroup><tbody>'
+    )
+    for i in range(rows):
+        sender = rng.choice(_SENDERS)
+        unread = " zE" if rng.random() < 0.3 else ""
+        hover = (
+            f'<td class="{_cls(rng)}" style="display:none"><ul role="toolbar">'
+            f'<li role="button" data-tooltip="Архивировать">{_ICON}</li>'
+            f'<li role="button" data-tooltip="Удалить">{_ICON}</li>'
+            f'<li role="button" data-tooltip="Отметить как прочитанное">{_ICON}</li></ul></td>'
+        )
+        parts.append(
+            f'<tr class="zA{unread}" role="row" tabindex="-1" id=":{i + 100:x}" jsaction="{_cls(rng, 2)}">'
+            f'<td class="{_cls(rng)}"><div role="checkbox" aria-label="Выбрать" aria-checked="false"></div></td>'
+            f'<td class="{_cls(rng)}"><span role="button" aria-label="Не помечено" title="Не помечено">{_ICON}</span></td>'
+            f'<td class="{_cls(rng)}"><div class="{_cls(rng)}"><span email="s{i % 97}@example.com" name="{sender}">{sender}</span></div></td>'
+            f'<td class="{_cls(rng)}"><div class="{_cls(rng)}"><div class="{_cls(rng)}"><span class="bog">'
+            f'<span>{_phrase(rng, 4).capitalize()} №{i}</span></span>'
+            f'<span class="y2"> - {_phrase(rng, 12)}…</span></div></div></td>'
+            f"{hover}"
+            f'<td class="{_cls(rng)}"><span title="{rng.randint(1, 28)} окт. 2025 г., {rng.randint(0, 23)}:{rng.randint(0, 59):02d}">'
+            f"{rng.randint(1, 28)} окт.</span></td></tr>"
+        )
+    parts.append("</tbody></table></div>")
+    parts.append(f'<div aria-hidden="true" class="{_cls(rng)}">' + "".join(f"<div>{_phrase(rng, 3)}</div>" for _ in range(200)) + "</div>")
+    parts.append("<!-- footer --></body></html>")
+    return "".join(parts)
+
+
+def ecommerce_listing(products: int = 1500, seed: int = 2) -> str:
+    rng = random.Random(seed)
+    parts = [_head("Смартфоны — купить в интернет-магазине", rng), f'<body class="{_cls(rng)}">']
+    parts.append(
+        f'<header class="{_cls(rng)}"><a href="/" aria-label="На главную">{_ICON}</a>'
+        f'<input type="search" name="text" placeholder="Искать на сайте" aria-label="Поиск">'
+        f'<button type="submit">Найти</button><a href="/cart" aria-label="Корзина">{_ICON}<span>3</span></a></header>'
+    )
+    parts.append(f'<aside class="{_cls(rng)}"><h2>Фильтры</h2>')
+    for group in ("Бренд", "Объём памяти", "Диагональ", "Цвет", "Продавец"):
+        parts.append(f'<fieldset><legend>{group}</legend>')
+        for j in range(25):
+            hidden = ' style="display:none"' if j >= 8 else ""
+            parts.append(
+                f'<label{hidden}><input type="checkbox" name="{group}" value="{j}">'
+                f'<span>{_phrase(rng, 1).capitalize()} {j}</span><span class="{_cls(rng, 1)}">{rng.randint(1, 900)}</span></label>'
+            )
+        parts.append('<button type="button">Показать все</button></fieldset>')
+    parts.append(
+        '<label>Цена от <input type="number" name="price_from"></label>'
+        '<label>до <input type="number" name="price_to"></label></aside>'
+    )
+    parts.append(f'<main class="{_cls(rng)}"><h1>Смартфоны</h1><select name="sort" aria-label="Сортировка">'
+                 '<option>По популярности</option><option>Сначала дешёвые</option><option>Сначала дорогие</option></select>'
+                 f'<div class="{_cls(rng)}" data-widget="searchResultsV2">')
+    for i in range(products):
+        price = rng.randint(5000, 180000)
+        parts.append(
+            f'<div class="{_cls(rng)}" data-index="{i}"><div class="{_cls(rng)}">'
+            f'<a href="/product/{i}" class="{_cls(rng)}"><div class="{_cls(rng)}">'
+            f'<img src="https://cdn.example.com/{i}.webp" alt="Смартфон {i}" loading="lazy" width="200" height="260"></div></a>'
+            f'<div class="{_cls(rng)}"><span class="{_cls(rng, 1)}">{price:,} ₽</span>'
+            f'<span class="{_cls(rng, 1)}" style="text-decoration:line-through">{price + rng.randint(500, 9000):,} ₽</span></div>'
+            f'<a href="/product/{i}" class="{_cls(rng)}"><span>Смартфон Model {i} {rng.choice([64, 128, 256])} ГБ, {_phrase(rng, 2)}</span></a>'
+            f'<div class="{_cls(rng)}"><span aria-label="Рейтинг {rng.randint(30, 50) / 10}">★★★★☆</span><span>{rng.randint(0, 9000)} отзывов</span></div>'
+            f'<button type="button" class="{_cls(rng)}">В корзину</button>'
+            f'<button type="button" aria-label="Добавить в избранное" class="{_cls(rng)}">{_ICON}</button>'
+            f'<div class="{_cls(rng)}" hidden><span>Доставка {rng.randint(1, 9)} дней</span></div>'
+            "</div></div>"
+        )
+    parts.append('</div><nav aria-label="Страницы">' + "".join(f'<a href="?page={p}">{p}</a>' for p in range(1, 30)) + "</nav></main>")
+    parts.append('<script type="application/ld+json">{"@context":"https://schema.org","@type":"ItemList","itemListElement":['
+                 + ",".join(f'{{"@type":"ListItem","position":{i}}}' for i in range(products)) + "]}</script>")
+    parts.append("<footer><p>© Магазин</p><a href=\"/help\">Помощь</a></footer></body></html>")
+    return "".join(parts)
+
+
+def article(paragraphs: int = 180, seed: int = 3) -> str:
+    rng = random.Random(seed)
+    parts = [_head("Как устроены браузерные агенты — Блог", rng), "<body>"]
+    parts.append(
+        '<nav class="top"><a href="/">Главная</a><a href="/news">Новости</a><a href="/blog">Блог</a>'
+        '<button type="button" aria-label="Меню">≡</button></nav>'
+        '<div class="cookie" role="dialog" aria-label="Cookies"><p>Мы используем cookies.</p>'
+        '<button type="button">Принять</button></div>'
+    )
+    parts.append("<article><h1>Как устроены браузерные агенты</h1><p class=\"meta\">12 октября 2025 · 18 мин</p>")
+    for i in range(paragraphs):
+        if i % 15 == 0:
+            parts.append(f"<h2>Раздел {i // 15 + 1}: {_phrase(rng, 3)}</h2>")
+        if i % 25 == 7:
+            parts.append(f'<figure><img src="/img/{i}.png" alt="Схема {i}"><figcaption>Схема {i}</figcaption></figure>')
+        if i % 30 == 11:
+            parts.append('<div class="ad" style="display:none"><iframe src="https://ads.example.com/x"></iframe></div>')
+        parts.append(
+            "<p>" + " ".join(
+                f'<a href="/wiki/{rng.randint(1, 999)}">{_phrase(rng, 2)}</a>' if rng.random() < 0.05 else _phrase(rng, 1)
+                for _ in range(rng.randint(40, 90))
+            ) + ".</p>"
+        )
+    parts.append("</article><section class=\"comments\"><h2>Комментарии</h2>")
+    for i in range(60):
+        parts.append(
+            f'<div class="comment"><b>Читатель {i}</b><p>{_phrase(rng, 20)}</p>'
+            '<button type="button">Ответить</button></div>'
+        )
+    parts.append('<textarea name="comment" placeholder="Ваш комментарий"></textarea><button type="submit">Отправить</button>')
+    parts.append("</section><footer><a href=\"/about\">О нас</a></footer></body></html>")
+    return "".join(parts)
+
+
+PAGES = {
+    "gmail_inbox": gmail_inbox,
+    "ecommerce_listing": ecommerce_listing,
+    "article": article,
+}
+
+
+def main():
+    os.makedirs(CORPUS_DIR, exist_ok=True)
+    for name, build in PAGES.items():
+        html = build()
+        path = os.path.join(CORPUS_DIR, f"{name}.html.gz")
+        # mtime=0 — одинаковые байты при повторной генерации
+        with open(path, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as file:
+            file.write(html.encode("utf-8"))
+        print(f"{name}: {len(html) / 1024:.0f} KB → {os.path.getsize(path) / 1024:.0f} KB gz")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,98 @@
-from typing import Optional
-from pydantic import BaseModel
+import json
+from typing import Optional, Literal, Union
+from pydantic import BaseModel, ConfigDict, field_validator
 
 class NextAction(BaseModel):
     function: str
     args: dict
     reason: Optional[str] = None
 
+    @field_validator("args")
+    @classmethod
+    def _clean_args(cls, args: dict) -> dict:
+        # В строгой JSON-схеме все аргументы присутствуют (null, если не нужны),
+        # а extra передаётся JSON-строкой
+        args = {key: value for key, value in args.items() if value is not None}
+        extra = args.get("extra")
+        if isinstance(extra, str):
+            try:
+                args["extra"] = json.loads(extra)
+            except ValueError:
+                pass
+        return args
+
 class MissingData(BaseModel):
     field: str
     question: str
 
 class AssistantResponse(BaseModel):
     action_sequence: Optional[list[NextAction]] = None
-    status: str 
+    status: str
     current_goal: str
     missing_data: Optional[list[MissingData]] = None
 
 class ResponseXpath(BaseModel):
-    xpath: str
\ No newline at end of file
+    xpath: str
+
+
+# ==========================
+# Строгие схемы для response_format (structured outputs)
+# ==========================
+# В strict-режиме все поля обязательны, лишние запрещены, свободных dict нет —
+# поэтому args описаны явно, а ненужные аргументы модель ставит в null.
+
+class _Strict(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+class WireArgs(_Strict):
+    url: Optional[str]
+    id: Optional[Union[int, str]]
+    xpath: Optional[str]
+    text: Optional[str]
+    mode: Optional[str]
+    selector: Optional[str]
+    prompt: Optional[str]
+    msg: Optional[str]
+    extra: Optional[str]
+    page: Optional[int]
+
+class WireAction(_Strict):
+    function: Literal[
+        "open", "click", "enter", "get", "get_dom_chunk", "get_details", "get_page_state",
+        "helper", "save_response", "delete_response", "waiting_user_input",
+    ]
+    args: WireArgs
+    reason: Optional[str]
+
+class WireMissingData(_Strict):
+    field: str
+    question: str
+
+class WireAssistantResponse(_Strict):
+    status: Literal["in_progress", "waiting_user_input", "done", "error"]
+    current_goal: str
+    action_sequence: Optional[list[WireAction]]
+    missing_data: Optional[list[WireMissingData]]
+
+class WireElement(_Strict):
+    description: str
+    id: Optional[int]
+    xpath: str
+    action: Optional[Literal["click", "enter"]]
+
+class WireAnalysisResult(_Strict):
+    found: bool
+    elements: list[WireElement]
+    page_context: str
+
+
+def response_format(model: type[BaseModel], name: str) -> dict:
+    """response_format для chat.completions.create: строгая JSON-схема модели."""
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": name,
+            "strict": True,
+            "schema": model.model_json_schema(),
+        },
+    }
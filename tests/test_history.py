@@ -0,0 +1,51 @@
+from utils.history import HistoryManager, PageStateInterner, page_state_block
+
+
+def diff_block(step: int, base: int, url: str, body: str) -> str:
+    return f"[PAGE DIFF #{step} vs step {base} | url={url}]\n{body}\n[/PAGE DIFF]"
+
+
+def test_stub_page_states_keeps_trailing_diff_after_two_states():
+    # Первое состояние длиннее второго: после замены его заглушкой DIFF
+    # сдвигается левее начала последнего состояния, но должен остаться как есть
+    first = page_state_block("старое состояние\n" * 200, "https://example.com", "Example", step=1)
+    second = page_state_block("новое состояние", "https://example.com", "Example", step=2)
+    trailing = diff_block(3, 2, "https://example.com", "+ новая строка")
+    history = [
+        {"role": "system", "content": "system"},
+        {"role": "user", "content": f"{first}\n\n{second}\n\n{trailing}"},
+    ]
+
+    content = HistoryManager._stub_page_states(history)[1]["content"]
+
+    assert "старое состояние" not in content
+    assert "[PAGE STATE #1 url=https://example.com | title=Example | sha1=" in content
+    assert second in content
+    assert trailing in content
+    assert "устарело]" not in content.split(second, 1)[1]
+
+
+def test_stub_page_states_stubs_diff_before_latest_state():
+    old_diff = diff_block(2, 1, "https://example.com", "+ строка")
+    state = page_state_block("состояние", "https://example.com", "Example", step=3)
+    history = [
+        {"role": "user", "content": old_diff},
+        {"role": "user", "content": state},
+    ]
+
+    result = HistoryManager._stub_page_states(history)
+
+    assert result[0]["content"] == "[PAGE DIFF #2 vs step 1 — устарело]"
+    assert result[1] is history[1]
+
+
+def test_interner_reset_sends_full_state_after_lost_message():
+    interner = PageStateInterner()
+    state = "строка 1\nстрока 2\nстрока 3"
+    interner.render(state, "https://example.com", "Example")
+    assert interner.render(state, "https://example.com", "Example").startswith("[PAGE UNCHANGED since step 1")
+
+    # Сообщение с базой не дошло до модели — ссылаться на неё нельзя
+    interner.reset()
+
+    assert interner.render(state, "https://example.com", "Example").startswith("[PAGE STATE #3 ")
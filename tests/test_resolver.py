@@ -0,0 +1,45 @@
+import gzip
+import json
+import os
+
+import pytest
+
+from utils.resolver import ElementResolver, element_role
+from utils.snapshot import PageSnapshot
+
+
+CORPUS = os.path.join(os.path.dirname(__file__), "..", "benchmarks", "corpus")
+
+
+@pytest.fixture(scope="module")
+def gmail():
+    with gzip.open(os.path.join(CORPUS, "gmail_inbox.html.gz"), "rt", encoding="utf-8") as file:
+        return PageSnapshot(file.read())
+
+
+def resolved_role(snapshot: PageSnapshot, prompt: str):
+    result = ElementResolver().resolve(snapshot, prompt)
+    if result is None:
+        return None
+    xpath = json.loads(result)["elements"][0]["xpath"]
+    (el,) = snapshot.tree.xpath(xpath)
+    return element_role(el)
+
+
+@pytest.mark.parametrize("prompt, role", [
+    # Раньше: ссылка "Вся почта" с уверенностью 0.84
+    ("чекбокс выбрать все", "checkbox"),
+    # Раньше: кнопка-div "Настройки" с уверенностью 1.0
+    ("ссылка Настройки", "link"),
+])
+def test_role_word_never_resolves_to_other_role(gmail, prompt, role):
+    assert resolved_role(gmail, prompt) in (None, role)
+
+
+@pytest.mark.parametrize("prompt, role", [
+    ("ссылка Спам", "link"),
+    ("кнопка Настройки", "button"),
+    ("поле поиска", "textbox"),
+])
+def test_role_word_resolves_matching_element(gmail, prompt, role):
+    assert resolved_role(gmail, prompt) == role
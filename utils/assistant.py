@@ -1,13 +1,57 @@
 import time
 import json
-import re
-from typing import Optional, List
-
-from httpx import Client, Proxy
-from openai import OpenAI, RateLimitError
-from bs4 import BeautifulSoup, Comment
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from urllib.parse import urlparse
+from typing import Optional, List, Iterator
+
+from openai import (
+    OpenAI,
+    AsyncOpenAI,
+    APIError,
+    RateLimitError,
+    APITimeoutError,
+    APIConnectionError,
+    InternalServerError,
+)
 from lxml import etree
 
+from utils.snapshot import PageSnapshot, HtmlChunk
+from utils.resolver import parse_prompt, tokenize
+from utils.locators import LocatorIndex
+from utils.llm_cache import LLMCache
+from utils.history import HistoryManager, messages_tokens
+from utils.rate_limit import shared_rate_limiter, parse_retry_after, RateLimitTimeout
+from utils.transport import build_http_client, build_async_http_client, warm_up_in_background
+from utils.replay import ReplayStore, split_content
+from utils.tracing import span, tracer
+from models.models import WireAssistantResponse, WireAnalysisResult, response_format
+
+
+class RequestCancelled(Exception):
+    """Запрос к модели отменён (результат больше не нужен)."""
+
+
+# Ошибки, после которых запрос имеет смысл повторить
+RETRYABLE_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+
+# Ошибки запроса, которые остаются после всех повторов: модель недоступна, а не агент сломан
+REQUEST_ERRORS = (APIError, RateLimitTimeout)
+
+# Дополнение системного промпта, когда состояние страницы приходит порциями
+# (BrowserController.page_state_paged); без бюджета get_page_state недоступен
+PAGED_STATE_PROMT = """
+# ПОРЦИИ СОСТОЯНИЯ СТРАНИЦЫ
+
+| Функция        | args | Описание |
+|----------------|------|----------|
+| get_page_state | page | Следующая порция состояния страницы (см. [OMITTED] в [CURRENT PAGE STATE]) |
+
+Текст и элементы в состоянии отобраны по релевантности к current_goal и сообщению пользователя.
+Строка [OMITTED] в конце показывает, что не поместилось; если нужного элемента нет —
+запроси следующую порцию: {"function": "get_page_state", "args": {"page": 2}} (затем 3, ...).
+"""
+
 
 class AssistantAI:
     """
@@ -17,17 +61,108 @@ class AssistantAI:
     - планирующая модель (chat);
     - анализатор HTML для get_details (analyze_html / analyze_html_chunked);
     - вторая модель-помощник (call_helper), которая всегда отвечает JSON.
+
+    Ответы analyze_html и call_helper — чистые функции запроса, поэтому при
+    переданном cache (LLMCache) повторные одинаковые запросы в модель не уходят.
+
+    История диалога перед каждым запросом сжимается HistoryManager'ом
+    под бюджет токенов (старые состояния страницы → заглушки).
+
+    structured_output=True — ответы планировщика и анализатора ограничиваются
+    строгой JSON-схемой (response_format json_schema), помощника — JSON-режимом,
+    так что ответы модели всегда разбираются без повторных запросов.
+
+    roles — настройки по ролям "plan" (chat), "analysis" (analyze_html),
+    "helper" (call_helper): {"model", "max_tokens", "temperature"}; не заданная
+    модель берётся из model. Если get_details на модели анализа ничего не нашёл,
+    при escalate_analysis запрос один раз повторяется на модели планировщика
+    (роль "escalation"). Задержка и токены по ролям копятся в role_stats.
+
+    Все запросы проходят через общий на процесс RateLimiter модели
+    (rate_limits: {"requests_per_minute", "tokens_per_minute"}); 429/таймауты/5xx
+    повторяются с Retry-After или экспоненциальной задержкой с джиттером,
+    но не больше max_attempts попыток и не дольше request_deadline секунд.
+
+    HTTP-транспорт (прокси, HTTP/2, пул, таймауты) задаётся transport —
+    ключи utils.transport.DEFAULT_TRANSPORT_OPTIONS; async_client — такой же
+    AsyncOpenAI для конкурентных вызовов; base_url — другой OpenAI-совместимый
+    сервер (например, utils.fake_openai). replay — запись/воспроизведение
+    ответов под request/request_stream (utils.replay.ReplayStore).
+
+    paged_state=True — к системному промпту добавляется PAGED_STATE_PROMT
+    (функция get_page_state и строка [OMITTED]).
     """
 
-    def __init__(self, api_key: str, model: str):
+    ROLES = ("plan", "analysis", "helper", "escalation")
+
+    def __init__(
+        self,
+        api_key: str,
+        model: str,
+        cache: Optional[LLMCache] = None,
+        history_manager: Optional[HistoryManager] = None,
+        structured_output: bool = False,
+        roles: Optional[dict] = None,
+        escalate_analysis: bool = True,
+        rate_limits: Optional[dict] = None,
+        max_attempts: int = 6,
+        request_deadline: float = 300.0,
+        transport: Optional[dict] = None,
+        base_url: Optional[str] = None,
+        replay: Optional[ReplayStore] = None,
+        paged_state: bool = False,
+    ):
+        self.api_key = api_key
+        self.transport = transport or {}
+        if base_url and urlparse(base_url).hostname in ("localhost", "127.0.0.1", "::1"):
+            # Локальный сервер — мимо прокси
+            self.transport = {**self.transport, "proxy": ""}
+        self.replay = replay
+        self.http_client = build_http_client(self.transport)
         self.client = OpenAI(
             api_key=api_key,
-            http_client=Client(proxy=Proxy("http://73.235.88.231:1194"))
+            base_url=base_url or None,
+            http_client=self.http_client,
+            # Повторы делает _create с учётом общего лимита
+            max_retries=0,
         )
+        self._async_client: Optional[AsyncOpenAI] = None
         self.model = model
+        self.cache = cache
+        self.history_manager = history_manager or HistoryManager()
+        self.structured_output = structured_output
+        # Ответы, которые не удалось разобрать как JSON
+        self.parse_stats = {"analysis_failures": 0}
+        self.roles = roles or {}
+        self.escalate_analysis = escalate_analysis
+        self.role_stats = {
+            kind: {"calls": 0, "seconds": 0.0, "prompt_tokens": 0, "completion_tokens": 0}
+            for kind in self.ROLES
+        }
+        self._stats_lock = threading.Lock()
+        self.rate_limits = rate_limits or {}
+        self.max_attempts = max_attempts
+        self.request_deadline = request_deadline
         self.history: list[dict] = []
+        self.paged_state = paged_state
         self.promt = self.load_promt()
 
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        """AsyncOpenAI с тем же транспортом; создаётся при первом обращении."""
+        if self._async_client is None:
+            self._async_client = AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.client.base_url,
+                http_client=build_async_http_client(self.transport),
+                max_retries=0,
+            )
+        return self._async_client
+
+    def warm_up(self) -> threading.Thread:
+        """Открывает соединение с API в фоне, пока идёт остальной запуск."""
+        return warm_up_in_background(self.http_client, str(self.client.base_url))
+
     # ==========================
     # Базовый чат
     # ==========================
@@ -35,6 +170,8 @@ class AssistantAI:
     def load_promt(self) -> str:
         with open("./promt.txt", "r", encoding="utf-8") as file:
             promt = file.read()
+        if self.paged_state:
+            promt += PAGED_STATE_PROMT
         self.history.append(
             {
                 "role": "system",
@@ -43,20 +180,221 @@ class AssistantAI:
         )
         return promt
 
-    def request(self, messages: list[dict]) -> str:
+    def _response_format(self, kind: str) -> Optional[dict]:
+        """response_format для роли: "plan" | "analysis" | "helper" (None — без ограничений)."""
+        if not self.structured_output:
+            return None
+        if kind == "plan":
+            return response_format(WireAssistantResponse, "assistant_response")
+        if kind in ("analysis", "escalation"):
+            return response_format(WireAnalysisResult, "analysis_result")
+        return {"type": "json_object"}
+
+    def role_settings(self, kind: str) -> dict:
+        """{"model", "max_tokens", "temperature"} для роли (эскалация — анализ на модели планировщика)."""
+        if kind == "escalation":
+            settings = self.role_settings("analysis")
+            settings["model"] = self.role_settings("plan")["model"]
+            return settings
+        settings = dict(self.roles.get(kind) or {})
+        settings["model"] = settings.get("model") or self.model
+        return settings
+
+    def _completion_kwargs(self, kind: str, response_format: Optional[dict]) -> dict:
+        settings = self.role_settings(kind)
+        kwargs = {"model": settings["model"]}
+        if settings.get("max_tokens"):
+            kwargs["max_completion_tokens"] = settings["max_tokens"]
+        if settings.get("temperature") is not None:
+            kwargs["temperature"] = settings["temperature"]
+        if response_format:
+            kwargs["response_format"] = response_format
+        return kwargs
+
+    def _record_usage(self, kind: str, seconds: float, usage):
+        with self._stats_lock:
+            stats = self.role_stats[kind]
+            stats["calls"] += 1
+            stats["seconds"] += seconds
+            if usage is not None:
+                stats["prompt_tokens"] += usage.prompt_tokens or 0
+                stats["completion_tokens"] += usage.completion_tokens or 0
+
+    def _create(self, messages: list[dict], kwargs: dict, cancel: Optional[threading.Event] = None):
+        """
+        chat.completions.create через общий RateLimiter модели с повторами.
+        Возвращает (ответ, лимитер, зарезервированные токены).
+        """
+        limiter = shared_rate_limiter(kwargs["model"], **self.rate_limits)
+        estimated = messages_tokens(messages) + (kwargs.get("max_completion_tokens") or 1000)
+        deadline = time.monotonic() + self.request_deadline
+        attempt = 0
         while True:
+            if cancel is not None and cancel.is_set():
+                raise RequestCancelled()
+            waited = limiter.acquire(estimated, deadline=deadline, cancel=cancel)
+            if waited is None:
+                raise RequestCancelled()
+            if cancel is not None and cancel.is_set():
+                # Отменили сразу после резерва — запрос не уйдёт, токены возвращаются в ведро
+                limiter.refund(estimated)
+                raise RequestCancelled()
             try:
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=messages,
-                )
-                break
-            except RateLimitError:
-                print("Rate limit exceeded. Waiting for 60 seconds before retrying...")
-                time.sleep(60)
+                with span("llm.http", attempt=attempt + 1, limiter_wait_ms=round(waited * 1000, 1)):
+                    raw = self.client.chat.completions.with_raw_response.create(
+                        messages=messages,
+                        **kwargs,
+                    )
+                limiter.update_from_headers(raw.headers)
+                return raw.parse(), limiter, estimated
+            except RETRYABLE_ERRORS as e:
+                # Попытка не состоялась — её резерв не должен тормозить остальные запросы
+                limiter.refund(estimated)
+                # Кончилась квота — повтор не поможет
+                if getattr(e, "code", None) == "insufficient_quota":
+                    raise
+                attempt += 1
+                response = getattr(e, "response", None)
+                headers = response.headers if response is not None else None
+                limiter.update_from_headers(headers)
+                retry_after = parse_retry_after(headers)
+                delay = retry_after if retry_after is not None else limiter.backoff(attempt)
+                if isinstance(e, RateLimitError):
+                    # Пауза общая: остальные потоки не будут долбить API в это время
+                    limiter.penalize(delay)
+                if attempt >= self.max_attempts or time.monotonic() + delay > deadline:
+                    raise
+                print(f"⏳ {type(e).__name__}: повтор {attempt}/{self.max_attempts} через {delay:.1f} с")
+                if cancel is not None:
+                    cancel.wait(delay)
+                else:
+                    time.sleep(delay)
+            except Exception:
+                limiter.refund(estimated)
+                raise
+
+    @staticmethod
+    def _trace_messages(trace, messages: list[dict]):
+        if tracer.enabled:
+            trace.set(
+                messages=len(messages),
+                request_bytes=len(json.dumps(messages, ensure_ascii=False).encode("utf-8")),
+            )
+
+    @staticmethod
+    def _trace_reply(trace, reply: Optional[str], usage, replayed: bool = False):
+        if not tracer.enabled:
+            return
+        trace.set(response_bytes=len((reply or "").encode("utf-8")), replayed=replayed)
+        if usage is not None:
+            trace.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+
+    def request(
+        self,
+        messages: list[dict],
+        cancel: Optional[threading.Event] = None,
+        response_format: Optional[dict] = None,
+        kind: str = "plan",
+    ) -> str:
+        """
+        Один запрос к модели.
 
-        bot_reply = response.choices[0].message.content
-        return bot_reply
+        cancel          — событие отмены: если оно выставлено до отправки запроса
+                          или во время ожидания после rate limit, бросается RequestCancelled.
+        response_format — ограничение формата ответа (см. _response_format).
+        kind            — роль запроса: модель и параметры берутся из role_settings.
+        """
+        kwargs = self._completion_kwargs(kind, response_format)
+        with span("llm.request", kind=kind, model=kwargs["model"]) as trace:
+            self._trace_messages(trace, messages)
+            started = time.perf_counter()
+            if self.replay is not None and self.replay.mode == "replay":
+                entry = self.replay.lookup(kwargs["model"], messages)
+                self._record_usage(kind, time.perf_counter() - started, None)
+                self._trace_reply(trace, entry["content"], None, replayed=True)
+                return entry["content"]
+
+            response, limiter, estimated = self._create(messages, kwargs, cancel=cancel)
+            usage = getattr(response, "usage", None)
+            limiter.settle(estimated, usage.total_tokens if usage is not None else None)
+            seconds = time.perf_counter() - started
+            self._record_usage(kind, seconds, usage)
+            bot_reply = response.choices[0].message.content
+            self._trace_reply(trace, bot_reply, usage)
+            if self.replay is not None:
+                self.replay.record(kwargs["model"], messages, bot_reply, seconds, usage)
+            return bot_reply
+
+    def cached_request(
+        self,
+        messages: list[dict],
+        cancel: Optional[threading.Event] = None,
+        response_format: Optional[dict] = None,
+        kind: str = "plan",
+    ) -> str:
+        """request через кэш: в кэш попадают только ответы, являющиеся валидным JSON."""
+        if self.cache is None:
+            return self.request(messages, cancel=cancel, response_format=response_format, kind=kind)
+
+        # Ответ, полученный с другой схемой или настройками роли, не подходит
+        params = self._completion_kwargs(kind, response_format)
+        key = LLMCache.make_key(params.pop("model"), messages, params)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        reply = self.request(messages, cancel=cancel, response_format=response_format, kind=kind)
+        try:
+            json.loads(reply)
+        except Exception:
+            return reply
+        self.cache.set(key, reply)
+        return reply
+
+    def request_stream(
+        self,
+        messages: list[dict],
+        response_format: Optional[dict] = None,
+        kind: str = "plan",
+    ) -> Iterator[str]:
+        """Запрос к модели с stream=True: отдаёт текст ответа кусками по мере генерации."""
+        kwargs = self._completion_kwargs(kind, response_format)
+        # Span открыт, пока вызывающий читает поток: действия плана, исполненные
+        # на лету, попадают в него дочерними
+        with span("llm.stream", kind=kind, model=kwargs["model"]) as trace:
+            self._trace_messages(trace, messages)
+            started = time.perf_counter()
+            if self.replay is not None and self.replay.mode == "replay":
+                entry = self.replay.lookup(kwargs["model"], messages, wait=False)
+                pieces = list(split_content(entry["content"]))
+                for piece in pieces:
+                    if self.replay.replay_latency:
+                        time.sleep((entry.get("latency") or 0.0) / len(pieces))
+                    yield piece
+                self._record_usage(kind, time.perf_counter() - started, None)
+                self._trace_reply(trace, entry["content"], None, replayed=True)
+                return
+
+            kwargs.update(stream=True, stream_options={"include_usage": True})
+            stream, limiter, estimated = self._create(messages, kwargs)
+
+            usage = None
+            parts: List[str] = []
+            for chunk in stream:
+                # Последний чанк (include_usage) несёт только usage, без choices
+                if getattr(chunk, "usage", None) is not None:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if not parts:
+                        trace.set(first_token_ms=round((time.perf_counter() - started) * 1000, 1))
+                    parts.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+            limiter.settle(estimated, usage.total_tokens if usage is not None else None)
+            seconds = time.perf_counter() - started
+            self._record_usage(kind, seconds, usage)
+            self._trace_reply(trace, "".join(parts), usage)
+            if self.replay is not None:
+                self.replay.record(kwargs["model"], messages, "".join(parts), seconds, usage)
 
     def chat(self, msg: str, role: str = "user") -> str:
         self.history.append(
@@ -65,16 +403,56 @@ class AssistantAI:
                 "content": msg,
             }
         )
-        response = self.request(self.history)
+        self._compact_history()
+        try:
+            response = self.request(self.history, response_format=self._response_format("plan"))
+        except Exception:
+            self._discard_message(msg, role)
+            raise
+        self._append_reply(response)
+        return response
+
+    def chat_stream(self, msg: str, role: str = "user") -> Iterator[str]:
+        """
+        Как chat, но отдаёт ответ кусками по мере генерации.
+        В историю ответ попадает целиком, когда генератор исчерпан.
+        """
+        self.history.append(
+            {
+                "role": role,
+                "content": msg,
+            }
+        )
+        self._compact_history()
+        parts: List[str] = []
+        try:
+            for delta in self.request_stream(self.history, response_format=self._response_format("plan")):
+                parts.append(delta)
+                yield delta
+        except Exception:
+            self._discard_message(msg, role)
+            raise
+        self._append_reply("".join(parts))
+
+    def _compact_history(self):
+        # Итоги — в history_manager.stats/last и в трейсе, не в stdout на каждый запрос
+        with span("history.compact") as trace:
+            self.history = self.history_manager.compact(self.history)
+            if tracer.enabled:
+                trace.set(**self.history_manager.last)
+
+    def _discard_message(self, msg: str, role: str):
+        """Убирает сообщение, на которое не пришёл ответ: в истории не будет хода без ответа."""
+        if self.history and self.history[-1]["role"] == role and self.history[-1]["content"] == msg:
+            self.history.pop()
+
+    def _append_reply(self, response: str):
         self.history.append(
             {
                 "role": "assistant",
                 "content": response,
             }
         )
-        if len(self.history) > 10:
-            self.history = self.history[:2] + self.history[4:]
-        return response
 
     def save_response(self, msg: str):
         self.history.append(
@@ -143,12 +521,12 @@ class AssistantAI:
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_message},
         ]
-        return self.request(messages)
+        return self.cached_request(messages, response_format=self._response_format("helper"), kind="helper")
 
     def _get_analysis_system_prompt(self) -> str:
         return """
 Ты — анализатор HTML. Твоя задача — по описанию запроса найти подходящие элементы
-в ОЧИЩЕННОЙ ВИДИМОЙ части страницы и вернуть их xpath.
+в ОЧИЩЕННОЙ ВИДИМОЙ части страницы и вернуть их id (атрибут data-ba-id) и xpath.
 
 ФОРМАТ ОТВЕТА (СТРОГО JSON-ОБЪЕКТ):
 
@@ -157,6 +535,7 @@ class AssistantAI:
   "elements": [
     {
       "description": "видимый текст + пояснение, что это за элемент",
+      "id": 17,
       "xpath": "строка xpath",
       "action": "click" | "enter" | null
     }
@@ -170,26 +549,53 @@ class AssistantAI:
 2. Никогда НЕ ставь "found": true с пустым "elements".
 3. Если есть сомнения — ставь "found": false.
 4. Каждый элемент в "elements" обязан иметь ПОНЯТНОЕ "description" и корректный "xpath".
-5. НИКАКИХ висячих запятых в твоём JSON.
+5. Если у элемента (или его ближайшего кликабельного предка) есть атрибут data-ba-id —
+   ОБЯЗАТЕЛЬНО верни его числом в поле "id". Не выдумывай id, которых нет в HTML.
+6. Если перед HTML есть строка [ANCESTOR PATH] — это фрагмент страницы, вложенный
+   в указанный путь. Абсолютный xpath строй ОТ этого пути (предки во фрагменте
+   показаны без своих остальных детей, индексы считай только внутри фрагмента).
+   Лучше используй xpath из списка интерактивных элементов или атрибуты.
+7. НИКАКИХ висячих запятых в твоём JSON.
 """
 
     def _clean_html(self, html: str) -> str:
-        soup = BeautifulSoup(html, "html.parser")
-        for tag in soup.find_all(["script", "style", "noscript", "svg", "head", "meta", "link"]):
-            tag.decompose()
-        for comment in soup.find_all(string=lambda t: isinstance(t, Comment)):
-            comment.extract()
-        result = str(soup)
-        result = re.sub(r"\s+", " ", result)
-        return result
-
-    def _extract_with_lxml(self, html: str) -> str:
-        """Извлекает краткий список интерактивных элементов (по видимой части)."""
-        try:
-            parser = etree.HTMLParser()
-            tree = etree.fromstring(html.encode("utf-8", errors="ignore"), parser)
-        except Exception as e:
-            return f"[PARSE ERROR: {e}]"
+        return PageSnapshot(html).cleaned_html()
+
+    def _extract_with_lxml(
+        self,
+        html: str,
+        tree=None,
+        origin: Optional[dict] = None,
+        locators: Optional[LocatorIndex] = None,
+    ) -> str:
+        """
+        Извлекает краткий список интерактивных элементов (по видимой части).
+
+        tree     — уже разобранное lxml-дерево этого HTML (например,
+                   PageSnapshot.visible_tree()); если передано, HTML повторно не парсится.
+        origin   — копия → исходный элемент (HtmlChunk.origin): xpath строятся
+                   и проверяются на уникальность по полному дереву страницы.
+        locators — готовый LocatorIndex документа, к которому относятся xpath
+                   (PageSnapshot.locator_index()); иначе строится здесь.
+        """
+        if tree is None:
+            try:
+                parser = etree.HTMLParser()
+                tree = etree.fromstring(html.encode("utf-8", errors="ignore"), parser)
+            except Exception as e:
+                return f"[PARSE ERROR: {e}]"
+        if tree is None:
+            return "[PARSE ERROR: empty document]"
+
+        if origin is not None:
+            if locators is None:
+                first = next(iter(origin.values()), None)
+                locators = LocatorIndex(first)
+            make_xpath = lambda el: locators.locator(origin.get(el, el))
+        else:
+            if locators is None:
+                locators = LocatorIndex(tree)
+            make_xpath = locators.locator
 
         def is_likely_visible(el) -> bool:
             if el.get("hidden") is not None:
@@ -232,9 +638,11 @@ class AssistantAI:
                 desc = aria or label or text or href
                 if not desc:
                     continue
-                xpath = self._make_xpath_lxml(el)
+                xpath = make_xpath(el)
                 lines.append(f" • {desc}")
                 lines.append(f" xpath: {xpath}")
+                if el.get("data-ba-id"):
+                    lines.append(f" id: {el.get('data-ba-id')}")
 
         # Кнопки role=button
         buttons = tree.xpath('//*[@role="button"]')
@@ -253,9 +661,11 @@ class AssistantAI:
                 desc = aria or tooltip or text
                 if not desc:
                     continue
-                xpath = self._make_xpath_lxml(el)
+                xpath = make_xpath(el)
                 lines.append(f" • {desc}")
                 lines.append(f" xpath: {xpath}")
+                if el.get("data-ba-id"):
+                    lines.append(f" id: {el.get('data-ba-id')}")
 
         # Чекбоксы
         checkboxes = tree.xpath('//*[@role="checkbox"]')
@@ -270,9 +680,11 @@ class AssistantAI:
                     break
                 aria = el.get("aria-label", f"checkbox_{count}")
                 checked = el.get("aria-checked", "false")
-                xpath = self._make_xpath_lxml(el)
+                xpath = make_xpath(el)
                 lines.append(f" • {aria} (checked={checked})")
                 lines.append(f" xpath: {xpath}")
+                if el.get("data-ba-id"):
+                    lines.append(f" id: {el.get('data-ba-id')}")
 
         # Строки с role=row
         rows = tree.xpath('//*[@role="row"]')
@@ -288,76 +700,54 @@ class AssistantAI:
                 text = "".join(el.itertext()).strip()[:80]
                 if len(text) < 5:
                     continue
-                xpath = self._make_xpath_lxml(el)
+                xpath = make_xpath(el)
                 lines.append(f" • row_{count}: {text}")
                 lines.append(f" xpath: {xpath}")
+                if el.get("data-ba-id"):
+                    lines.append(f" id: {el.get('data-ba-id')}")
 
         return "\n".join(lines)
 
-    def _escape_xpath(self, value: str) -> str:
-        if "'" not in value:
-            return value
-        if '"' not in value:
-            return value
-        return value.replace("'", "")
-
-    def _make_xpath_lxml(self, el) -> str:
-        if el.get("id"):
-            return f"//*[@id='{el.get('id')}']"
-        if el.get("data-label"):
-            return f"//*[@data-label='{self._escape_xpath(el.get('data-label'))}']"
-        if el.get("data-tooltip"):
-            return f"//*[@data-tooltip='{self._escape_xpath(el.get('data-tooltip'))}']"
-        if el.get("aria-label"):
-            return f"//*[@aria-label='{self._escape_xpath(el.get('aria-label'))}']"
-        if el.get("name"):
-            return f"//{el.tag}[@name='{el.get('name')}']"
-        if el.tag == "a" and el.get("href"):
-            href = el.get("href")
-            if len(href) < 60 and "'" not in href:
-                return f"//a[@href='{href}']"
-        if el.get("role"):
-            role = el.get("role")
-            text = "".join(el.itertext()).strip()[:25]
-            if text and "'" not in text:
-                return f"//*[@role='{role}'][contains(., '{text}')]"
-            return f"//*[@role='{role}']"
-        text = "".join(el.itertext()).strip()[:25]
-        if text and "'" not in text and len(text) > 2:
-            return f"//{el.tag}[contains(., '{text}')]"
-        return self._build_absolute_xpath(el)
-
-    def _build_absolute_xpath(self, el) -> str:
-        parts = []
-        current = el
-        while current is not None and getattr(current, "tag", None) is not None:
-            if current.get("id"):
-                parts.insert(0, f"//*[@id='{current.get('id')}']")
-                break
-            parent = current.getparent()
-            if parent is None:
-                parts.insert(0, f"/{current.tag}")
-            else:
-                siblings = [c for c in parent if c.tag == current.tag]
-                if len(siblings) == 1:
-                    parts.insert(0, f"/{current.tag}")
-                else:
-                    index = siblings.index(current) + 1
-                    parts.insert(0, f"/{current.tag}[{index}]")
-            current = parent
-        return "".join(parts) if parts else f"//{getattr(el, 'tag', 'div')}"
-
-    def analyze_html(self, html: str, prompt: str) -> str:
+    def analyze_html(
+        self,
+        html: str,
+        prompt: str,
+        snapshot: Optional[PageSnapshot] = None,
+        cancel: Optional[threading.Event] = None,
+        chunk: Optional[HtmlChunk] = None,
+        kind: str = "analysis",
+    ) -> str:
         """
         Анализирует ОДИН чанк ОЧИЩЕННОГО ВИДИМОГО HTML.
         Возвращает строку с JSON (как вернула модель).
-        """
-        interactive_summary = self._extract_with_lxml(html)
-        cleaned_html = self._clean_html(html)
 
-        max_chars = 60000
-        if len(cleaned_html) > max_chars:
-            cleaned_html = cleaned_html[:max_chars] + "\n[...TRUNCATED...]"
+        snapshot — снимок, из которого получен html; если передан, его
+        уже разобранное дерево переиспользуется без повторного парсинга
+        (для chunk — его locator_index() проверяет уникальность xpath).
+        cancel   — событие отмены (см. request).
+        chunk    — кусок страницы из PageSnapshot.html_chunks (вместо html).
+        kind     — роль запроса ("analysis" или "escalation").
+        """
+        if chunk is not None:
+            interactive_summary = self._extract_with_lxml(
+                chunk.html,
+                tree=chunk.tree,
+                origin=chunk.origin,
+                locators=snapshot.locator_index() if snapshot is not None else None,
+            )
+            cleaned_html = chunk.html
+            if chunk.path:
+                cleaned_html = f"[ANCESTOR PATH]: {chunk.path}\n{cleaned_html}"
+        else:
+            if snapshot is None:
+                snapshot = PageSnapshot(html)
+            interactive_summary = self._extract_with_lxml(
+                html,
+                tree=snapshot.visible_tree(),
+                origin=snapshot.visible_origin(),
+                locators=snapshot.locator_index(),
+            )
+            cleaned_html = snapshot.visible_html(max_chars=60000)
 
         system_prompt = self._get_analysis_system_prompt()
         user_message = f"ЗАДАЧА: {prompt}\n\n{interactive_summary}\n\n[HTML]:\n{cleaned_html}"
@@ -366,53 +756,163 @@ class AssistantAI:
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_message},
         ]
-        return self.request(messages)
+        return self.cached_request(
+            messages, cancel=cancel, response_format=self._response_format(kind), kind=kind
+        )
+
+    def _parse_analysis_hit(self, raw_response: str) -> Optional[dict]:
+        """JSON ответа анализатора, если в нём found=true и непустой elements, иначе None."""
+        try:
+            data = json.loads(raw_response)
+        except Exception:
+            self.parse_stats["analysis_failures"] += 1
+            return None
+        if not isinstance(data, dict):
+            return None
+        if data.get("found") and data.get("elements"):
+            return data
+        return None
 
     def analyze_html_chunked(
         self,
         html: str,
         prompt: str,
-        max_chunk_chars: int = 100000,
+        max_chunk_chars: int = 60000,
+        snapshot: Optional[PageSnapshot] = None,
+        max_concurrency: int = 4,
+        max_chunks: int = 0,
         **kwargs
     ) -> str:
         """
-        Режет большой HTML на чанки и по очереди вызывает analyze_html.
-        Как только находит found=true и непустой elements — возвращает этот результат.
-        Если нигде не найдено — возвращает found=false с описанием.
+        Делит видимую часть страницы на чанки по границам элементов
+        (PageSnapshot.html_chunks) и анализирует их параллельно
+        (не больше max_concurrency запросов одновременно).
+
+        Результат выбирается в порядке чанков: возвращается первый по порядку
+        чанк с found=true и непустым elements — как только все чанки до него
+        ответили "не найдено". Оставшиеся запросы отменяются: ещё не начатые
+        не отправляются, ожидающие после rate limit прерываются, а ответы уже
+        отправленных отбрасываются.
+        Если нигде не найдено и включена эскалация, анализ один раз повторяется
+        на модели планировщика; иначе возвращает found=false с описанием.
+
+        snapshot   — снимок страницы; если передан, чанки строятся по его полному
+                     дереву (html не используется), и xpath в них валидны для всей страницы.
+        max_chunks — сколько чанков анализировать не больше (0 — все); каждый чанк —
+                     отдельный запрос, поэтому на длинных страницах берутся самые
+                     подходящие к запросу (см. _select_chunks).
         """
-        if isinstance(html, bytes):
-            html = html.decode("utf-8", errors="replace")
-
-        chunks: List[str] = []
-        for i in range(0, len(html), max_chunk_chars):
-            chunks.append(html[i : i + max_chunk_chars])
-
+        if snapshot is None:
+            snapshot = PageSnapshot(html)
+        chunks = snapshot.html_chunks(max_chunk_chars)
+        if not chunks:
+            return json.dumps(
+                {"found": False, "elements": [], "page_context": "Страница пуста"},
+                ensure_ascii=False,
+            )
         total = len(chunks)
-        for idx, chunk_html in enumerate(chunks, start=1):
-            chunk_prompt = f"{prompt} (чанк {idx}/{total})"
-            raw_response = self.analyze_html(html=chunk_html, prompt=chunk_prompt)
-
-            try:
-                data = json.loads(raw_response)
-            except Exception:
-                continue
-
-            if not isinstance(data, dict):
-                continue
-
-            found = bool(data.get("found"))
-            elements = data.get("elements") or []
-
-            if found and elements:
-                meta = data.get("meta") or {}
-                meta["chunk_index"] = idx
-                meta["total_chunks"] = total
-                data["meta"] = meta
-                return json.dumps(data, ensure_ascii=False)
-
+        if max_chunks and total > max_chunks:
+            chunks = self._select_chunks(chunks, prompt, max_chunks)
+
+        # Индекс локаторов строится один раз, до раздачи чанков по потокам
+        snapshot.locator_index()
+        result = self._analyze_chunks(chunks, prompt, max_concurrency, kind="analysis", snapshot=snapshot)
+        if (
+            result is None
+            and self.escalate_analysis
+            and self.role_settings("escalation")["model"] != self.role_settings("analysis")["model"]
+        ):
+            print(f"🔁 get_details: повтор на модели {self.role_settings('escalation')['model']}")
+            result = self._analyze_chunks(chunks, prompt, max_concurrency, kind="escalation", snapshot=snapshot)
+        if result is not None:
+            return result
+
+        page_context = "Элемент по запросу не найден ни в одном чанке"
+        if len(chunks) < total:
+            page_context += f" (проанализировано {len(chunks)} из {total}, отобраны по словам запроса)"
         not_found = {
             "found": False,
             "elements": [],
-            "page_context": "Элемент по запросу не найден ни в одном чанке",
+            "page_context": page_context,
         }
         return json.dumps(not_found, ensure_ascii=False)
+
+    @staticmethod
+    def _select_chunks(chunks: List[HtmlChunk], prompt: str, max_chunks: int) -> List[HtmlChunk]:
+        """
+        max_chunks чанков, в которых встречается больше всего разных слов запроса
+        (в форме utils.resolver, вместе с атрибутами); при равенстве — более ранние.
+        Порядок документа сохраняется.
+        """
+        _, terms = parse_prompt(prompt)
+        wanted = set(terms)
+
+        def rank(item) -> tuple:
+            index, chunk = item
+            return -len(wanted.intersection(tokenize(chunk.html))), index
+
+        chosen = sorted(enumerate(chunks), key=rank)[:max_chunks]
+        return [chunk for _, chunk in sorted(chosen, key=lambda item: item[0])]
+
+    def _analyze_chunks(
+        self,
+        chunks: List[HtmlChunk],
+        prompt: str,
+        max_concurrency: int,
+        kind: str,
+        snapshot: Optional[PageSnapshot] = None,
+    ) -> Optional[str]:
+        """
+        Параллельный анализ чанков (см. analyze_html_chunked); None — ничего не найдено.
+        Ошибка запроса по чанку считается промахом этого чанка; исключение
+        пробрасывается, только если не удалось проанализировать ни один чанк.
+        """
+        total = len(chunks)
+        failures: List[Exception] = []
+        cancel = threading.Event()
+        pool = ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, total)))
+        try:
+            pending = {
+                pool.submit(
+                    self.analyze_html,
+                    html=chunk.html,
+                    prompt=f"{prompt} (чанк {idx}/{total})",
+                    snapshot=snapshot,
+                    cancel=cancel,
+                    chunk=chunk,
+                    kind=kind,
+                ): idx
+                for idx, chunk in enumerate(chunks, start=1)
+            }
+            done_by_idx = {}
+            next_idx = 1
+            while next_idx <= total:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    done_by_idx[pending.pop(future)] = future
+
+                # Чанки разбираются строго по порядку: ответ чанка idx важен,
+                # только когда все чанки до него ничего не нашли
+                while next_idx in done_by_idx:
+                    try:
+                        data = self._parse_analysis_hit(done_by_idx.pop(next_idx).result())
+                    except Exception as e:
+                        print(
+                            f"⚠️ get_details: чанк {next_idx}/{total} не проанализирован: "
+                            f"{type(e).__name__}: {e}"
+                        )
+                        failures.append(e)
+                        data = None
+                    if data is not None:
+                        meta = data.get("meta") or {}
+                        meta["chunk_index"] = next_idx
+                        meta["total_chunks"] = total
+                        data["meta"] = meta
+                        return json.dumps(data, ensure_ascii=False)
+                    next_idx += 1
+        finally:
+            cancel.set()
+            pool.shutdown(wait=False, cancel_futures=True)
+        if failures and len(failures) == total:
+            raise failures[-1]
+        return None
@@ -0,0 +1,120 @@
+from typing import Optional, List
+
+
+# Роли-обёртки: сами не выводятся, их дети поднимаются на уровень выше
+PASS_THROUGH_ROLES = {
+    "generic", "none", "presentation", "GenericContainer", "Section",
+    "LineBreak", "Ignored", "IframePresentational", "LayoutTable",
+    "LayoutTableRow", "LayoutTableCell", "paragraph", "group", "Div",
+}
+
+# Роли, которые выводятся всегда, даже без имени
+INTERACTIVE_ROLES = {
+    "button", "link", "checkbox", "radio", "textbox", "searchbox", "combobox",
+    "listbox", "option", "menuitem", "menuitemcheckbox", "menuitemradio", "tab",
+    "switch", "slider", "spinbutton", "row", "treeitem", "gridcell", "cell",
+}
+
+# Состояния, которые стоит показать модели
+STATE_PROPERTIES = ("checked", "selected", "expanded", "pressed", "disabled", "focused", "required")
+
+
+def _value(field: Optional[dict]):
+    if not isinstance(field, dict):
+        return None
+    return field.get("value")
+
+
+def _clip(text: str, limit: int = 80) -> str:
+    text = " ".join(str(text).split())
+    return text if len(text) <= limit else text[:limit] + "…"
+
+
+def node_id(node: dict) -> str:
+    """Стабильный id узла: backendDOMNodeId живёт столько же, сколько DOM-узел."""
+    backend_id = node.get("backendDOMNodeId")
+    return f"ax{backend_id}" if backend_id is not None else f"ax:{node.get('nodeId')}"
+
+
+def serialize_ax_tree(
+    nodes: List[dict],
+    max_chars: int = 30000,
+) -> str:
+    """
+    Сворачивает ответ Accessibility.getFullAXTree в компактный outline:
+
+        link "Спам" [ax123]
+          button "Удалить навсегда" [ax456] disabled
+
+    - игнорируемые узлы и обёртки (generic/none/...) не выводятся, их дети
+      поднимаются вверх;
+    - StaticText, повторяющий имя родителя, отбрасывается;
+    - неинтерактивные узлы без имени и без выведенных потомков отбрасываются.
+    """
+    if not nodes:
+        return "[empty accessibility tree]"
+
+    by_id = {node.get("nodeId"): node for node in nodes}
+    roots = [node for node in nodes if not node.get("parentId") or node.get("parentId") not in by_id]
+
+    lines: List[str] = []
+    size = 0
+    truncated = False
+
+    def describe(node: dict, role: str, name: str) -> str:
+        parts = [role]
+        if name:
+            parts.append(f'"{_clip(name)}"')
+        parts.append(f"[{node_id(node)}]")
+        value = _value(node.get("value"))
+        if value not in (None, "") and role != "StaticText":
+            parts.append(f'value="{_clip(value, 60)}"')
+        for prop in node.get("properties") or []:
+            prop_name = prop.get("name")
+            if prop_name not in STATE_PROPERTIES:
+                continue
+            prop_value = _value(prop.get("value"))
+            if prop_value in (None, False, "false"):
+                continue
+            parts.append(prop_name if prop_value in (True, "true") else f"{prop_name}={prop_value}")
+        return " ".join(parts)
+
+    def walk(node: dict, depth: int, parent_name: str) -> List[str]:
+        role = _value(node.get("role")) or ""
+        name = (_value(node.get("name")) or "").strip()
+
+        if role == "InlineTextBox":
+            return []
+
+        children: List[str] = []
+        emit = not node.get("ignored") and role not in PASS_THROUGH_ROLES
+        if role == "StaticText":
+            emit = bool(name) and name not in parent_name
+        child_depth = depth + 1 if emit else depth
+        for child_id in node.get("childIds") or []:
+            child = by_id.get(child_id)
+            if child is not None:
+                children.extend(walk(child, child_depth, name or parent_name))
+
+        if not emit:
+            return children
+        if role == "StaticText":
+            return ["  " * depth + f'text "{_clip(name, 120)}"']
+        if not name and not children and role not in INTERACTIVE_ROLES:
+            return []
+        return ["  " * depth + describe(node, role, name)] + children
+
+    for root in roots:
+        for line in walk(root, 0, ""):
+            if size + len(line) + 1 > max_chars:
+                truncated = True
+                break
+            lines.append(line)
+            size += len(line) + 1
+        if truncated:
+            break
+
+    outline = "\n".join(lines) if lines else "[empty accessibility tree]"
+    if truncated:
+        outline += "\n[...TRUNCATED...]"
+    return outline
@@ -1,15 +1,57 @@
+import json
 import time
-from typing import Optional, Literal, List
+from typing import Optional, Literal, List, Tuple, Union
 
 import undetected_chromedriver as uc
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.common.action_chains import ActionChains
+from selenium.webdriver.remote.webelement import WebElement
 from selenium.webdriver.chromium.options import ChromiumOptions
-from selenium.common.exceptions import TimeoutException, ElementClickInterceptedException
-
-from bs4 import BeautifulSoup, Comment, Tag
-from lxml import html as lxml_html
+from selenium.common.exceptions import (
+    TimeoutException,
+    ElementClickInterceptedException,
+    NoSuchElementException,
+    StaleElementReferenceException,
+)
+
+from utils.snapshot import (
+    PageSnapshot,
+    LocatorError,
+    describe_interactive,
+    normalize_whitespace,
+    truncate,
+)
+from utils.ax_tree import serialize_ax_tree
+from utils.page_state import budgeted_page_state
+from utils.page_scripts import (
+    DOM_OBSERVER_SCRIPT,
+    DOM_VERSION_SCRIPT,
+    EXTRACT_PAGE_STATE_SCRIPT,
+    STAMP_SELECTOR,
+    STAMP_ELEMENTS_SCRIPT,
+    STAMP_NODE_FUNCTION,
+    SETTLE_PROBE_SCRIPT,
+)
+from utils.network import NetworkTracker, BLOCK_PROFILES, blocked_patterns
+from utils.tracing import span, tracer, traced
+
+
+# Параметры ожидания "страница успокоилась" после каждого действия:
+# quiet_ms        — сколько DOM должен не меняться;
+# network_idle_ms — сколько в полёте должно быть не больше max_inflight запросов;
+# long_request_s  — запросы старше этого не ждём (long-polling, стримы);
+# timeout         — жёсткий потолок ожидания, сек;
+# element_timeout — ожидание элемента по xpath при click/enter, сек.
+DEFAULT_SETTLE_OPTIONS = {
+    "open": {"quiet_ms": 500, "network_idle_ms": 500, "max_inflight": 0,
+             "long_request_s": 5.0, "timeout": 15.0},
+    "click": {"quiet_ms": 300, "network_idle_ms": 300, "max_inflight": 0,
+              "long_request_s": 3.0, "timeout": 8.0, "element_timeout": 5.0},
+    "enter": {"quiet_ms": 150, "network_idle_ms": 0, "max_inflight": 0,
+              "long_request_s": 2.0, "timeout": 3.0, "element_timeout": 5.0},
+}
 
 
 class BrowserController:
@@ -23,72 +65,419 @@ class BrowserController:
         * get_html(raw=True)  — очищенный HTML (без скриптов/стилей);
         * get_visible_html()  — очищенный HTML ТОЛЬКО ВИДИМОЙ части страницы (для get_details/helper);
         * get_dom_chunk(...)  — выборка куска DOM по CSS/xpath.
+
+    page_state_backend — как строится get_html(raw=False):
+        * "python" — page_source + разбор lxml (видимость по inline-стилям);
+        * "js"     — один скрипт в странице (видимость по getComputedStyle/геометрии),
+                     по сети идёт только компактный JSON;
+        * "ax"     — дерево доступности Chrome (CDP Accessibility.getFullAXTree),
+                     свёрнутое в компактный outline со стабильными id узлов.
+    Задержка и объём переданных данных по каждому backend копятся в extraction_stats.
+
+    При каждом новом снимке интерактивные элементы получают короткий числовой
+    data-ba-id; click_element/enter принимают id=17 (или "ax123" из дерева
+    доступности) и находят элемент через кэш id → WebElement без ожиданий.
+    xpath перед передачей в Selenium проверяется по снимку: 0/несколько
+    совпадений или неинтерактивная цель сразу дают LocatorError с кандидатами.
+
+    После open/click/enter контроллер ждёт, пока страница "успокоится"
+    (wait_for_settle): DOM не меняется quiet_ms и сеть простаивает
+    network_idle_ms, но не дольше timeout. Параметры задаются по действиям
+    в settle_options (см. DEFAULT_SETTLE_OPTIONS), итог — в last_settle.
+
+    block_profile ("none" | "light" | "aggressive") отрезает ненужные агенту
+    ресурсы (картинки, медиа, шрифты, трекеры) через Network.setBlockedURLs;
+    block_allow — {домен: {категории}} исключения для отдельных сайтов.
+    page_load_strategy ("normal" | "eager" | "none") — когда driver.get отдаёт
+    управление; дальше страницу дожидается wait_for_settle.
+    Время загрузки страниц копится в page_load_stats по "профиль/стратегия".
+
+    page_state_budget (токены, backend "python") — вместо обрезки текста и
+    списка элементов по фиксированным лимитам get_html собирает состояние
+    по релевантности к query под этот бюджет (utils.page_state); остальное
+    доступно постранично: get_html(query=..., page=2). 0 — прежние лимиты.
     """
 
     def __init__(
         self,
         path_to_chrome: Optional[str] = None,
         default_timeout: int = 10,
+        page_state_backend: Literal["python", "js", "ax"] = "python",
+        settle_options: Optional[dict] = None,
+        block_profile: Literal["none", "light", "aggressive"] = "none",
+        block_allow: Optional[dict] = None,
+        page_load_strategy: Literal["normal", "eager", "none"] = "normal",
+        page_state_budget: int = 0,
     ):
+        if block_profile not in BLOCK_PROFILES:
+            raise ValueError(f"Unknown block profile: {block_profile!r}")
         self.driver = None
         self.path_to_chrome = path_to_chrome
         self.default_timeout = default_timeout
+        self.page_state_backend = page_state_backend
+        self.page_state_budget = page_state_budget
+        # (снимок, запрос), по которому ранжирована показанная страница 1 состояния
+        self._paged_query: Optional[tuple] = None
+        self.extraction_stats = {
+            backend: {"calls": 0, "seconds": 0.0, "bytes": 0}
+            for backend in ("python", "js", "ax")
+        }
+        self._snapshot: Optional[PageSnapshot] = None
+        self._snapshot_key: Optional[tuple] = None
+        self.snapshot_stats = {"hits": 0, "misses": 0}
+        # data-ba-id → WebElement для текущего документа
+        self._elements: dict[int, WebElement] = {}
+        self._elements_doc: Optional[str] = None
+        self.settle_options = {
+            action: {**defaults, **((settle_options or {}).get(action) or {})}
+            for action, defaults in DEFAULT_SETTLE_OPTIONS.items()
+        }
+        self.network = NetworkTracker()
+        self.last_settle: Optional[dict] = None
+        self.block_profile = block_profile
+        self.block_allow = block_allow or {}
+        self.page_load_strategy = page_load_strategy
+        self._blocked: Optional[List[str]] = None
+        self.page_load_stats: dict[str, dict] = {}
 
     def start_browser(self):
         """Запуск браузера с заданным бинарником (если указан)."""
         options = ChromiumOptions()
         if self.path_to_chrome:
             options.binary_location = self.path_to_chrome
+        # CDP-события Network.* попадают в performance-лог — по ним NetworkTracker
+        # считает запросы в полёте для wait_for_settle
+        options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+        options.page_load_strategy = self.page_load_strategy
 
         self.driver = uc.Chrome(options=options)
+        try:
+            # Счётчик поколений DOM ставится в каждый новый документ заранее
+            self.driver.execute_cdp_cmd(
+                "Page.addScriptToEvaluateOnNewDocument", {"source": DOM_OBSERVER_SCRIPT}
+            )
+        except Exception as e:
+            print(f"⚠️ Не удалось установить DOM-observer через CDP: {e}")
+        self._apply_blocking("")
         return self.driver
 
+    def _apply_blocking(self, url: str):
+        """
+        Применяет профиль блокировки для страницы url (CDP вызывается только при изменении).
+        Вызывается в open() до загрузки и в snapshot() — после переходов кликом/вводом.
+        """
+        patterns = blocked_patterns(self.block_profile, url, self.block_allow)
+        if patterns == self._blocked:
+            return
+        try:
+            if self._blocked is None:
+                self.driver.execute_cdp_cmd("Network.enable", {})
+            self.driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": patterns})
+            self._blocked = patterns
+        except Exception as e:
+            print(f"⚠️ Не удалось применить профиль блокировки '{self.block_profile}': {e}")
+
     def close_browser(self):
         """Закрытие браузера."""
         if self.driver:
             self.driver.quit()
             self.driver = None
+            self._snapshot = None
+            self._snapshot_key = None
+            self._paged_query = None
+            self._elements = {}
+            self._elements_doc = None
+            self.network.reset()
+            self._blocked = None
 
     def open(self, url: str):
         """Открытие страницы по URL."""
         if not self.driver:
             raise RuntimeError("Browser is not started. Call start_browser() first.")
-        self.driver.get(url)
+        with span("browser.open", url=url) as trace:
+            self._apply_blocking(url)
+            started = time.perf_counter()
+            self.driver.get(url)
+            loaded = time.perf_counter()
+            trace.set(get_ms=round((loaded - started) * 1000, 1))
+            self.wait_for_settle(**self._settle_kwargs("open"))
+
+        key = f"{self.block_profile}/{self.page_load_strategy}"
+        stats = self.page_load_stats.setdefault(
+            key, {"loads": 0, "get_seconds": 0.0, "settled_seconds": 0.0}
+        )
+        stats["loads"] += 1
+        stats["get_seconds"] += loaded - started
+        stats["settled_seconds"] += time.perf_counter() - started
 
-    def click_element(self, xpath: str, by: By = By.XPATH, **kwargs):
+    def click_element(
+        self,
+        xpath: Optional[str] = None,
+        by: By = By.XPATH,
+        id: Optional[Union[int, str]] = None,
+        **kwargs,
+    ):
         """
-        Клик по элементу.
+        Клик по элементу: по id (data-ba-id / "ax123") или по xpath.
 
         Возвращает None при успехе, либо Exception при ошибке.
         """
         if not self.driver:
             raise RuntimeError("Browser is not started. Call start_browser() first.")
 
-        try:
-            self._safe_click_element(xpath, by=by, timeout=kwargs.get("timeout"))
-        except Exception as err:
-            return err
+        with span("browser.click", id=id, xpath=xpath) as trace:
+            try:
+                self._safe_click_element(
+                    xpath, by=by, element_id=id,
+                    timeout=kwargs.get("timeout") or self.settle_options["click"].get("element_timeout"),
+                )
+            except Exception as err:
+                trace.set(error=f"{type(err).__name__}: {err}"[:300])
+                return err
+            self.wait_for_settle(**self._settle_kwargs("click"))
 
-    def enter(self, xpath: str, text: str, by: By = By.XPATH):
+    def enter(
+        self,
+        xpath: Optional[str] = None,
+        text: str = "",
+        by: By = By.XPATH,
+        id: Optional[Union[int, str]] = None,
+    ):
         """
-        Ввод текста в поле.
+        Ввод текста в поле: по id (data-ba-id / "ax123") или по xpath.
 
         Возвращает None при успехе, либо Exception при ошибке.
         """
         if not self.driver:
             raise RuntimeError("Browser is not started. Call start_browser() first.")
 
-        try:
-            self._safe_enter_text(xpath, text, by=by)
-        except Exception as err:
-            return err
+        with span("browser.enter", id=id, xpath=xpath, chars=len(text or "")) as trace:
+            try:
+                self._safe_enter_text(xpath, text, by=by, element_id=id)
+            except Exception as err:
+                trace.set(error=f"{type(err).__name__}: {err}"[:300])
+                return err
+            self.wait_for_settle(**self._settle_kwargs("enter"))
+
+    def wait_for_settle(
+        self,
+        quiet_ms: int = 300,
+        network_idle_ms: int = 300,
+        max_inflight: int = 0,
+        long_request_s: float = 5.0,
+        timeout: float = 10.0,
+        poll_interval: float = 0.1,
+    ) -> dict:
+        """
+        Ждёт, пока страница "успокоится": document не в состоянии loading,
+        DOM не менялся quiet_ms и запросов в полёте не больше max_inflight
+        уже network_idle_ms. Никогда не ждёт дольше timeout.
+
+        Возвращает {"settled", "waited", "dom_quiet_ms", "inflight"}; то же
+        сохраняется в self.last_settle.
+        """
+        with span("browser.settle") as trace:
+            started = time.monotonic()
+            deadline = started + timeout
+            idle_since: Optional[float] = None
+            dom_quiet_ms, inflight, settled = 0, 0, False
+
+            while True:
+                now = time.monotonic()
+                self.network.drain(self.driver)
+                inflight = self.network.inflight(long_request_s)
+                if inflight <= max_inflight:
+                    idle_since = idle_since if idle_since is not None else now
+                else:
+                    idle_since = None
+
+                try:
+                    dom_quiet_ms, ready_state = self.driver.execute_script(SETTLE_PROBE_SCRIPT)
+                except Exception:
+                    # Навигация в процессе — контекст страницы недоступен
+                    dom_quiet_ms, ready_state = 0, "loading"
+
+                if (
+                    ready_state != "loading"
+                    and dom_quiet_ms >= quiet_ms
+                    and idle_since is not None
+                    and (now - idle_since) * 1000 >= network_idle_ms
+                ):
+                    settled = True
+                    break
+                if now >= deadline:
+                    break
+                time.sleep(min(poll_interval, max(deadline - now, 0)))
+
+            self.last_settle = {
+                "settled": settled,
+                "waited": round(time.monotonic() - started, 3),
+                "dom_quiet_ms": dom_quiet_ms,
+                "inflight": inflight,
+            }
+            trace.set(settled=settled, inflight=inflight)
+        return self.last_settle
+
+    def _settle_kwargs(self, action: str) -> dict:
+        options = dict(self.settle_options.get(action) or {})
+        options.pop("element_timeout", None)
+        return options
 
     def get_raw_html(self) -> str:
         """Сырой HTML текущей страницы."""
         if not self.driver:
             return ""
-        return self.driver.page_source or ""
+        with span("browser.page_source") as trace:
+            html = self.driver.page_source or ""
+            if tracer.enabled:
+                trace.set(bytes=len(html.encode("utf-8")))
+        return html
+
+    def get_dom_version(self) -> Optional[tuple]:
+        """
+        Версия DOM одной дешёвой командой: (url, title, id документа, поколение).
+
+        Если observer ещё не стоял на странице, он ставится этим же вызовом
+        (и версия, соответственно, будет новой). None — версию узнать не удалось.
+        """
+        if not self.driver:
+            return None
+        try:
+            url, title, doc_id, generation = self.driver.execute_script(DOM_VERSION_SCRIPT)
+        except Exception:
+            return None
+        return (url or "").strip(), (title or "").strip(), doc_id, generation
+
+    @traced("browser.snapshot")
+    def snapshot(self) -> PageSnapshot:
+        """
+        Снимок текущего состояния страницы.
+
+        Пока URL, документ и поколение DOM не изменились, возвращается тот же
+        снимок — page_source повторно не запрашивается и не парсится.
+        """
+        version = self.get_dom_version()
+        if version is not None:
+            url, title, doc_id, generation = version
+            key = (url, doc_id, generation)
+            if self._snapshot is not None and self._snapshot_key == key:
+                self.snapshot_stats["hits"] += 1
+                return self._snapshot
+            # page_source запрашивается только если он действительно понадобится
+            html = None
+            self._stamp_elements(doc_id)
+        else:
+            # Фолбэк без счётчика: сравниваем сам page_source
+            key = None
+            html = self.get_raw_html()
+            if self._snapshot is not None and self._snapshot.html == html:
+                self.snapshot_stats["hits"] += 1
+                return self._snapshot
+            if self._stamp_elements(None):
+                html = self.get_raw_html()
+            url = (self.driver.current_url or "").strip() if self.driver else ""
+            title = (self.driver.title or "").strip() if self.driver else ""
+
+        self.snapshot_stats["misses"] += 1
+        # Переход по ссылке/форме/редиректу мог увести на другой домен — профиль по новому адресу
+        if self._blocked is not None:
+            self._apply_blocking(url)
+        self._snapshot = PageSnapshot(
+            html, url=url, title=title, html_loader=self.get_raw_html
+        )
+        self._snapshot_key = key
+        return self._snapshot
+
+    @property
+    def document_key(self) -> tuple:
+        """(url, документ) последнего снимка: data-ba-id элементов действительны, пока он тот же."""
+        if self._snapshot is None:
+            return ("", None)
+        return (self._snapshot.url, self._elements_doc)
+
+    def _stamp_elements(self, doc_id: Optional[str]) -> int:
+        """
+        Проставляет data-ba-id новым интерактивным элементам и кладёт их в кэш.
+
+        При смене документа кэш сбрасывается. Возвращает число новых элементов.
+        """
+        if doc_id is None or doc_id != self._elements_doc:
+            self._elements = {}
+            self._elements_doc = doc_id
+        try:
+            fresh = self.driver.execute_script(STAMP_ELEMENTS_SCRIPT, STAMP_SELECTOR) or []
+        except Exception:
+            return 0
+        for element_id, element in fresh:
+            self._elements[int(element_id)] = element
+        return len(fresh)
+
+    def resolve_element(self, element_id: Union[int, str], refresh: bool = False) -> WebElement:
+        """
+        WebElement по data-ba-id за O(1) через кэш.
+
+        element_id вида "ax123" (узел дерева доступности) сначала переводится
+        в data-ba-id через CDP. refresh=True — кэшированный элемент устарел,
+        ищем заново по атрибуту.
+        """
+        if isinstance(element_id, str) and element_id.startswith("ax"):
+            element_id = self._resolve_ax_node(element_id)
+        element_id = int(element_id)
+
+        element = None if refresh else self._elements.get(element_id)
+        if element is not None:
+            return element
+
+        found = self.driver.find_elements(By.CSS_SELECTOR, f'[data-ba-id="{element_id}"]')
+        if not found:
+            raise NoSuchElementException(
+                f"Element id={element_id} not found on the current page (page changed?)"
+            )
+        self._elements[element_id] = found[0]
+        return found[0]
 
+    def validate_xpath(self, xpath: str, action: Literal["click", "enter"] = "click") -> Optional[int]:
+        """
+        Проверка xpath по текущему снимку до обращения к Selenium.
+
+        Возвращает data-ba-id найденного элемента (или None, если у него нет id —
+        тогда кликаем по xpath). Бросает LocatorError, если цель не найдена,
+        неоднозначна или неинтерактивна.
+        """
+        try:
+            target = self.snapshot().resolve_xpath(xpath, action=action)
+        except LocatorError as err:
+            # page_source мог разойтись с живым DOM (shadow DOM, iframe, поздняя отрисовка):
+            # прежде чем отказать, одним запросом без ожидания проверяем сам браузер
+            if err.reason == "no_match" and self.driver.find_elements(By.XPATH, xpath):
+                return None
+            raise
+        element_id = target.get("data-ba-id")
+        return int(element_id) if element_id and element_id.isdigit() else None
+
+    def _resolve_ax_node(self, ax_id: str) -> int:
+        """data-ba-id DOM-узла по id из дерева доступности ("ax123" → backendNodeId 123)."""
+        try:
+            backend_node_id = int(ax_id[2:])
+            remote = self.driver.execute_cdp_cmd(
+                "DOM.resolveNode", {"backendNodeId": backend_node_id}
+            )
+            result = self.driver.execute_cdp_cmd(
+                "Runtime.callFunctionOn",
+                {
+                    "objectId": remote["object"]["objectId"],
+                    "functionDeclaration": STAMP_NODE_FUNCTION,
+                    "returnByValue": True,
+                },
+            )
+            element_id = result["result"]["value"]
+        except Exception as e:
+            raise NoSuchElementException(f"Accessibility node {ax_id} not found: {e}") from e
+        if element_id is None:
+            raise NoSuchElementException(f"Accessibility node {ax_id} is not an element")
+        return int(element_id)
+
+    @traced("browser.get_visible_html")
     def get_visible_html(self, max_chars: int = 150000) -> str:
         """
         Очищенный HTML ТОЛЬКО ВИДИМОЙ части страницы:
@@ -96,45 +485,15 @@ class BrowserController:
         - удалены комментарии;
         - удалены элементы с hidden/aria-hidden/display:none/visibility:hidden/opacity:0.
         """
-        html = self.get_raw_html()
-        if not html:
-            return ""
+        return self.snapshot().visible_html(max_chars=max_chars)
+
+    @property
+    def page_state_paged(self) -> bool:
+        """Состояние страницы набирается под бюджет и доступно порциями (get_html(page=...))."""
+        return self.page_state_backend == "python" and self.page_state_budget > 0
 
-        soup = BeautifulSoup(html, "html.parser")
-
-        for tag in soup.find_all(["script", "style", "noscript", "svg", "head"]):
-            tag.decompose()
-        for comment in soup.find_all(string=lambda t: isinstance(t, Comment)):
-            comment.extract()
-
-        to_remove: List[Tag] = []
-        for tag in soup.find_all(True):
-            if not isinstance(tag, Tag):
-                continue
-            attrs = tag.attrs if isinstance(getattr(tag, "attrs", None), dict) else {}
-            style_raw = attrs.get("style") or ""
-            style = style_raw.lower().replace(" ", "")
-            hidden_attr = "hidden" in attrs
-            aria_hidden = attrs.get("aria-hidden") == "true"
-            if (
-                hidden_attr
-                or aria_hidden
-                or "display:none" in style
-                or "visibility:hidden" in style
-                or "opacity:0" in style
-            ):
-                to_remove.append(tag)
-
-        for tag in to_remove:
-            tag.decompose()
-
-        cleaned = str(soup)
-        cleaned = self._normalize_whitespace(cleaned)
-        if len(cleaned) > max_chars:
-            cleaned = cleaned[:max_chars] + "\n[...TRUNCATED...]"
-        return cleaned
-
-    def get_html(self, raw: bool = False, max_chars: int = 60000) -> str:
+    @traced("browser.get_html")
+    def get_html(self, raw: bool = False, max_chars: int = 60000, query: str = "", page: int = 1) -> str:
         """
         Подготовленный HTML / текст для LLM.
 
@@ -143,6 +502,9 @@ class BrowserController:
             - компактный видимый текст
             - краткий список интерактивных элементов
           → используется как [CURRENT PAGE STATE] для планирующей модели.
+          При page_state_budget > 0 (backend "python") текст и элементы
+          ранжируются по релевантности к query и набираются под бюджет;
+          page — номер следующей порции для той же страницы и запроса.
 
         raw = True:
             - URL и заголовок
@@ -152,37 +514,68 @@ class BrowserController:
         if not self.driver:
             return ""
 
-        html = self.get_raw_html()
-        url = (self.driver.current_url or "").strip()
-        title = (self.driver.title or "").strip()
+        snapshot = self.snapshot()
+        url = snapshot.url
+        title = snapshot.title
 
         if raw:
-            cleaned = self._remove_scripts_and_styles(html)
-            cleaned = self._normalize_whitespace(cleaned)
-            if len(cleaned) > max_chars:
-                cleaned = cleaned[:max_chars] + "\n[...TRUNCATED...]"
+            cleaned = snapshot.cleaned_html(max_chars=max_chars)
             return f"{url}\n[TITLE]: {title}\n[HTML]:\n{cleaned}"
 
-        visible_text = self._extract_visible_text(html, max_chars=max_chars // 2)
-        interactive_summary = self._summarize_interactive_elements(
-            html, max_items=80, max_chars=max_chars // 2
-        )
+        started = time.perf_counter()
+        if self.page_state_backend == "ax":
+            outline, payload = self._page_state_ax(snapshot, max_chars=max_chars)
+            result_parts: List[str] = [
+                url,
+                f"[TITLE]: {title}",
+                "",
+                "[ACCESSIBILITY TREE]:",
+                outline,
+            ]
+        elif self.page_state_paged:
+            payload = 0 if snapshot.html_loaded else len(snapshot.html.encode("utf-8"))
+            # Страницы 2+ того же снимка ранжируются тем же запросом, что и страница 1,
+            # иначе порции берутся из разных ранжирований: повторы и пропуски
+            if page <= 1:
+                self._paged_query = (snapshot, query)
+            elif self._paged_query is not None and self._paged_query[0] is snapshot:
+                query = self._paged_query[1]
+            with span("browser.page_state_budget", page=page) as budget_span:
+                state = budgeted_page_state(snapshot, query, self.page_state_budget, page)
+                budget_span.set(chars=len(state))
+            result_parts = [url, f"[TITLE]: {title}", "", state]
+        else:
+            if self.page_state_backend == "js":
+                visible_text, interactive_summary, payload = self._page_state_js(
+                    snapshot, max_chars=max_chars
+                )
+            else:
+                payload = 0 if snapshot.html_loaded else len(snapshot.html.encode("utf-8"))
+                visible_text = snapshot.visible_text(max_chars=max_chars // 2)
+                interactive_summary = snapshot.interactive_summary(
+                    max_items=80, max_chars=max_chars // 2
+                )
+            result_parts = [
+                url,
+                f"[TITLE]: {title}",
+                "",
+                "[VISIBLE TEXT]:",
+                visible_text,
+                "",
+                "[INTERACTIVE ELEMENTS]:",
+                interactive_summary,
+            ]
+        stats = self.extraction_stats[self.page_state_backend]
+        stats["calls"] += 1
+        stats["seconds"] += time.perf_counter() - started
+        stats["bytes"] += payload
 
-        result_parts: List[str] = [
-            url,
-            f"[TITLE]: {title}",
-            "",
-            "[VISIBLE TEXT]:",
-            visible_text,
-            "",
-            "[INTERACTIVE ELEMENTS]:",
-            interactive_summary,
-        ]
         combined = "\n".join(result_parts)
         if len(combined) > max_chars:
             combined = combined[:max_chars] + "\n[...TRUNCATED...]"
         return combined
 
+    @traced("browser.get_dom_chunk")
     def get_dom_chunk(
         self,
         mode: Literal["css", "xpath"] = "css",
@@ -192,57 +585,108 @@ class BrowserController:
         """
         Возвращает фрагмент DOM (для функции get_dom_chunk).
 
-        mode="css"   — selector как CSS-селектор (BeautifulSoup).
-        mode="xpath" — selector как XPath (lxml).
+        mode="css"   — selector как CSS-селектор.
+        mode="xpath" — selector как XPath.
         """
-        html = self.get_raw_html()
-        if not html:
-            return ""
+        return self.snapshot().dom_chunk(mode=mode, selector=selector, max_chars=max_chars)
 
-        if mode == "css":
-            soup = BeautifulSoup(html, "html.parser")
-            nodes = soup.select(selector)
-            if not nodes:
-                return f"[DOM CHUNK] No elements for CSS selector: {selector}"
-            chunk_html = "".join(str(n) for n in nodes)
-        else:
-            try:
-                tree = lxml_html.fromstring(html)
-                nodes = tree.xpath(selector)
-            except Exception as e:
-                return f"[DOM CHUNK] XPath parse error: {e}"
-            if not nodes:
-                return f"[DOM CHUNK] No elements for XPath: {selector}"
-            chunk_html = "".join(
-                lxml_html.tostring(node, encoding="unicode") for node in nodes
-            )
+    def _page_state_js(
+        self,
+        snapshot: PageSnapshot,
+        max_chars: int = 60000,
+        max_items: int = 80,
+    ) -> Tuple[str, str, int]:
+        """
+        Видимый текст и список интерактивных элементов одним скриптом в странице.
+
+        Результат кэшируется в снимке; возвращает (текст, список, байт передано).
+        """
+        payload = 0
+
+        def run():
+            nonlocal payload
+            data = self.driver.execute_script(
+                EXTRACT_PAGE_STATE_SCRIPT, max_items, max_chars // 2
+            ) or {}
+            payload = len(json.dumps(data, ensure_ascii=False).encode("utf-8"))
+            return data
 
-        cleaned = self._remove_scripts_and_styles(chunk_html)
-        cleaned = self._normalize_whitespace(cleaned)
-        if len(cleaned) > max_chars:
-            cleaned = cleaned[:max_chars] + "\n[...TRUNCATED...]"
+        data = snapshot.memoize(("js_state", max_items, max_chars), run)
+
+        visible_text = truncate(
+            normalize_whitespace(" ".join(data.get("text") or [])), max_chars // 2, sep=" "
+        )
+        lines: List[str] = []
+        for item in data.get("interactive") or []:
+            line = describe_interactive(item.get("kind", "ELEMENT"), item)
+            if line:
+                lines.append(line)
+        summary = "\n".join(lines) if lines else "[no interactive elements summary]"
+        return visible_text, truncate(summary, max_chars // 2), payload
 
-        return f"[DOM CHUNK mode={mode} selector={selector}]:\n{cleaned}"
+    def _page_state_ax(
+        self,
+        snapshot: PageSnapshot,
+        max_chars: int = 60000,
+    ) -> Tuple[str, int]:
+        """
+        Дерево доступности страницы одной CDP-командой, свёрнутое в outline.
 
-    def _safe_click_element(self, selector, by=By.XPATH, **kwargs):
+        Результат кэшируется в снимке; возвращает (outline, байт передано).
+        """
+        payload = 0
+
+        def run():
+            nonlocal payload
+            response = self.driver.execute_cdp_cmd("Accessibility.getFullAXTree", {}) or {}
+            payload = len(json.dumps(response, ensure_ascii=False).encode("utf-8"))
+            return serialize_ax_tree(response.get("nodes") or [], max_chars=max_chars)
+
+        outline = snapshot.memoize(("ax_tree", max_chars), run)
+        return outline, payload
+
+    def _safe_click_element(self, selector, by=By.XPATH, element_id=None, **kwargs):
         """
         Клик по элементу.
 
         :param selector: XPath-селектор или другой идентификатор
         :param by: тип селектора (по умолчанию XPath)
+        :param element_id: data-ba-id элемента; если задан, selector — запасной вариант
         """
-        wait_element = WebDriverWait(self.driver, 10)
+        if element_id is None and selector and by == By.XPATH:
+            element_id = self.validate_xpath(selector, action="click")
+
+        if element_id is not None:
+            try:
+                element = self.resolve_element(element_id)
+                try:
+                    self._click_with_fallbacks(element, f"id={element_id}")
+                except StaleElementReferenceException:
+                    element = self.resolve_element(element_id, refresh=True)
+                    self._click_with_fallbacks(element, f"id={element_id}")
+                return
+            except Exception:
+                if not selector:
+                    raise
+
+        wait_element = WebDriverWait(self.driver, kwargs.get("timeout") or self.default_timeout)
         try:
-            element = wait_element.until(
-                EC.element_to_be_clickable((by, selector))
-            )
+            with span("browser.wait_element", selector=selector, condition="clickable"):
+                element = wait_element.until(
+                    EC.element_to_be_clickable((by, selector))
+                )
         except TimeoutException as e:
             # Элемент так и не стал кликабельным
             raise TimeoutException(f"Element not clickable by {by}='{selector}'") from e
 
+        self._click_with_fallbacks(element, f"{by}='{selector}'")
+
+    def _click_with_fallbacks(self, element: WebElement, description: str):
         try:
             # Обычный клик
             element.click()
+        except StaleElementReferenceException:
+            raise
         except (ElementClickInterceptedException, Exception):
             # Фолбэки для сложных SPA (типа Яндекс Лавки)
             try:
@@ -257,82 +701,56 @@ class BrowserController:
                 except Exception:
                     # 3) Жёсткий JS-клик
                     self.driver.execute_script("arguments[0].click();", element)
+            except StaleElementReferenceException:
+                raise
             except Exception as e:
                 raise ElementClickInterceptedException(
-                    f"Failed to click element by {by}='{selector}' even with JS fallback: {e}"
+                    f"Failed to click element by {description} even with JS fallback: {e}"
                 )
 
     def _safe_enter_text(
         self,
-        selector: str,
+        selector: Optional[str],
         text: str,
         by: By = By.XPATH,
+        element_id=None,
     ):
         """Ожидает поле ввода и печатает в него текст."""
-        wait = WebDriverWait(self.driver, self.default_timeout)
+        if element_id is None and selector and by == By.XPATH:
+            element_id = self.validate_xpath(selector, action="enter")
+
+        if element_id is not None:
+            try:
+                element = self.resolve_element(element_id)
+                try:
+                    element.clear()
+                except StaleElementReferenceException:
+                    element = self.resolve_element(element_id, refresh=True)
+                    element.clear()
+                element.send_keys(text)
+                return
+            except Exception:
+                if not selector:
+                    raise
+
+        wait = WebDriverWait(
+            self.driver, self.settle_options["enter"].get("element_timeout") or self.default_timeout
+        )
         try:
-            element = wait.until(EC.presence_of_element_located((by, selector)))
+            with span("browser.wait_element", selector=selector, condition="present"):
+                element = wait.until(EC.presence_of_element_located((by, selector)))
             element.clear()
             element.send_keys(text)
         except TimeoutException as e:
             raise TimeoutException(f"Input element not found by {by}='{selector}'") from e
 
-    @staticmethod
-    def _remove_scripts_and_styles(html: str) -> str:
-        """Удаляет script/style/noscript/svg/head и комментарии."""
-        soup = BeautifulSoup(html, "html.parser")
-
-        for tag in soup.find_all(["script", "style", "noscript", "svg", "head"]):
-            tag.decompose()
-
-        for comment in soup.find_all(string=lambda t: isinstance(t, Comment)):
-            comment.extract()
-
-        return str(soup)
-
-    @staticmethod
-    def _normalize_whitespace(text: str) -> str:
-        return " ".join(text.split())
-
     def _extract_visible_text(self, html: str, max_chars: int = 20000) -> str:
         """
         Извлекает видимый текст страницы:
         - удаляет мусорные теги и комментарии;
         - убирает заведомо скрытые элементы (hidden, aria-hidden, display:none и т.п.).
         """
-        soup = BeautifulSoup(html, "html.parser")
-
-        for tag in soup.find_all(["script", "style", "noscript", "svg", "head"]):
-            tag.decompose()
-        for comment in soup.find_all(string=lambda t: isinstance(t, Comment)):
-            comment.extract()
-
-        to_remove: List[Tag] = []
-        for tag in soup.find_all(True):
-            if not isinstance(tag, Tag):
-                continue
-            attrs = tag.attrs if isinstance(getattr(tag, "attrs", None), dict) else {}
-            style_raw = attrs.get("style") or ""
-            style = style_raw.lower().replace(" ", "")
-            hidden_attr = "hidden" in attrs
-            aria_hidden = attrs.get("aria-hidden") == "true"
-            if (
-                hidden_attr
-                or aria_hidden
-                or "display:none" in style
-                or "visibility:hidden" in style
-                or "opacity:0" in style
-            ):
-                to_remove.append(tag)
-
-        for tag in to_remove:
-            tag.decompose()
-
-        text = soup.get_text(separator=" ", strip=True)
-        text = self._normalize_whitespace(text)
-        if len(text) > max_chars:
-            text = text[:max_chars] + " [...TRUNCATED...]"
-        return text
+        return PageSnapshot(html).visible_text(max_chars=max_chars)
 
     def _summarize_interactive_elements(
         self,
@@ -340,76 +758,5 @@ class BrowserController:
         max_items: int = 80,
         max_chars: int = 20000,
     ) -> str:
-        """
-        Краткий список интерактивных элементов:
-        - ссылки <a>
-        - кнопки <button>
-        - элементы с role=button/link/checkbox/tab/menuitem/row/option
-        - элементы с data-tooltip / data-label
-        """
-        soup = BeautifulSoup(html, "html.parser")
-        lines: List[str] = []
-
-        def add_line(prefix: str, tag):
-            desc_parts = []
-
-            text = (tag.get_text(strip=True) or "")[:80]
-            aria = (tag.get("aria-label") or "")[:80]
-            tooltip = (tag.get("data-tooltip") or "")[:80]
-            label = (tag.get("data-label") or "")[:80]
-            title = (tag.get("title") or "")[:80]
-            href = (tag.get("href") or "")[:120]
-
-            if aria:
-                desc_parts.append(f"aria={aria}")
-            if tooltip:
-                desc_parts.append(f"tooltip={tooltip}")
-            if label:
-                desc_parts.append(f"label={label}")
-            if title:
-                desc_parts.append(f"title={title}")
-            if text and text not in (aria, tooltip, label, title):
-                desc_parts.append(f"text={text}")
-            if href:
-                desc_parts.append(f"href={href}")
-
-            if not desc_parts:
-                return
-
-            desc = " | ".join(desc_parts)
-            lines.append(f"{prefix}: {desc}")
-
-        # Ссылки
-        for a in soup.find_all("a"):
-            if len(lines) >= max_items:
-                break
-            add_line("LINK", a)
-
-        for btn in soup.find_all("button"):
-            if len(lines) >= max_items:
-                break
-            add_line("BUTTON", btn)
-
-        roles = ["button", "link", "checkbox", "tab", "menuitem", "row", "option"]
-        for role in roles:
-            for el in soup.find_all(attrs={"role": role}):
-                if len(lines) >= max_items:
-                    break
-                add_line(f"ROLE[{role}]", el)
-            if len(lines) >= max_items:
-                break
-
-        for el in soup.find_all(attrs={"data-tooltip": True}):
-            if len(lines) >= max_items:
-                break
-            add_line("TOOLTIP", el)
-
-        for el in soup.find_all(attrs={"data-label": True}):
-            if len(lines) >= max_items:
-                break
-            add_line("LABEL", el)
-
-        summary = "\n".join(lines) if lines else "[no interactive elements summary]"
-        if len(summary) > max_chars:
-            summary = summary[:max_chars] + "\n[...TRUNCATED...]"
-        return summary
+        """Краткий список интерактивных элементов (см. PageSnapshot.interactive_summary)."""
+        return PageSnapshot(html).interactive_summary(max_items=max_items, max_chars=max_chars)
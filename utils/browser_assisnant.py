@@ -1,19 +1,123 @@
 import json
 import re
+import time
+from typing import Tuple
 
 from utils.browser import BrowserController
-from utils.assistant import AssistantAI
+from utils.network import parse_allow_list
+from utils.snapshot import LocatorError
+from utils.assistant import AssistantAI, REQUEST_ERRORS
+from utils.llm_cache import LLMCache
+from utils.history import HistoryManager, PageStateInterner
+from utils.rate_limit import RateLimiter
+from utils.plan_stream import PlanStreamParser
+from utils.replay import ReplayStore
+from utils.resolver import ElementResolver
+from utils.locator_store import LocatorStore
+from utils.tracing import span, configure as configure_tracing
 import models.models as models
 
 
+# Сколько шагов кандидат get_details ждёт click/enter по своему элементу
+PENDING_LOCATOR_STEPS = 3
+
+# Сообщение модели после status="error"
+SYSTEM_RETRY_PROMPT = """[SYSTEM RETRY {attempt}/{limit}]
+Предыдущая ошибка: {error}
+ОБЯЗАТЕЛЬНО выполни get_details для анализа текущей страницы:
+{{
+  "function": "get_details",
+  "args": {{"prompt": "Опиши, что сейчас на странице. Найди все интерактивные элементы."}},
+  "reason": "Анализ после ошибки"
+}}
+Верни status="in_progress" с action_sequence."""
+
+
 class BrowserAssistant:
     def __init__(self, config, path_to_chrome: str = None):
+        # Трассировка шагов (пустые пути — выключена, накладных расходов нет)
+        configure_tracing(config.trace_path, config.trace_chrome_path)
         self.browser_controller = BrowserController(
-            path_to_chrome=path_to_chrome
+            path_to_chrome=path_to_chrome,
+            page_state_backend=config.page_state_backend,
+            block_profile=config.block_profile,
+            block_allow=parse_allow_list(config.block_allow),
+            page_load_strategy=config.page_load_strategy,
+            page_state_budget=config.page_state_budget_tokens,
         )
         self.assistant = AssistantAI(
             api_key=config.open_ai_token,
             model=config.model,
+            cache=LLMCache(
+                path=config.llm_cache_path or None,
+                ttl=config.llm_cache_ttl,
+                max_disk_bytes=config.llm_cache_max_mb * 1024 * 1024,
+            ),
+            history_manager=HistoryManager(max_tokens=config.history_max_tokens),
+            structured_output=config.structured_output,
+            roles={
+                role: {
+                    "model": getattr(config, f"{role}_model"),
+                    "max_tokens": getattr(config, f"{role}_max_tokens"),
+                    "temperature": getattr(config, f"{role}_temperature"),
+                }
+                for role in ("plan", "analysis", "helper")
+            },
+            escalate_analysis=config.analysis_escalate,
+            rate_limits={
+                "requests_per_minute": config.rate_limit_rpm,
+                "tokens_per_minute": config.rate_limit_tpm,
+            },
+            max_attempts=config.request_max_attempts,
+            request_deadline=config.request_deadline,
+            transport={
+                "proxy": config.openai_proxy,
+                "http2": config.openai_http2,
+                "max_connections": config.openai_max_connections,
+                "max_keepalive_connections": config.openai_max_keepalive,
+                "keepalive_expiry": config.openai_keepalive_expiry,
+                "connect_timeout": config.openai_connect_timeout,
+                "read_timeout": config.openai_read_timeout,
+                "write_timeout": config.openai_write_timeout,
+                "pool_timeout": config.openai_pool_timeout,
+            },
+            base_url=config.openai_base_url or None,
+            replay=(
+                ReplayStore(config.replay_path, mode=config.replay_mode, replay_latency=config.replay_latency)
+                if config.replay_mode != "off" else None
+            ),
+            paged_state=self.browser_controller.page_state_paged,
+        )
+        # Невалидные ответы планировщика: каждый стоит лишнего запроса к модели
+        self.parse_stats = {
+            "replies": 0,
+            "parse_failures": 0,
+            "wasted_round_trips": 0,
+            "wasted_seconds": 0.0,
+        }
+        # Одинаковые/почти одинаковые состояния страницы не отправляются повторно
+        self.page_states = PageStateInterner()
+        # Запрос, по которому ранжируется состояние страницы: цель модели + последнее сообщение пользователя
+        self.page_goal = ""
+        self.page_user_message = ""
+        # Потоковый режим: действия плана исполняются, пока модель ещё дописывает ответ
+        self.stream_plan = config.stream_plan
+        self.get_details_max_chunks = config.get_details_max_chunks
+        self.plan_stats = {
+            "replies": 0,
+            "streamed_actions": 0,
+            "first_action_seconds": 0.0,
+            "first_action_count": 0,
+        }
+        # Локаторы, сработавшие в прошлых сессиях: (домен, намерение) → локатор + отпечаток
+        self.locator_store = LocatorStore(config.locator_store_path) if config.locator_store_path else None
+        # Найденные get_details элементы до click/enter по ним: ("id"/"xpath", значение) →
+        # {candidate, from_store, document, step}; живут, пока тот же документ, но не дольше PENDING_LOCATOR_STEPS
+        self._pending_locators: dict = {}
+        self._step = 0
+        # get_details сначала пробует локальный поиск по снимку — без запроса к модели
+        self.resolver = (
+            ElementResolver(min_confidence=config.resolver_min_confidence) if config.local_resolver else None
         )
 
     def _fix_trailing_commas(self, text: str) -> str:
@@ -23,217 +127,404 @@ class BrowserAssistant:
         """
         return re.sub(r',(\s*[\]}])', r'\1', text)
 
-    def start(self):
-        self.browser_controller.start_browser()
-
-        model: models.AssistantResponse | None = None
-        error_retries = 0
-        max_error_retries = 5
+    def _locator_error_hint(self, error: Exception) -> str:
+        """Подсказка модели после неудачной проверки локатора."""
+        if not isinstance(error, LocatorError):
+            return ""
+        if error.candidates:
+            return (
+                "[SYSTEM] Этот xpath не подходит для текущей страницы. Используй id одного из "
+                "candidates выше (args {\"id\": N}) или вызови get_details с другим запросом "
+                "(по тексту/aria-label/data-tooltip).\n"
+            )
+        return (
+            "[SYSTEM] Этот xpath не подходит для текущей страницы и похожих элементов нет. "
+            "Вызови get_details с другим запросом.\n"
+        )
 
+    def _page_state(self) -> str:
+        """
+        Состояние текущей страницы для модели: полный блок [PAGE STATE #N],
+        либо [PAGE UNCHANGED since step N] / [PAGE DIFF] (см. utils.history).
+        """
+        snapshot = self.browser_controller.snapshot()
+        state = self.browser_controller.get_html(query=self._page_query())
+        return self.page_states.render(state, snapshot.url, snapshot.title)
+
+    def _remember_locator(self, snapshot, prompt: str, element: dict, from_store: bool):
+        """Запоминает найденный get_details элемент до исхода click/enter по нему."""
+        if self.locator_store is None:
+            return
+        candidate = self.locator_store.candidate(snapshot, prompt, element)
+        if candidate is None:
+            return
+        pending = {
+            "candidate": candidate,
+            "from_store": from_store,
+            "document": self.browser_controller.document_key,
+            "step": self._step,
+        }
+        for kind in ("id", "xpath"):
+            if element.get(kind) is not None:
+                self._pending_locators[(kind, str(element[kind]))] = pending
+
+    def _expire_pending_locators(self):
+        """Убирает кандидатов с другого документа (id там значат другое) и слишком старых."""
+        document = self.browser_controller.document_key
+        self._pending_locators = {
+            key: pending for key, pending in self._pending_locators.items()
+            if pending["document"] == document and self._step - pending["step"] < PENDING_LOCATOR_STEPS
+        }
+
+    def _learn_locator(self, args: dict, ok: bool, document: tuple):
+        """
+        Исход click/enter в документе document: удачный локатор сохраняется,
+        неудачный из хранилища — удаляется.
+        """
+        if self.locator_store is None:
+            return
+        kind = "id" if args.get("id") is not None else "xpath"
+        key = (kind, str(args.get(kind)))
+        pending = self._pending_locators.get(key)
+        if pending is None or pending["document"] != document:
+            return
+        del self._pending_locators[key]
+        candidate, from_store = pending["candidate"], pending["from_store"]
+        if ok:
+            self.locator_store.record(**candidate)
+        elif from_store:
+            self.locator_store.evict(candidate["domain"], candidate["intent"])
+
+    def _page_query(self) -> str:
+        return f"{self.page_goal} {self.page_user_message}".strip()
+
+    @staticmethod
+    def _input(prompt: str) -> str:
+        # Ожидание пользователя отдельным span — чтобы не путать его с работой агента
+        with span("user.input"):
+            return input(prompt)
+
+    def _execute_action(self, action: models.NextAction) -> str:
+        """Выполняет одно действие плана и возвращает текст результата для модели."""
+        with span("agent.action", function=action.function):
+            return self._run_action(action)
+
+    def _run_action(self, action: models.NextAction) -> str:
         msg = ""
-        failed_xpaths: dict[str, int] = {}
-        max_xpath_retries = 2
+        print(f"▶️ {action.function} | {action.reason if action.reason else '...'}")
+
+        try:
+            if action.function == "open":
+                self.browser_controller.open(**action.args)
+                msg += f"\n[PAGE LOADED]: {self.browser_controller.driver.current_url}\n"
+                msg += self._page_state()
+
+            elif action.function == "click":
+                document = self.browser_controller.document_key
+                error = self.browser_controller.click_element(**action.args)
+                self._learn_locator(action.args, ok=error is None, document=document)
+                if error:
+                    msg += f"\n[CLICK ERROR]: {error}\n"
+                    msg += self._locator_error_hint(error)
+                else:
+                    msg += f"\n[CLICK OK]: {action.args}\n"
+                    msg += self._page_state()
+
+            elif action.function == "enter":
+                document = self.browser_controller.document_key
+                error = self.browser_controller.enter(**action.args)
+                self._learn_locator(action.args, ok=error is None, document=document)
+                if error:
+                    msg += f"\n[ENTER ERROR]: {error}\n"
+                    msg += self._locator_error_hint(error)
+                else:
+                    msg += f"\n[ENTER OK]: {action.args}\n"
+                    msg += self._page_state()
+
+            elif action.function == "get":
+                html = self.browser_controller.get_html(raw=True)
+                msg += f"\n[FULL HTML]:\n{html}\n"
+
+            elif action.function == "get_page_state":
+                page = int(action.args.get("page") or 2)
+                if not self.browser_controller.page_state_paged:
+                    # Без бюджета порций нет: [CURRENT PAGE STATE] уже содержит всё, что выводится
+                    msg += (
+                        "\n[SYSTEM] get_page_state недоступен: состояние страницы не делится на порции "
+                        "(page_state_budget_tokens=0 или backend не python). "
+                        "[CURRENT PAGE STATE] уже полный — используй get_details для поиска элемента.\n"
+                    )
+                else:
+                    state = self.browser_controller.get_html(query=self._page_query(), page=page)
+                    msg += f"\n[PAGE STATE PAGE {page}]:\n{state}\n"
+
+            elif action.function == "get_dom_chunk":
+                chunk = self.browser_controller.get_dom_chunk(**action.args)
+                msg += f"\n[DOM CHUNK]:\n{chunk}\n"
+
+            elif action.function == "get_details":
+                snapshot = self.browser_controller.snapshot()
+                prompt = action.args.get("prompt", "")
+                result = None
+                from_store = False
+                if self.locator_store is not None:
+                    with span("locator_store.lookup") as store_span:
+                        result = self.locator_store.resolve(snapshot, prompt)
+                        store_span.set(hit=result is not None)
+                    if result is not None:
+                        from_store = True
+                        print(f"📚 Локатор из хранилища сайта: {self.locator_store.stats['hits']} попаданий")
+                if result is None and self.resolver is not None:
+                    # Итоги — в resolver.stats и в трейсе
+                    with span("resolver.local") as resolver_span:
+                        result = self.resolver.resolve(snapshot, prompt)
+                        resolver_span.set(hit=result is not None)
+                if result is None:
+                    result = self.assistant.analyze_html_chunked(
+                        html="",
+                        max_chunk_chars=60000,
+                        max_chunks=self.get_details_max_chunks,
+                        snapshot=snapshot,
+                        **action.args,
+                    )
+
+                msg += f"\n[GET_DETAILS RESULT]:\n{result}\n"
 
-        while True:
-            current_state = self.browser_controller.get_html()
-            user_input = ""
-
-            if model and model.missing_data and len(model.missing_data) > 0:
-                print("📝 Требуется ввод данных:")
-                for item in model.missing_data:
-                    print(f" - {item.question}")
-                user_input = input("\n(enter `q` to exit)>>> ")
-                if user_input.lower() == "q":
-                    self.browser_controller.close_browser()
-                    break
-
-                fields = ", ".join(m.field for m in model.missing_data)
-                msg = (
-                    f"Пользователь ввёл данные для полей: {fields}. "
-                    f"Сырый ответ пользователя: {user_input}"
+                try:
+                    data = json.loads(result)
+                except Exception as e:
+                    msg += f"\n[SYSTEM] Не удалось распарсить JSON get_details: {e}\n"
+                else:
+                    found = bool(data.get("found"))
+                    elements = data.get("elements") or []
+                    if found and elements:
+                        best = elements[0]
+                        self._remember_locator(snapshot, prompt, best, from_store)
+                        xpath = best.get("xpath")
+                        element_id = best.get("id")
+                        locator = (
+                            f'id: {element_id} (args {{"id": {element_id}}})'
+                            if element_id is not None else f"xpath: {xpath}"
+                        )
+                        action_type = (best.get("action") or "click").lower()
+                        msg += (
+                            "\n[SYSTEM] get_details нашёл подходящий элемент.\n"
+                            "В СЛЕДУЮЩЕМ ОТВЕТЕ ОБЯЗАТЕЛЬНО добавь в action_sequence "
+                            f"ПЕРВЫМ действием функцию \"{action_type}\" с этим {locator}.\n"
+                            "НЕ вызывай get_details ещё раз для этой же подзадачи и НЕ ставь status=\"error\".\n"
+                        )
+                    else:
+                        msg += (
+                            "\n[SYSTEM] get_details НЕ нашёл элемент по запросу.\n"
+                            "НЕ ставь status=\"error\". Выполни ещё один get_details с более точным "
+                            "или другим prompt, либо измени стратегию (другая часть страницы).\n"
+                        )
+                msg += (
+                    "\n[SYSTEM] ОБЯЗАТЕЛЬНО используй id (или xpath) из [GET_DETAILS RESULT] выше, "
+                    "если found=true!\n"
                 )
-                error_retries = 0
 
-            elif model is None or model.status in ["done", "error"]:
-                if model and model.status == "done":
-                    print(f"✅ Задача выполнена: {model.current_goal}")
-                    user_input = input("Скажите, что делать далее: ")
-                    continue
+            elif action.function == "helper":
+                visible_html = self.browser_controller.get_visible_html()
+                helper_prompt = action.args.get("prompt", "")
+                extra = action.args.get("extra")
 
-                if model and model.status == "error":
-                    error_retries += 1
-                    print(f"⚠️ Ошибка ({error_retries}/{max_error_retries}): {model.current_goal}")
-                    if error_retries >= max_error_retries:
-                        print("❌ Лимит попыток исчерпан")
-                        break
-
-                    msg = f"""[SYSTEM RETRY {error_retries}/{max_error_retries}]
-Предыдущая ошибка: {model.current_goal}
-ОБЯЗАТЕЛЬНО выполни get_details для анализа текущей страницы:
-{{
-  "function": "get_details",
-  "args": {{"prompt": "Опиши, что сейчас на странице. Найди все интерактивные элементы."}},
-  "reason": "Анализ после ошибки"
-}}
-Верни status="in_progress" с action_sequence."""
-                else:
-                    user_input = input("(enter `q` to exit)>>> ")
-                    if user_input.lower() == "q":
-                        self.browser_controller.close_browser()
-                        break
-                    msg = user_input
-                    error_retries = 0
+                result = self.assistant.call_helper(
+                    helper_prompt=helper_prompt,
+                    html=visible_html,
+                    extra=extra,
+                )
+                msg += f"\n[HELPER RESULT]:\n{result}\n"
 
-            if msg:
-                full_message = f"{msg}\n\n[CURRENT PAGE STATE]:\n{current_state}"
-            else:
-                full_message = f"[CURRENT PAGE STATE]:\n{current_state}"
+            elif action.function == "save_response":
+                self.assistant.save_response(**action.args)
+                msg += f"\n[SAVED]: {action.args.get('msg', '')[:100]}\n"
 
-            response = self.assistant.chat(full_message)
-            msg = ""
+            elif action.function == "delete_response":
+                self.assistant.delete_response(**action.args)
+                msg += "\n[DELETED]\n"
 
-            cleaned_response = self._fix_trailing_commas(response)
+            elif action.function == 'waiting_user_input':
+                msg += f'user input: {self._input("")}'
 
-            try:
-                model = models.AssistantResponse.model_validate_json(cleaned_response)
-            except Exception as e:
-                print(f"❌ Ошибка парсинга: {e}")
-                msg = (
-                    "[SYSTEM] Ошибка парсинга JSON. Убери висячие запятые и другие "
-                    "некорректные конструкции. Верни ВАЛИДНЫЙ JSON по описанию в промте."
-                )
-                continue
+            else:
+                msg += f"\n[UNKNOWN FUNCTION]: {action.function}\n"
 
-            if model.missing_data and len(model.missing_data) > 0:
-                continue
+        except Exception as e:
+            msg += f"\n[EXCEPTION in {action.function}]: {e}\n"
+            print(f"❌ Exception: {e}")
+        return msg
 
-            if not model.action_sequence:
-                continue
+    def _chat_streaming(self, full_message: str) -> Tuple[str, str, int]:
+        """
+        Запрашивает план в режиме stream и исполняет действия по мере того,
+        как закрываются их JSON-объекты. На лету исполняется только префикс
+        плана и только если status="in_progress" пришёл раньше первого действия;
+        остальное выполняется обычным путём после разбора всего ответа.
 
-            for action in model.action_sequence:
-                print(f"▶️ {action.function} | {action.reason if action.reason else '...'}")
+        Возвращает (полный ответ, результаты исполненных действий, их число).
+        """
+        parser = PlanStreamParser()
+        msg = ""
+        executed = 0
+        streaming = True
+        started = time.perf_counter()
 
+        for delta in self.assistant.chat_stream(full_message):
+            for data in parser.feed(delta):
+                if not streaming:
+                    continue
+                if data is None or parser.status_late or parser.status != "in_progress":
+                    streaming = False
+                    continue
                 try:
-                    if action.function == "open":
-                        self.browser_controller.open(**action.args)
-                        msg += f"\n[PAGE LOADED]: {self.browser_controller.driver.current_url}\n"
-                        msg += self.browser_controller.get_html()
-
-                    elif action.function == "click":
-                        xpath = action.args.get("xpath", "")
-
-                        if xpath in failed_xpaths and failed_xpaths[xpath] >= max_xpath_retries:
-                            msg += (
-                                f"\n[SYSTEM CRITICAL] xpath {xpath} уже провалился "
-                                f"{failed_xpaths[xpath]} раз!\n"
-                            )
-                            msg += (
-                                "ОБЯЗАТЕЛЬНО вызови get_details с СОВЕРШЕННО ДРУГИМ запросом "
-                                "(по тексту/aria-label/data-tooltip вместо жёсткой структуры DOM).\n"
-                            )
-                            print(f"🚫 Блокировка xpath после {max_xpath_retries} неудач")
-                            continue
-
-                        error = self.browser_controller.click_element(**action.args)
-                        if error:
-                            failed_xpaths[xpath] = failed_xpaths.get(xpath, 0) + 1
-                            msg += f"\n[CLICK ERROR #{failed_xpaths[xpath]}]: {error}\n"
-                            msg += f"Элемент не найден по xpath: {xpath}\n"
-                            if failed_xpaths[xpath] >= max_xpath_retries:
-                                msg += "⚠️ КРИТИЧЕСКОЕ ПРЕДУПРЕЖДЕНИЕ: Этот xpath не работает!\n"
-                                msg += "В СЛЕДУЮЩЕМ ОТВЕТЕ:\n"
-                                msg += "1. Вызови get_details с ДРУГОЙ стратегией поиска\n"
-                                msg += "2. НЕ используй xpath со структурой //tr[3]//div — он НЕ РАБОТАЕТ\n"
-                                msg += "3. Ищи элементы по aria-label, data-tooltip или видимому тексту\n"
-                        else:
-                            if xpath in failed_xpaths:
-                                del failed_xpaths[xpath]
-                            msg += f"\n[CLICK OK]: {action.args}\n"
-                            msg += self.browser_controller.get_html()
-
-                    elif action.function == "enter":
-                        error = self.browser_controller.enter(**action.args)
-                        if error:
-                            msg += f"\n[ENTER ERROR]: {error}\n"
-                        else:
-                            msg += f"\n[ENTER OK]: {action.args}\n"
-                            msg += self.browser_controller.get_html()
-
-                    elif action.function == "get":
-                        html = self.browser_controller.get_html(raw=True)
-                        msg += f"\n[FULL HTML]:\n{html}\n"
-
-                    elif action.function == "get_dom_chunk":
-                        chunk = self.browser_controller.get_dom_chunk(**action.args)
-                        msg += f"\n[DOM CHUNK]:\n{chunk}\n"
-
-                    elif action.function == "get_details":
-                        visible_html = self.browser_controller.get_visible_html()
-                        result = self.assistant.analyze_html_chunked(
-                            html=visible_html,
-                            max_chunk_chars=150000,
-                            **action.args,
-                        )
+                    action = models.NextAction.model_validate(data)
+                except Exception:
+                    streaming = False
+                    continue
+                if executed == 0:
+                    first_action = time.perf_counter() - started
+                    self.plan_stats["first_action_seconds"] += first_action
+                    self.plan_stats["first_action_count"] += 1
+                    print(f"⏱️ Первое действие через {first_action:.2f} с после запроса")
+                msg += self._execute_action(action)
+                executed += 1
+
+        self.plan_stats["replies"] += 1
+        self.plan_stats["streamed_actions"] += executed
+        return parser.text, msg, executed
 
-                        msg += f"\n[GET_DETAILS RESULT]:\n{result}\n"
-
-                        try:
-                            data = json.loads(result)
-                        except Exception as e:
-                            msg += f"\n[SYSTEM] Не удалось распарсить JSON get_details: {e}\n"
-                        else:
-                            found = bool(data.get("found"))
-                            elements = data.get("elements") or []
-                            if found and elements:
-                                best = elements[0]
-                                xpath = best.get("xpath")
-                                action_type = (best.get("action") or "click").lower()
-                                msg += (
-                                    "\n[SYSTEM] get_details нашёл подходящий элемент.\n"
-                                    "В СЛЕДУЮЩЕМ ОТВЕТЕ ОБЯЗАТЕЛЬНО добавь в action_sequence "
-                                    f"ПЕРВЫМ действием функцию \"{action_type}\" с этим xpath: {xpath}.\n"
-                                    "НЕ вызывай get_details ещё раз для этой же подзадачи и НЕ ставь status=\"error\".\n"
-                                )
-                            else:
-                                msg += (
-                                    "\n[SYSTEM] get_details НЕ нашёл элемент по запросу.\n"
-                                    "НЕ ставь status=\"error\". Выполни ещё один get_details с более точным "
-                                    "или другим prompt, либо измени стратегию (другая часть страницы).\n"
-                                )
-                        msg += (
-                            "\n[SYSTEM] ОБЯЗАТЕЛЬНО используй xpath из [GET_DETAILS RESULT] выше, "
-                            "если found=true!\n"
-                        )
+    def start(self):
+        # TLS/прокси к API устанавливаются, пока запускается браузер
+        self.assistant.warm_up()
+        self.browser_controller.start_browser()
 
-                    elif action.function == "helper":
-                        visible_html = self.browser_controller.get_visible_html()
-                        helper_prompt = action.args.get("prompt", "")
-                        extra = action.args.get("extra")
+        model: models.AssistantResponse | None = None
+        error_retries = 0
+        max_error_retries = 5
+        request_failures = 0
 
-                        result = self.assistant.call_helper(
-                            helper_prompt=helper_prompt,
-                            html=visible_html,
-                            extra=extra,
-                        )
-                        msg += f"\n[HELPER RESULT]:\n{result}\n"
+        msg = ""
+        step = 0
 
-                    elif action.function == "save_response":
-                        self.assistant.save_response(**action.args)
-                        msg += f"\n[SAVED]: {action.args.get('msg', '')[:100]}\n"
+        while True:
+            step += 1
+            # Итерация цикла агента: состояние страницы, запрос к модели, действия
+            with span("agent.step", step=step):
+                self._step = step
+                current_state = self._page_state()
+                self._expire_pending_locators()
+                user_input = ""
+
+                if request_failures:
+                    # Прошлый msg не дошёл до модели — отправляется снова, без новых вопросов пользователю
+                    pass
+                elif model and model.missing_data and len(model.missing_data) > 0:
+                    print("📝 Требуется ввод данных:")
+                    for item in model.missing_data:
+                        print(f" - {item.question}")
+                    user_input = self._input("\n(enter `q` to exit)>>> ")
+                    if user_input.lower() == "q":
+                        self.browser_controller.close_browser()
+                        break
 
-                    elif action.function == "delete_response":
-                        self.assistant.delete_response(**action.args)
-                        msg += "\n[DELETED]\n"
+                    self.page_user_message = user_input
+                    fields = ", ".join(m.field for m in model.missing_data)
+                    msg = (
+                        f"Пользователь ввёл данные для полей: {fields}. "
+                        f"Сырый ответ пользователя: {user_input}"
+                    )
+                    error_retries = 0
 
-                    elif action.function == 'waiting_user_input':
-                        msg += f'user input: {input()}'
+                elif model is None or model.status in ["done", "error"]:
+                    if model and model.status == "done":
+                        print(f"✅ Задача выполнена: {model.current_goal}")
+                        user_input = self._input("Скажите, что делать далее: ")
+                        continue
+
+                    if model and model.status == "error":
+                        error_retries += 1
+                        print(f"⚠️ Ошибка ({error_retries}/{max_error_retries}): {model.current_goal}")
+                        if error_retries >= max_error_retries:
+                            print("❌ Лимит попыток исчерпан")
+                            self.browser_controller.close_browser()
+                            break
+
+                        msg = SYSTEM_RETRY_PROMPT.format(
+                            attempt=error_retries, limit=max_error_retries, error=model.current_goal
+                        )
+                    else:
+                        user_input = self._input("(enter `q` to exit)>>> ")
+                        if user_input.lower() == "q":
+                            self.browser_controller.close_browser()
+                            break
+                        msg = user_input
+                        self.page_user_message = user_input
+                        error_retries = 0
+
+                if msg:
+                    full_message = f"{msg}\n\n[CURRENT PAGE STATE]:\n{current_state}"
+                else:
+                    full_message = f"[CURRENT PAGE STATE]:\n{current_state}"
 
+                requested = time.perf_counter()
+                try:
+                    if self.stream_plan:
+                        response, msg, executed = self._chat_streaming(full_message)
                     else:
-                        msg += f"\n[UNKNOWN FUNCTION]: {action.function}\n"
+                        response = self.assistant.chat(full_message)
+                        msg, executed = "", 0
+                except REQUEST_ERRORS as e:
+                    # Повторы внутри запроса исчерпаны: пауза и тот же msg на следующем шаге.
+                    # Сообщение убрано из истории вместе с состояниями страницы в нём —
+                    # UNCHANGED/DIFF на них ссылаться не должны, следующее состояние полное
+                    self.page_states.reset()
+                    request_failures += 1
+                    print(
+                        f"❌ Модель недоступна ({request_failures}/{max_error_retries}): "
+                        f"{type(e).__name__}: {e}"
+                    )
+                    if request_failures >= max_error_retries:
+                        print("❌ Лимит попыток исчерпан")
+                        self.browser_controller.close_browser()
+                        break
+                    time.sleep(RateLimiter.backoff(request_failures))
+                    continue
+                request_failures = 0
+                self.parse_stats["replies"] += 1
+
+                cleaned_response = self._fix_trailing_commas(response)
 
+                try:
+                    model = models.AssistantResponse.model_validate_json(cleaned_response)
                 except Exception as e:
-                    msg += f"\n[EXCEPTION in {action.function}]: {e}\n"
-                    print(f"❌ Exception: {e}")
+                    print(f"❌ Ошибка парсинга: {e}")
+                    # Ответ выброшен — на исправление уйдёт ещё один запрос
+                    self.parse_stats["parse_failures"] += 1
+                    self.parse_stats["wasted_round_trips"] += 1
+                    self.parse_stats["wasted_seconds"] += time.perf_counter() - requested
+                    print(
+                        f"📉 Невалидных ответов: {self.parse_stats['parse_failures']}"
+                        f"/{self.parse_stats['replies']}, потеряно "
+                        f"~{self.parse_stats['wasted_seconds']:.1f} с"
+                    )
+                    msg += (
+                        "[SYSTEM] Ошибка парсинга JSON. Убери висячие запятые и другие "
+                        "некорректные конструкции. Верни ВАЛИДНЫЙ JSON по описанию в промте."
+                    )
+                    continue
+
+                self.page_goal = model.current_goal
 
-            if model.status == "in_progress" and model.action_sequence:
-                error_retries = 0
+                if model.missing_data and len(model.missing_data) > 0:
+                    continue
+
+                if not model.action_sequence:
+                    continue
+
+                # Префикс плана, исполненный на лету в потоковом режиме, не повторяем
+                for action in model.action_sequence[executed:]:
+                    msg += self._execute_action(action)
+
+                if model.status == "in_progress" and model.action_sequence:
+                    error_retries = 0
@@ -0,0 +1,266 @@
+"""
+Локальный OpenAI-совместимый сервер для офлайн-прогонов и нагрузочных тестов.
+
+    python -m utils.fake_openai --recordings .cache/replay.jsonl --latency 0.5
+    python -m utils.fake_openai --script scripted.json --port 8765
+
+В .env: openai_base_url=http://127.0.0.1:8765/v1 (прокси для локального
+адреса не используется).
+
+Ответ на POST /v1/chat/completions ищется так:
+    1. запись ReplayStore по хэшу (модель, сообщения);
+    2. сценарий --script: JSON-список, элемент — строка ответа или
+       {"match": "подстрока", "content": "...", "latency": 0.2};
+       правило с match срабатывает, если подстрока есть в последнем сообщении
+       user, элементы без match выдаются по очереди;
+    3. иначе — 404 в формате ошибки OpenAI.
+Задержка: latency правила сценария, иначе --latency секунд (по умолчанию —
+записанная в ReplayStore) плюс равномерный --jitter. Поддерживаются stream=True (SSE) и include_usage.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from utils.history import estimate_tokens, messages_tokens
+from utils.replay import ReplayStore, split_content
+
+
+class FakeOpenAIServer:
+    """Сервер в фоновом потоке: start() возвращает base_url, stop() — останавливает."""
+
+    def __init__(
+        self,
+        recordings: Optional[str] = None,
+        script: Optional[list] = None,
+        latency: Optional[float] = None,
+        jitter: float = 0.0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.store = ReplayStore(recordings, mode="replay") if recordings else None
+        self.script = list(script or [])
+        self.latency = latency
+        self.jitter = jitter
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "replayed": 0, "scripted": 0, "misses": 0}
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> str:
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def respond(self, body: dict) -> Optional[tuple[str, float]]:
+        """(ответ, задержка) для тела запроса или None."""
+        model = body.get("model", "")
+        messages = body.get("messages") or []
+        with self._lock:
+            self.stats["requests"] += 1
+
+        if self.store is not None:
+            entry = self.store.get(self.store.make_key(model, messages))
+            if entry is not None:
+                with self._lock:
+                    self.stats["replayed"] += 1
+                return entry["content"], self._delay(entry.get("latency"))
+
+        last_user = next(
+            (str(m.get("content") or "") for m in reversed(messages) if m.get("role") == "user"), ""
+        )
+        with self._lock:
+            item = self._pick_scripted(last_user)
+            if item is not None:
+                self.stats["scripted"] += 1
+            else:
+                self.stats["misses"] += 1
+        if item is None:
+            return None
+        if isinstance(item, str):
+            return item, self._delay(None)
+        if item.get("latency") is not None:
+            # Задержка правила сценария важнее общей --latency
+            return item.get("content", ""), max(0.0, item["latency"] + random.uniform(0, self.jitter))
+        return item.get("content", ""), self._delay(None)
+
+    def _pick_scripted(self, last_user: str):
+        for item in self.script:
+            if isinstance(item, dict) and item.get("match") and item["match"] in last_user:
+                return item
+        sequential = [item for item in self.script if not (isinstance(item, dict) and item.get("match"))]
+        if self._sequence < len(sequential):
+            item = sequential[self._sequence]
+            self._sequence += 1
+            return item
+        return None
+
+    def _delay(self, recorded: Optional[float]) -> float:
+        base = self.latency if self.latency is not None else (recorded or 0.0)
+        return max(0.0, base + random.uniform(0, self.jitter))
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_HEAD(self):
+                # warm-up транспорта
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/models"):
+                    self._json(200, {"object": "list", "data": [{"id": "fake", "object": "model"}]})
+                else:
+                    self._error(404, f"Unknown path {self.path}")
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    self._error(400, "Invalid JSON body")
+                    return
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._error(404, f"Unknown path {self.path}")
+                    return
+
+                reply = server.respond(body)
+                if reply is None:
+                    self._error(404, "No recorded or scripted response for this request")
+                    return
+                content, delay = reply
+                usage = {
+                    "prompt_tokens": messages_tokens(body.get("messages") or []),
+                    "completion_tokens": estimate_tokens(content),
+                }
+                usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                if body.get("stream"):
+                    include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+                    self._stream(body.get("model", ""), content, delay, usage if include_usage else None)
+                    return
+                time.sleep(delay)
+                self._json(200, {
+                    "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", ""),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": usage,
+                })
+
+            def _stream(self, model: str, content: str, delay: float, usage: Optional[dict]):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                pieces = list(split_content(content)) or [""]
+                chunk_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+
+                def send(payload: dict):
+                    self.wfile.write(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+
+                for index, piece in enumerate(pieces):
+                    time.sleep(delay / len(pieces))
+                    send({
+                        "id": chunk_id,
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [{
+                            "index": 0,
+                            "delta": {"content": piece},
+                            "finish_reason": "stop" if index == len(pieces) - 1 else None,
+                        }],
+                    })
+                if usage is not None:
+                    send({
+                        "id": chunk_id,
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [],
+                        "usage": usage,
+                    })
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+            def _json(self, status: int, payload: dict):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _error(self, status: int, message: str):
+                self._json(status, {"error": {"message": message, "type": "fake_server_error", "code": None}})
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальный OpenAI-совместимый сервер (replay/сценарий)")
+    parser.add_argument("--recordings", help="JSONL-файл ReplayStore")
+    parser.add_argument("--script", help="JSON-файл со сценарием ответов")
+    parser.add_argument("--latency", type=float, default=None, help="задержка ответа, с (по умолчанию — записанная)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="случайная добавка к задержке, с")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    script = None
+    if args.script:
+        with open(args.script, "r", encoding="utf-8") as file:
+            script = json.load(file)
+
+    server = FakeOpenAIServer(
+        recordings=args.recordings,
+        script=script,
+        latency=args.latency,
+        jitter=args.jitter,
+        host=args.host,
+        port=args.port,
+    )
+    records = len(server.store) if server.store is not None else 0
+    print(f"🧪 Fake OpenAI: {server.base_url} | записей: {records} | сценарий: {len(server.script)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+import hashlib
+import math
+import re
+from collections import Counter
+from typing import List, Optional
+
+
+# Блок состояния страницы в сообщениях истории:
+#   [PAGE STATE #4 url=... | title=...]
+#   ...
+#   [/PAGE STATE]
+PAGE_STATE_RE = re.compile(
+    r"\[PAGE STATE (?:#(?P<step>\d+) )?url=(?P<url>[^\n]*?) \| title=(?P<title>[^\n]*?)\]\n"
+    r"(?P<body>.*?)\n\[/PAGE STATE\]",
+    re.S,
+)
+
+# Изменения относительно последнего полного состояния (PageStateInterner):
+#   [PAGE DIFF #6 vs step 4 | url=...]
+#   + добавленная строка
+#   - удалённая строка
+#   [/PAGE DIFF]
+PAGE_DIFF_RE = re.compile(
+    r"\[PAGE DIFF #(?P<step>\d+) vs step (?P<base>\d+) \| url=(?P<url>[^\n]*?)\]\n.*?\n\[/PAGE DIFF\]",
+    re.S,
+)
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]", re.U)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Приблизительное число токенов без словаря токенизатора.
+
+    Слово латиницей ≈ 1 токен на 4 символа, кириллицей ≈ 1 на 3 символа,
+    каждый знак пунктуации — отдельный токен. Для BPE-словарей OpenAI
+    ошибка обычно в пределах 10–20%, чего хватает для бюджета истории.
+    """
+    tokens = 0
+    for piece in _TOKEN_RE.findall(text or ""):
+        if len(piece) == 1:
+            tokens += 1
+        elif piece.isascii():
+            tokens += math.ceil(len(piece) / 4)
+        else:
+            tokens += math.ceil(len(piece) / 3)
+    return tokens
+
+
+def messages_tokens(messages: List[dict]) -> int:
+    # +4 — служебные токены на каждое сообщение (роль, разделители)
+    return sum(estimate_tokens(str(m.get("content") or "")) + 4 for m in messages)
+
+
+def _header_value(value: str) -> str:
+    return " ".join((value or "").split()).replace("]", ")")
+
+
+def page_state_block(state: str, url: str = "", title: str = "", step: Optional[int] = None) -> str:
+    """Оборачивает состояние страницы в маркеры, по которым его находит HistoryManager."""
+    number = f"#{step} " if step is not None else ""
+    return (
+        f"[PAGE STATE {number}url={_header_value(url)} | title={_header_value(title)}]\n"
+        f"{state}\n[/PAGE STATE]"
+    )
+
+
+def page_state_stub(url: str, title: str, body: str, step: Optional[str] = None) -> str:
+    digest = hashlib.sha1(body.encode("utf-8")).hexdigest()[:10]
+    number = f"#{step} " if step else ""
+    return f"[PAGE STATE {number}url={url} | title={title} | sha1={digest} — устарело, актуальное состояние ниже]"
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class PageStateInterner:
+    """
+    Дедупликация состояний страницы между шагами одной сессии.
+
+    Каждое состояние получает номер шага и хэш содержимого:
+    - совпадает с предыдущим (или с последним полным) → одна строка
+      [PAGE UNCHANGED since step N];
+    - та же страница (url), изменилась часть строк → [PAGE DIFF] с
+      добавленными/удалёнными строками относительно последнего ПОЛНОГО
+      состояния, если diff заметно короче полного состояния;
+    - иначе — полный блок [PAGE STATE #N ...], он становится новой базой.
+    HistoryManager никогда не вырезает последний полный блок, поэтому база,
+    на которую ссылаются UNCHANGED/DIFF, всегда остаётся в контексте.
+    """
+
+    # Удалённые строки нужны модели только для опознания — обрезаем
+    REMOVED_LINE_CHARS = 120
+
+    def __init__(self, max_diff_ratio: float = 0.5):
+        self.max_diff_ratio = max_diff_ratio
+        self.step = 0
+        self._base: Optional[dict] = None
+        self._previous: Optional[dict] = None
+        self.stats = {"full": 0, "unchanged": 0, "diff": 0, "chars_saved": 0}
+
+    def reset(self):
+        """
+        Забывает базу и предыдущее состояние: следующее уйдёт полным блоком.
+        Нужно, когда сообщение с отрисованным состоянием не дошло до модели.
+        """
+        self._base = None
+        self._previous = None
+
+    def render(self, state: str, url: str = "", title: str = "") -> str:
+        self.step += 1
+        digest = _digest(state)
+
+        for reference in (self._previous, self._base):
+            if reference is not None and reference["digest"] == digest:
+                self._previous = {"step": self.step, "digest": digest}
+                self.stats["unchanged"] += 1
+                self.stats["chars_saved"] += len(state)
+                return f"[PAGE UNCHANGED since step {reference['step']} | url={_header_value(url)}]"
+
+        base = self._base
+        if base is not None and base["url"] == url:
+            diff = self._diff(base["lines"], state.split("\n"))
+            if diff and len(diff) < len(state) * self.max_diff_ratio:
+                self._previous = {"step": self.step, "digest": digest}
+                self.stats["diff"] += 1
+                self.stats["chars_saved"] += len(state) - len(diff)
+                return (
+                    f"[PAGE DIFF #{self.step} vs step {base['step']} | url={_header_value(url)}]\n"
+                    f"{diff}\n[/PAGE DIFF]"
+                )
+
+        self._base = {"step": self.step, "digest": digest, "url": url, "lines": state.split("\n")}
+        self._previous = {"step": self.step, "digest": digest}
+        self.stats["full"] += 1
+        return page_state_block(state, url, title, step=self.step)
+
+    def _diff(self, old_lines: List[str], new_lines: List[str]) -> str:
+        old_counts = Counter(old_lines)
+        new_counts = Counter(new_lines)
+        removed = old_counts - new_counts
+        added = new_counts - old_counts
+
+        lines: List[str] = []
+        for line in old_lines:
+            if removed.get(line, 0) > 0 and line.strip():
+                removed[line] -= 1
+                short = line if len(line) <= self.REMOVED_LINE_CHARS else line[: self.REMOVED_LINE_CHARS] + "…"
+                lines.append(f"- {short}")
+        for line in new_lines:
+            if added.get(line, 0) > 0 and line.strip():
+                added[line] -= 1
+                lines.append(f"+ {line}")
+        return "\n".join(lines)
+
+
+class HistoryManager:
+    """
+    Сжатие истории диалога под бюджет токенов.
+
+    - системный промт и первый обмен (исходная задача пользователя) сохраняются;
+    - все блоки [PAGE STATE], кроме последнего, заменяются строкой-заглушкой
+      (url + title + хэш содержимого), как и блоки [PAGE DIFF] до него;
+    - если история всё ещё больше max_tokens, удаляются самые старые ходы
+      ЦЕЛИКОМ (сообщение user со всеми ответами после него), но не последние
+      keep_recent сообщений и не ход с последним полным состоянием страницы.
+    Токены до/после сжатия по каждому запросу — в stats и last.
+    """
+
+    def __init__(self, max_tokens: int = 60000, keep_recent: int = 4, pinned: int = 3):
+        self.max_tokens = max_tokens
+        self.keep_recent = keep_recent
+        self.pinned = pinned
+        self.stats = {"requests": 0, "tokens_before": 0, "tokens_after": 0}
+        self.last: Optional[dict] = None
+
+    def compact(self, history: List[dict]) -> List[dict]:
+        before = messages_tokens(history)
+        result = self._stub_page_states(history)
+
+        pinned = min(self.pinned, len(result))
+        while messages_tokens(result) > self.max_tokens:
+            turn_end = self._first_turn_end(result, pinned)
+            if turn_end is None or len(result) - turn_end < self.keep_recent:
+                break
+            if any(PAGE_STATE_RE.search(str(m.get("content") or "")) for m in result[pinned:turn_end]):
+                # На последнее полное состояние ссылаются UNCHANGED/DIFF — ход оставляем
+                pinned = turn_end
+                continue
+            del result[pinned:turn_end]
+
+        after = messages_tokens(result)
+        self.stats["requests"] += 1
+        self.stats["tokens_before"] += before
+        self.stats["tokens_after"] += after
+        self.last = {"tokens_before": before, "tokens_after": after, "messages": len(result)}
+        return result
+
+    @staticmethod
+    def _stub_page_states(history: List[dict]) -> List[dict]:
+        # Последний блок состояния страницы остаётся как есть
+        latest = None
+        for index in range(len(history) - 1, -1, -1):
+            matches = list(PAGE_STATE_RE.finditer(str(history[index].get("content") or "")))
+            if matches:
+                latest = (index, matches[-1].start())
+                break
+
+        result = []
+        for index, message in enumerate(history):
+            content = message.get("content")
+            if not isinstance(content, str) or ("[PAGE STATE " not in content and "[PAGE DIFF " not in content):
+                result.append(message)
+                continue
+
+            # Позиции берутся по исходному тексту: latest посчитан по нему же,
+            # а замены блоков сдвигают всё, что идёт после них
+            replacements = []
+            for match in PAGE_STATE_RE.finditer(content):
+                if latest != (index, match.start()):
+                    stub = page_state_stub(
+                        match.group("url"), match.group("title"), match.group("body"), match.group("step")
+                    )
+                    replacements.append((match.start(), match.end(), stub))
+            for match in PAGE_DIFF_RE.finditer(content):
+                if latest is not None and (index, match.start()) < latest:
+                    stub = f"[PAGE DIFF #{match.group('step')} vs step {match.group('base')} — устарело]"
+                    replacements.append((match.start(), match.end(), stub))
+
+            parts, position = [], 0
+            for start, end, stub in sorted(replacements):
+                parts += [content[position:start], stub]
+                position = end
+            compacted = "".join(parts) + content[position:]
+            result.append(message if compacted == content else {**message, "content": compacted})
+        return result
+
+    @staticmethod
+    def _first_turn_end(history: List[dict], start: int) -> Optional[int]:
+        """Конец первого хода после start: индекс следующего сообщения user."""
+        if start >= len(history):
+            return None
+        for index in range(start + 1, len(history)):
+            if history[index].get("role") == "user":
+                return index
+        return None
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+class LLMCache:
+    """
+    Кэш ответов модели, адресуемый по содержимому запроса.
+
+    Ключ — sha256 от (модель, сообщения с нормализованными пробелами).
+    Два уровня:
+        * LRU в памяти (max_memory_items записей);
+        * опционально SQLite на диске (path): TTL и вытеснение давно не
+          использованных записей при превышении max_disk_bytes.
+    SQLite работает в режиме WAL с busy_timeout, поэтому один файл кэша
+    можно делить между несколькими процессами ассистента на одной машине.
+    Статистика попаданий — в stats / hit_rate().
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        max_memory_items: int = 256,
+        max_disk_bytes: int = 200 * 1024 * 1024,
+        ttl: float = 7 * 24 * 3600,
+    ):
+        self.path = path
+        self.max_memory_items = max_memory_items
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self._connect() as db:
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+                    " created REAL NOT NULL, accessed REAL NOT NULL)"
+                )
+                db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    @staticmethod
+    def make_key(model: str, messages: list[dict], params: Optional[dict] = None) -> str:
+        """
+        Ключ запроса: модель, сообщения (пробелы нормализованы) и параметры,
+        меняющие ответ (response_format, temperature, max_completion_tokens).
+        Без params ключ прежний — записи replay остаются валидными.
+        """
+        normalized = [
+            {"role": m.get("role"), "content": " ".join(str(m.get("content") or "").split())}
+            for m in messages
+        ]
+        request = {"model": model, "messages": normalized}
+        if params:
+            request["params"] = params
+        payload = json.dumps(request, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Отдельное соединение на поток: анализ чанков идёт из пула потоков
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA busy_timeout=10000")
+            self._local.db = db
+        return db
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created = entry
+                if now - created <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+
+        if self.path:
+            try:
+                with self._connect() as db:
+                    row = db.execute(
+                        "SELECT value, created FROM responses WHERE key = ?", (key,)
+                    ).fetchone()
+                    if row is not None and now - row[1] > self.ttl:
+                        db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                        row = None
+                    if row is not None:
+                        db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            except sqlite3.Error as e:
+                print(f"⚠️ Ошибка чтения кэша LLM: {e}")
+                row = None
+            if row is not None:
+                self._remember(key, row[0], row[1])
+                with self._lock:
+                    self.stats["disk_hits"] += 1
+                return row[0]
+
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def set(self, key: str, value: str):
+        now = time.time()
+        self._remember(key, value, now)
+        with self._lock:
+            self.stats["stores"] += 1
+        if not self.path:
+            return
+        try:
+            with self._connect() as db:
+                db.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, size, created, accessed)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (key, value, len(value.encode("utf-8")), now, now),
+                )
+                db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+                self._evict(db)
+        except sqlite3.Error as e:
+            print(f"⚠️ Ошибка записи кэша LLM: {e}")
+
+    def _remember(self, key: str, value: str, created: float):
+        with self._lock:
+            self._memory[key] = (value, created)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_items:
+                self._memory.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def _evict(self, db: sqlite3.Connection):
+        """Удаляет давно не использованные записи, пока кэш не влезет в max_disk_bytes."""
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_disk_bytes:
+            return
+        for key, size in db.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall():
+            db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            with self._lock:
+                self.stats["evictions"] += 1
+            total -= size
+            if total <= self.max_disk_bytes:
+                break
+
+    def hit_rate(self) -> float:
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        total = hits + self.stats["misses"]
+        return hits / total if total else 0.0
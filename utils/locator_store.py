@@ -0,0 +1,258 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+from urllib.parse import urlparse
+
+from utils.resolver import parse_prompt, element_role
+from utils.snapshot import PageSnapshot, LocatorError, element_fields, describe_interactive, is_editable
+
+
+# Поля отпечатка, которые обязаны совпасть (если были в записи)
+_LABEL_FIELDS = ("aria", "tooltip", "label", "title")
+
+
+def site_key(url: str) -> str:
+    """Домен страницы без www: записи общие для http/https и любых путей сайта."""
+    host = (urlparse(url or "").hostname or "").lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+def normalize_intent(prompt: str) -> str:
+    """
+    Запрос get_details → ключ намерения: значимые слова в общей латинской
+    форме (см. utils.resolver) и роли, без повторов и без учёта порядка.
+    "Найди ссылку Спам" и "spam link" дают один и тот же ключ.
+    """
+    roles, terms = parse_prompt(prompt)
+    return " ".join(sorted(set(terms)) + sorted(f"role:{role}" for role in roles))
+
+
+def element_fingerprint(el) -> dict:
+    """Структурный отпечаток элемента: тег, роль, тип, метки и теги трёх предков."""
+    fields = element_fields(el)
+    ancestors = []
+    for ancestor in el.iterancestors():
+        if len(ancestors) == 3:
+            break
+        ancestors.append(ancestor.tag)
+    return {
+        "tag": el.tag,
+        "role": element_role(el),
+        "type": (el.get("type") or "").lower(),
+        **{name: fields[name] or "" for name in _LABEL_FIELDS},
+        "text": fields["text"],
+        "ancestors": ancestors,
+    }
+
+
+def fingerprint_matches(stored: dict, current: dict) -> bool:
+    """
+    Тот же ли это элемент. Тег, роль и тип — строго; метки — если были
+    записаны; текст — только у элементов без меток (у меток он часто
+    содержит счётчики: "Входящие 12"). Предки допускают одно расхождение.
+    """
+    if any(stored.get(key) != current.get(key) for key in ("tag", "role", "type")):
+        return False
+    labels = [name for name in _LABEL_FIELDS if stored.get(name)]
+    if labels:
+        if any(stored[name] != current.get(name) for name in labels):
+            return False
+    elif stored.get("text") != current.get("text"):
+        return False
+    stored_path = stored.get("ancestors") or []
+    current_path = current.get("ancestors") or []
+    mismatches = sum(1 for a, b in zip(stored_path, current_path) if a != b)
+    return mismatches + abs(len(stored_path) - len(current_path)) <= 1
+
+
+class LocatorStore:
+    """
+    Выученные локаторы по сайтам, общие для всех сессий.
+
+    Запись — (домен, ключ намерения) → локатор (LocatorIndex, stable=True:
+    по атрибуту или тексту, позиционный — только если других нет; без
+    data-ba-id, которые живут одну сессию), действие и структурный отпечаток цели.
+    Записывается только то, что действительно сработало в click/enter.
+    lookup проверяет запись по текущему снимку: локатор должен указывать
+    ровно на один интерактивный элемент с тем же отпечатком; иначе запись
+    удаляется, как и при неудачном клике по выданному из хранилища локатору.
+
+    SQLite в режиме WAL с busy_timeout и отдельным соединением на поток
+    (как LLMCache): читатели не блокируют друг друга и запись, файл можно
+    делить между процессами. Индекс по domain — для выборки записей сайта.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.stats = {"lookups": 0, "hits": 0, "misses": 0, "stale": 0, "stores": 0, "evictions": 0}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS locators ("
+                " domain TEXT NOT NULL, intent TEXT NOT NULL, locator TEXT NOT NULL,"
+                " action TEXT NOT NULL, fingerprint TEXT NOT NULL, hits INTEGER NOT NULL DEFAULT 0,"
+                " created REAL NOT NULL, used REAL NOT NULL, PRIMARY KEY (domain, intent))"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS locators_domain ON locators (domain)")
+
+    def _connect(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA busy_timeout=10000")
+            self._local.db = db
+        return db
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def get(self, domain: str, intent: str) -> Optional[dict]:
+        try:
+            with self._connect() as db:
+                row = db.execute(
+                    "SELECT locator, action, fingerprint, hits FROM locators WHERE domain = ? AND intent = ?",
+                    (domain, intent),
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"⚠️ Ошибка чтения хранилища локаторов: {e}")
+            return None
+        if row is None:
+            return None
+        return {
+            "domain": domain,
+            "intent": intent,
+            "locator": row[0],
+            "action": row[1],
+            "fingerprint": json.loads(row[2]),
+            "hits": row[3],
+        }
+
+    def record(self, domain: str, intent: str, locator: str, action: str, fingerprint: dict):
+        """Локатор сработал: сохраняет запись или увеличивает её счётчик."""
+        if not domain or not intent:
+            return
+        now = time.time()
+        try:
+            with self._connect() as db:
+                db.execute(
+                    "INSERT INTO locators (domain, intent, locator, action, fingerprint, hits, created, used)"
+                    " VALUES (?, ?, ?, ?, ?, 1, ?, ?)"
+                    " ON CONFLICT (domain, intent) DO UPDATE SET"
+                    " hits = CASE WHEN locator = excluded.locator THEN hits + 1 ELSE 1 END,"
+                    " locator = excluded.locator, action = excluded.action,"
+                    " fingerprint = excluded.fingerprint, used = excluded.used",
+                    (domain, intent, locator, action, json.dumps(fingerprint, ensure_ascii=False), now, now),
+                )
+        except sqlite3.Error as e:
+            print(f"⚠️ Ошибка записи хранилища локаторов: {e}")
+            return
+        self._count("stores")
+
+    def evict(self, domain: str, intent: str):
+        try:
+            with self._connect() as db:
+                db.execute("DELETE FROM locators WHERE domain = ? AND intent = ?", (domain, intent))
+        except sqlite3.Error as e:
+            print(f"⚠️ Ошибка записи хранилища локаторов: {e}")
+            return
+        self._count("evictions")
+
+    def site(self, domain: str) -> list:
+        """Все записи сайта — [(намерение, локатор, hits)] по убыванию hits."""
+        try:
+            with self._connect() as db:
+                return db.execute(
+                    "SELECT intent, locator, hits FROM locators WHERE domain = ? ORDER BY hits DESC",
+                    (domain,),
+                ).fetchall()
+        except sqlite3.Error as e:
+            print(f"⚠️ Ошибка чтения хранилища локаторов: {e}")
+            return []
+
+    def lookup(self, snapshot: PageSnapshot, prompt: str) -> Optional[tuple]:
+        """
+        (запись, элемент снимка) для запроса на этой странице или None.
+        Запись, не прошедшая проверку по снимку, удаляется.
+        """
+        domain, intent = site_key(snapshot.url), normalize_intent(prompt)
+        if not domain or not intent:
+            return None
+        self._count("lookups")
+        entry = self.get(domain, intent)
+        if entry is None:
+            self._count("misses")
+            return None
+        try:
+            el = snapshot.resolve_xpath(entry["locator"], action=entry["action"])
+        except LocatorError:
+            el = None
+        if el is None or not fingerprint_matches(entry["fingerprint"], element_fingerprint(el)):
+            self._count("stale")
+            self.evict(domain, intent)
+            return None
+        self._count("hits")
+        return entry, el
+
+    def resolve(self, snapshot: PageSnapshot, prompt: str) -> Optional[str]:
+        """Ответ в формате get_details из проверенной записи или None."""
+        found = self.lookup(snapshot, prompt)
+        if found is None:
+            return None
+        entry, el = found
+        fields = element_fields(el)
+        ba_id = fields.get("id")
+        element = {
+            "description": describe_interactive(el.tag, fields) or el.tag,
+            "id": int(ba_id) if (ba_id or "").isdigit() else None,
+            "xpath": entry["locator"],
+            "action": entry["action"],
+        }
+        return json.dumps(
+            {
+                "found": True,
+                "elements": [element],
+                "page_context": "Локатор из хранилища сайта, проверен по текущей странице",
+                "meta": {"resolver": "store", "hits": entry["hits"]},
+            },
+            ensure_ascii=False,
+        )
+
+    def candidate(self, snapshot: PageSnapshot, prompt: str, element: dict) -> Optional[dict]:
+        """
+        Запись-кандидат для элемента из ответа get_details (id и/или xpath):
+        стабильный локатор LocatorIndex и отпечаток берутся из снимка ДО
+        действия — после клика страница уже другая. Сохраняется через
+        record(**candidate), когда действие по этому элементу прошло успешно.
+        """
+        domain, intent = site_key(snapshot.url), normalize_intent(prompt)
+        if not domain or not intent or snapshot.tree is None:
+            return None
+        el = None
+        element_id = element.get("id")
+        if element_id is not None and str(element_id).isdigit():
+            matches = snapshot.tree.xpath(f'//*[@data-ba-id="{int(element_id)}"]')
+            el = matches[0] if len(matches) == 1 else None
+        if el is None and element.get("xpath"):
+            try:
+                el = snapshot.resolve_xpath(element["xpath"])
+            except LocatorError:
+                return None
+        if el is None:
+            return None
+        return {
+            "domain": domain,
+            "intent": intent,
+            "locator": snapshot.locator_index().locator(el, stable=True),
+            "action": "enter" if is_editable(el) else "click",
+            "fingerprint": element_fingerprint(el),
+        }
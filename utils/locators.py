@@ -0,0 +1,197 @@
+import re
+from collections import Counter
+from typing import Optional, List
+
+
+# Атрибуты, по которым строится локатор, в порядке предпочтения
+LOCATOR_ATTRS = (
+    "id", "data-testid", "data-label", "data-tooltip", "aria-label",
+    "name", "placeholder", "title", "href",
+)
+
+_COUNTED_ATTRS = frozenset(LOCATOR_ATTRS + ("role",))
+
+# Теги, которые удобно искать по видимому тексту (кнопки, ссылки, подписи)
+TEXT_TAGS = ("a", "button", "label", "summary", "option", "li", "span", "td")
+
+# Длиннее — значение в локатор не берём: хрупко и съедает контекст модели
+MAX_VALUE_CHARS = 80
+
+
+_XPATH_SPACE_RE = re.compile(r"[ \t\r\n]+")
+
+
+def xpath_normalize_space(text: str) -> str:
+    # Как normalize-space() в XPath: только пробел, таб и переводы строк (не \xa0)
+    return _XPATH_SPACE_RE.sub(" ", text).strip(" \t\r\n")
+
+
+def xpath_literal(value: str) -> str:
+    """Строковый литерал XPath 1.0 для любого значения (с ' и " — через concat)."""
+    if "'" not in value:
+        return f"'{value}'"
+    if '"' not in value:
+        return f'"{value}"'
+    parts = value.split("'")
+    return "concat(" + ", \"'\", ".join(f"'{part}'" for part in parts) + ")"
+
+
+class LocatorIndex:
+    """
+    Локаторы для множества элементов одного документа за один проход.
+
+    При построении дерево обходится ОДИН раз и запоминается:
+        * позиция каждого элемента среди соседей с тем же тегом и их число;
+        * частоты (атрибут, значение) и (тег, атрибут, значение);
+        * группы элементов с одинаковым role и с тегами из TEXT_TAGS — частоты
+          их нормализованного текста считаются при первом обращении к группе.
+    locator(el) выбирает самый короткий из локаторов, уникальность которых
+    доказана этими таблицами:
+        //*[@attr='v']   //tag[@attr='v']
+        //*[@role='r'][normalize-space(.)='текст']   //tag[normalize-space(.)='текст']
+        <уникальный локатор ближайшего предка>/tag[i]/...  (позиционные шаги)
+        /html/body/div[2]/...                         (абсолютный путь)
+    Стоимость locator(el) — O(глубина), без повторного обхода соседей
+    (плюс однократный подсчёт текстов группы при первом текстовом локаторе).
+    """
+
+    def __init__(self, root):
+        # Уникальность считается по всему документу, даже если передан подэлемент
+        if root is not None:
+            root = root.getroottree().getroot()
+        self.root = root
+        # элемент → (позиция среди соседей с тем же тегом, счётчик тегов родителя)
+        self._position: dict = {}
+        self.attr_counts: Counter = Counter()
+        self.tag_attr_counts: Counter = Counter()
+        self._groups: dict = {}
+        self._group_counts: dict = {}
+        self._texts: dict = {}
+        self.stats = {"elements": 0, "attr": 0, "text": 0, "anchored": 0, "absolute": 0}
+
+        if root is None:
+            return
+        self._count(root)
+        self._position[root] = (1, {root.tag: 1})
+        for parent in root.iter():
+            if not isinstance(parent.tag, str):
+                continue
+            tags: Counter = Counter()
+            for child in parent:
+                if not isinstance(child.tag, str):
+                    continue
+                tags[child.tag] += 1
+                self._position[child] = (tags[child.tag], tags)
+                self._count(child)
+        self.stats["elements"] = len(self._position)
+
+    def _count(self, el):
+        attrib = el.attrib
+        role = None
+        if attrib:
+            for attr, value in attrib.items():
+                if attr in _COUNTED_ATTRS:
+                    self.attr_counts[(attr, value)] += 1
+                    self.tag_attr_counts[(el.tag, attr, value)] += 1
+            role = attrib.get("role")
+            if role is not None:
+                self._groups.setdefault(("role", role), []).append(el)
+        # //tag[...] найдёт элемент и с role — он состоит в обеих группах
+        if el.tag in TEXT_TAGS:
+            self._groups.setdefault(("tag", el.tag), []).append(el)
+
+    def _text(self, el) -> Optional[str]:
+        """normalize-space(.) элемента, если он годится для локатора."""
+        if el not in self._texts:
+            # У листа строковое значение — просто text
+            raw = (el.text or "") if not len(el) else "".join(el.itertext())
+            text = xpath_normalize_space(raw)
+            self._texts[el] = text if text and len(text) <= MAX_VALUE_CHARS else None
+        return self._texts[el]
+
+    def _text_unique(self, group: tuple, text: str) -> bool:
+        counts = self._group_counts.get(group)
+        if counts is None:
+            counts = self._group_counts[group] = Counter(self._text(el) for el in self._groups.get(group, ()))
+        return counts[text] == 1
+
+    def __contains__(self, el) -> bool:
+        return el in self._position
+
+    def _step(self, el) -> str:
+        index, tags = self._position[el]
+        return f"{el.tag}[{index}]" if tags[el.tag] > 1 else el.tag
+
+    def _attr_locator(self, el) -> Optional[str]:
+        """Самый короткий уникальный локатор по атрибуту элемента (без учёта текста)."""
+        best = None
+        for attr in LOCATOR_ATTRS:
+            value = el.get(attr)
+            if not value or len(value) > MAX_VALUE_CHARS:
+                continue
+            if self.attr_counts[(attr, value)] == 1:
+                candidate = f"//*[@{attr}={xpath_literal(value)}]"
+            elif self.tag_attr_counts[(el.tag, attr, value)] == 1:
+                candidate = f"//{el.tag}[@{attr}={xpath_literal(value)}]"
+            else:
+                continue
+            if best is None or len(candidate) < len(best):
+                best = candidate
+        return best
+
+    def _text_locator(self, el) -> Optional[str]:
+        role = el.get("role")
+        if role is None and el.tag not in TEXT_TAGS:
+            return None
+        text = self._text(el)
+        if text is None:
+            return None
+        if role is not None and self._text_unique(("role", role), text):
+            return f"//*[@role={xpath_literal(role)}][normalize-space(.)={xpath_literal(text)}]"
+        if el.tag in TEXT_TAGS and self._text_unique(("tag", el.tag), text):
+            return f"//{el.tag}[normalize-space(.)={xpath_literal(text)}]"
+        return None
+
+    def locator(self, el, stable: bool = False) -> str:
+        """
+        Кратчайший локатор, однозначно указывающий на el в этом документе.
+        stable=True — атрибутный или текстовый локатор, если он есть, даже когда
+        позиционный короче: позиции меняются с вёрсткой (локаторы на долгий срок).
+        """
+        if el not in self._position:
+            # Элемент не из этого документа — путь по его собственному дереву
+            self.stats["absolute"] += 1
+            return el.getroottree().getpath(el)
+
+        candidates: List[tuple] = []
+        own = self._attr_locator(el)
+        if own:
+            candidates.append((own, "attr"))
+        text = self._text_locator(el)
+        if text:
+            candidates.append((text, "text"))
+        if stable and candidates:
+            best, kind = min(candidates, key=lambda item: len(item[0]))
+            self.stats[kind] += 1
+            return best
+
+        # Позиционные шаги вверх до ближайшего предка с уникальным атрибутом
+        steps = [self._step(el)]
+        anchored = None
+        for ancestor in el.iterancestors():
+            anchor = self._attr_locator(ancestor)
+            if anchor:
+                anchored = anchor + "/" + "/".join(reversed(steps))
+                break
+            steps.append(self._step(ancestor))
+        if anchored:
+            candidates.append((anchored, "anchored"))
+        else:
+            candidates.append(("/" + "/".join(reversed(steps)), "absolute"))
+
+        best, kind = min(candidates, key=lambda item: len(item[0]))
+        self.stats[kind] += 1
+        return best
+
+    def locators(self, elements) -> List[str]:
+        return [self.locator(el) for el in elements]
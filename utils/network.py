@@ -0,0 +1,144 @@
+import json
+import time
+from typing import Dict, List, Optional, Set
+from urllib.parse import urlparse
+
+
+def _extensions(*exts: str) -> List[str]:
+    patterns = []
+    for ext in exts:
+        patterns += [f"*.{ext}", f"*.{ext}?*"]
+    return patterns
+
+
+# Категории ресурсов, которые агенту не нужны, → шаблоны Network.setBlockedURLs
+BLOCK_CATEGORIES: Dict[str, List[str]] = {
+    "image": _extensions("png", "jpg", "jpeg", "gif", "webp", "avif", "bmp", "ico"),
+    "media": _extensions("mp4", "webm", "mp3", "ogg", "wav", "mov", "avi", "m4a"),
+    "font": _extensions("woff", "woff2", "ttf", "otf", "eot"),
+    "tracker": [
+        "*doubleclick.net*", "*google-analytics.com*", "*googletagmanager.com*",
+        "*googlesyndication.com*", "*googleadservices.com*", "*connect.facebook.net*",
+        "*mc.yandex.ru*", "*an.yandex.ru*", "*top-fwz1.mail.ru*", "*hotjar.com*",
+        "*segment.io*", "*sentry-cdn.com*", "*criteo.com*", "*adnxs.com*",
+    ],
+}
+
+# Профили блокировки: какие категории отрезаются
+BLOCK_PROFILES: Dict[str, List[str]] = {
+    "none": [],
+    "light": ["media", "font", "tracker"],
+    "aggressive": ["image", "media", "font", "tracker"],
+}
+
+
+def parse_allow_list(value: Optional[str]) -> Dict[str, Set[str]]:
+    """
+    Разбирает allow-list из конфига: "mail.google.com:*;example.com:image,font".
+    Домен без категорий (или "*") означает "ничего не блокировать".
+    """
+    allow: Dict[str, Set[str]] = {}
+    for item in (value or "").split(";"):
+        domain, _, categories = item.strip().partition(":")
+        domain = domain.strip().lower()
+        if not domain:
+            continue
+        names = {c.strip() for c in categories.split(",") if c.strip()} or {"*"}
+        allow.setdefault(domain, set()).update(names)
+    return allow
+
+
+def blocked_patterns(
+    profile: str,
+    url: str = "",
+    allow: Optional[Dict[str, Set[str]]] = None,
+) -> List[str]:
+    """
+    Шаблоны URL для блокировки на странице url: категории профиля минус то,
+    что разрешено allow-list'ом для её домена (и его поддоменов).
+    """
+    if profile not in BLOCK_PROFILES:
+        raise ValueError(f"Unknown block profile: {profile!r}")
+    categories = set(BLOCK_PROFILES[profile])
+
+    host = (urlparse(url).hostname or "").lower()
+    for domain, allowed in (allow or {}).items():
+        if host and (host == domain or host.endswith("." + domain)):
+            categories = set() if "*" in allowed else categories - allowed
+
+    patterns = []
+    for category in BLOCK_PROFILES[profile]:
+        if category in categories:
+            patterns += BLOCK_CATEGORIES[category]
+    return patterns
+
+
+class NetworkTracker:
+    """
+    Счётчик сетевых запросов страницы "в полёте" по CDP-событиям Network.*.
+
+    События берутся из performance-лога ChromeDriver (goog:loggingPrefs
+    performance=ALL) — лог вычитывается при каждом drain(). Если лог
+    недоступен, трекер отключается и сеть всегда считается простаивающей.
+    """
+
+    # Запросы старше этого срока не учитываются (long-polling, стримы)
+    FORGET_AFTER = 60.0
+
+    def __init__(self):
+        # requestId → время начала запроса (unix, с) по данным самого браузера
+        self.pending: dict[str, float] = {}
+        self.enabled = True
+
+    @staticmethod
+    def _started_at(entry: dict, params: dict, now: float) -> float:
+        """
+        Когда браузер отправил запрос: wallTime из Network.requestWillBeSent,
+        иначе время записи в логе. Не время drain() — иначе запрос, начатый
+        между двумя ожиданиями, каждый раз выглядел бы новым.
+        """
+        started = params.get("wallTime")
+        if not isinstance(started, (int, float)):
+            logged = entry.get("timestamp")
+            started = logged / 1000 if isinstance(logged, (int, float)) else now
+        # Часы браузера и Python — одной машины, но не даём запросу оказаться "в будущем"
+        return min(started, now)
+
+    def drain(self, driver):
+        """Вычитывает накопившиеся события и обновляет список активных запросов."""
+        if not self.enabled:
+            return
+        try:
+            entries = driver.get_log("performance")
+        except Exception:
+            self.enabled = False
+            return
+
+        now = time.time()
+        for entry in entries:
+            try:
+                message = json.loads(entry["message"])["message"]
+            except Exception:
+                continue
+            method = message.get("method")
+            params = message.get("params") or {}
+            request_id = params.get("requestId")
+            if not request_id:
+                continue
+            if method == "Network.requestWillBeSent":
+                # Редирект приходит тем же requestId — время начала остаётся первым
+                self.pending.setdefault(request_id, self._started_at(entry, params, now))
+            elif method in ("Network.loadingFinished", "Network.loadingFailed"):
+                self.pending.pop(request_id, None)
+
+        stale = [rid for rid, started in self.pending.items() if now - started > self.FORGET_AFTER]
+        for request_id in stale:
+            del self.pending[request_id]
+
+    def inflight(self, long_request_s: float = 5.0) -> int:
+        """Число активных запросов, начатых не раньше long_request_s секунд назад."""
+        now = time.time()
+        return sum(1 for started in self.pending.values() if now - started < long_request_s)
+
+    def reset(self):
+        self.pending.clear()
@@ -0,0 +1,180 @@
+"""
+JS-скрипты, которые BrowserController выполняет внутри страницы.
+"""
+
+# Счётчик поколений DOM: MutationObserver увеличивает gen на каждую пачку
+# мутаций. doc — случайный id документа (меняется при навигации/перезагрузке).
+# Скрипт идемпотентен: повторная установка ничего не делает.
+DOM_OBSERVER_SCRIPT = """
+(function () {
+    if (window.__baDom) { return; }
+    var state = {
+        doc: Math.random().toString(36).slice(2) + Date.now().toString(36),
+        gen: 0,
+        last: Date.now()
+    };
+    window.__baDom = state;
+    new MutationObserver(function (records) {
+        for (var i = 0; i < records.length; i++) {
+            // Служебные атрибуты контроллера не считаются изменением страницы
+            var name = records[i].attributeName;
+            if (!name || name.indexOf('data-ba-') !== 0) {
+                state.gen++;
+                state.last = Date.now();
+                return;
+            }
+        }
+    }).observe(document, {
+        subtree: true, childList: true, attributes: true, characterData: true
+    });
+})();
+"""
+
+# Одна дешёвая команда: [url, title, id документа, поколение DOM].
+DOM_VERSION_SCRIPT = DOM_OBSERVER_SCRIPT + """
+var s = window.__baDom;
+return [location.href, document.title, s.doc, s.gen];
+"""
+
+# Извлечение состояния страницы за один round-trip (backend "js").
+# Видимость определяется по вычисленным стилям и геометрии, а не по inline-style.
+# arguments[0] — максимум интерактивных элементов, arguments[1] — лимит символов текста.
+# Возвращает {"text": [блоки видимого текста], "interactive": [{kind, aria, ...}]}.
+EXTRACT_PAGE_STATE_SCRIPT = """
+var maxItems = arguments[0], maxTextChars = arguments[1];
+var SKIP_TEXT = 'script,style,noscript,template,svg,head';
+var visibility = new Map();
+
+function isVisible(el) {
+    if (visibility.has(el)) { return visibility.get(el); }
+    var visible;
+    if (el.closest('[hidden],[aria-hidden="true"]')) {
+        visible = false;
+    } else if (el.checkVisibility) {
+        visible = el.checkVisibility({opacityProperty: true, visibilityProperty: true});
+    } else {
+        var style = getComputedStyle(el);
+        visible = style.display !== 'none' && style.visibility !== 'hidden'
+            && parseFloat(style.opacity) !== 0
+            && (!el.parentElement || isVisible(el.parentElement));
+    }
+    visibility.set(el, visible);
+    return visible;
+}
+
+function hasBox(el) {
+    var rect = el.getBoundingClientRect();
+    return rect.width > 0 || rect.height > 0;
+}
+
+function xpathOf(el) {
+    var id = el.getAttribute('id');
+    if (id && id.indexOf("'") < 0
+            && document.querySelectorAll('[id="' + CSS.escape(id) + '"]').length === 1) {
+        return "//*[@id='" + id + "']";
+    }
+    var parts = [];
+    for (var node = el; node && node.nodeType === 1; node = node.parentElement) {
+        var index = 0, count = 0;
+        var sibling = node.parentElement ? node.parentElement.firstElementChild : node;
+        for (; sibling; sibling = sibling.nextElementSibling) {
+            if (sibling.localName === node.localName) {
+                count++;
+                if (sibling === node) { index = count; }
+            }
+        }
+        parts.unshift(count > 1 ? node.localName + '[' + index + ']' : node.localName);
+    }
+    return '/' + parts.join('/');
+}
+
+var text = [], textChars = 0;
+if (document.body) {
+    var walker = document.createTreeWalker(document.body, NodeFilter.SHOW_TEXT);
+    while (textChars < maxTextChars && walker.nextNode()) {
+        var node = walker.currentNode, parent = node.parentElement;
+        var value = node.nodeValue.replace(/\\s+/g, ' ').trim();
+        if (!value || !parent || parent.closest(SKIP_TEXT) || !isVisible(parent)) { continue; }
+        text.push(value);
+        textChars += value.length + 1;
+    }
+}
+
+var groups = [['LINK', 'a'], ['BUTTON', 'button']];
+['button', 'link', 'checkbox', 'tab', 'menuitem', 'row', 'option'].forEach(function (role) {
+    groups.push(['ROLE[' + role + ']', '[role="' + role + '"]']);
+});
+groups.push(['TOOLTIP', '[data-tooltip]'], ['LABEL', '[data-label]']);
+
+var interactive = [];
+for (var g = 0; g < groups.length && interactive.length < maxItems; g++) {
+    var elements = document.querySelectorAll(groups[g][1]);
+    for (var i = 0; i < elements.length && interactive.length < maxItems; i++) {
+        var el = elements[i];
+        if (!isVisible(el) || !hasBox(el)) { continue; }
+        var item = {
+            kind: groups[g][0],
+            text: (el.textContent || '').replace(/\\s+/g, ' ').trim().slice(0, 80),
+            aria: el.getAttribute('aria-label'),
+            tooltip: el.getAttribute('data-tooltip'),
+            label: el.getAttribute('data-label'),
+            title: el.getAttribute('title'),
+            href: el.getAttribute('href'),
+            id: el.getAttribute('data-ba-id')
+        };
+        if (!(item.text || item.aria || item.tooltip || item.label || item.title || item.href)) {
+            continue;
+        }
+        item.xpath = xpathOf(el);
+        interactive.push(item);
+    }
+}
+
+return {text: text, interactive: interactive};
+"""
+
+# Селектор элементов, которые получают стабильный data-ba-id
+STAMP_SELECTOR = ",".join([
+    "a", "button", "input", "select", "textarea", "summary", "label",
+    "[role=button]", "[role=link]", "[role=checkbox]", "[role=radio]", "[role=tab]",
+    "[role=menuitem]", "[role=row]", "[role=option]", "[role=switch]",
+    "[role=textbox]", "[role=combobox]", "[role=searchbox]", "[role=treeitem]",
+    "[data-tooltip]", "[data-label]", "[contenteditable]", "[onclick]", "[tabindex]",
+])
+
+# Проставляет data-ba-id интерактивным элементам, у которых его ещё нет
+# (и тем, кто унаследовал чужой id при клонировании узла).
+# Возвращает только новые пары [id, element] — Selenium отдаёт их как WebElement.
+STAMP_ELEMENTS_SCRIPT = """
+var state = window.__baIds || (window.__baIds = {next: 1});
+var seen = new Set(), fresh = [];
+var elements = document.querySelectorAll(arguments[0]);
+for (var i = 0; i < elements.length; i++) {
+    var el = elements[i], id = el.getAttribute('data-ba-id');
+    if (id && !seen.has(id)) { seen.add(id); continue; }
+    id = String(state.next++);
+    el.setAttribute('data-ba-id', id);
+    seen.add(id);
+    fresh.push([Number(id), el]);
+}
+return fresh;
+"""
+
+# data-ba-id узла, найденного через CDP по backendNodeId (id вида "ax123").
+# Если у узла нет data-ba-id, он проставляется. this — сам DOM-узел.
+STAMP_NODE_FUNCTION = """
+function () {
+    var el = this.nodeType === 1 ? this : this.parentElement;
+    if (!el) { return null; }
+    if (!el.hasAttribute('data-ba-id')) {
+        var state = window.__baIds || (window.__baIds = {next: 1});
+        el.setAttribute('data-ba-id', String(state.next++));
+    }
+    return Number(el.getAttribute('data-ba-id'));
+}
+"""
+
+# Для wait_for_settle: [мс с последней мутации DOM, document.readyState].
+SETTLE_PROBE_SCRIPT = DOM_OBSERVER_SCRIPT + """
+return [Date.now() - window.__baDom.last, document.readyState];
+"""
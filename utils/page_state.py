@@ -0,0 +1,272 @@
+import json
+import math
+from collections import Counter
+from typing import Optional, List
+
+from lxml import etree
+
+from utils.history import estimate_tokens
+from utils.resolver import tokenize, element_role
+from utils.snapshot import PageSnapshot, describe_interactive, normalize_whitespace
+
+
+# Теги, начинающие новый текстовый блок
+BLOCK_TAGS = frozenset((
+    "html", "body", "div", "section", "article", "main", "aside", "header", "footer", "nav",
+    "p", "li", "ul", "ol", "dl", "dt", "dd", "table", "tr", "td", "th", "caption",
+    "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "pre", "form", "fieldset",
+    "legend", "label", "figure", "figcaption", "details", "summary", "option",
+))
+HEADING_TAGS = frozenset(("h1", "h2", "h3", "h4", "h5", "h6"))
+
+# Длинные блоки режутся на куски — иначе один абзац съедает бюджет целиком
+MAX_BLOCK_CHARS = 400
+
+# Априорные веса: интерактивность, заголовки, положение на странице
+INTERACTIVE_PRIOR = 0.3
+HEADING_PRIOR = 0.3
+POSITION_PRIOR = 0.4
+# Вес лексического совпадения с запросом (нормирован к 0..1 по лучшему элементу)
+LEXICAL_WEIGHT = 2.0
+
+
+def text_blocks(tree) -> List[tuple]:
+    """
+    [(тег блока, текст)] видимого дерева в порядке документа.
+
+    Текст относится к ближайшему предку из BLOCK_TAGS; подряд идущие куски
+    одного блока склеиваются, длинные блоки режутся по словам.
+    """
+    if tree is None:
+        return []
+    owners: dict = {}
+    pieces: List[tuple] = []
+
+    def add(owner, text):
+        if text and not text.isspace():
+            pieces.append((owner, text))
+
+    for event, el in etree.iterwalk(tree, events=("start", "end")):
+        if not isinstance(el.tag, str):
+            continue
+        if event == "start":
+            parent = el.getparent()
+            owners[el] = el if el.tag in BLOCK_TAGS or parent is None else owners.get(parent, el)
+            add(owners[el], el.text)
+        else:
+            parent = el.getparent()
+            if parent is not None:
+                add(owners.get(parent, parent), el.tail)
+
+    blocks: List[tuple] = []
+    current, buffer = None, []
+    for owner, text in pieces + [(None, "")]:
+        if owner is not current and buffer:
+            blocks.extend(_split_block(current.tag, normalize_whitespace(" ".join(buffer))))
+            buffer = []
+        current = owner
+        if text:
+            buffer.append(text)
+    return [(tag, text) for tag, text in blocks if text]
+
+
+def _split_block(tag: str, text: str) -> List[tuple]:
+    if len(text) <= MAX_BLOCK_CHARS:
+        return [(tag, text)]
+    parts, start = [], 0
+    while start < len(text):
+        end = start + MAX_BLOCK_CHARS
+        if end < len(text):
+            space = text.rfind(" ", start, end)
+            if space > start:
+                end = space
+        parts.append((tag, text[start:end].strip()))
+        start = end
+    return parts
+
+
+def element_prefix(el) -> str:
+    """Префикс строки элемента — как в interactive_summary (LINK, BUTTON, ROLE[...])."""
+    if el.get("role"):
+        return f"ROLE[{el.get('role')}]"
+    if el.tag == "a":
+        return "LINK"
+    if el.tag == "button":
+        return "BUTTON"
+    role = element_role(el)
+    return role.upper() if role != el.tag else el.tag.upper()
+
+
+class BudgetedPageState:
+    """
+    Состояние страницы, собранное под бюджет токенов по релевантности.
+
+    Элементы — текстовые блоки видимой части страницы и видимые интерактивные
+    элементы. Оценка каждого:
+        LEXICAL_WEIGHT × BM25(запрос) / лучший BM25
+        + POSITION_PRIOR × (1 − положение в документе)
+        + INTERACTIVE_PRIOR (элементы) / HEADING_PRIOR (h1–h6)
+    делённая на номер повтора строки (k-я одинаковая строка — в k раз ниже).
+    Невидимое отброшено заранее (visible_tree, is_interactable). Без запроса
+    остаются только априорные веса — верх страницы и элементы управления.
+
+    Страница 1 — жадное заполнение бюджета по убыванию оценки, страница 2 —
+    то же по оставшимся, и т.д. Выбранное выводится в порядке документа;
+    пропуски между текстовыми блоками помечены, в конце — что осталось и как
+    запросить следующую страницу (действие get_page_state).
+    """
+
+    def __init__(self, snapshot: PageSnapshot, query: str = "", k1: float = 1.2, b: float = 0.75):
+        self.snapshot = snapshot
+        self.query = query or ""
+        self.items: List[dict] = []
+
+        for tag, text in text_blocks(snapshot.visible_tree()):
+            self.items.append({
+                "kind": "text",
+                "line": text,
+                "tokens": tokenize(text),
+                "heading": tag in HEADING_TAGS,
+            })
+        for el, fields in snapshot.interactive_fields():
+            line = describe_interactive(element_prefix(el), fields)
+            if not line:
+                continue
+            self.items.append({
+                "kind": "element",
+                "line": line,
+                "tokens": tokenize(" ".join(
+                    str(fields[key]) for key in ("aria", "tooltip", "label", "title", "text") if fields[key]
+                )),
+                "heading": False,
+            })
+
+        self._score(k1, b)
+        self._pages: List[List[int]] = []
+        self._remaining = sorted(range(len(self.items)), key=lambda i: -self.items[i]["score"])
+
+    def _score(self, k1: float, b: float):
+        total = len(self.items)
+        for item in self.items:
+            item["cost"] = estimate_tokens(item["line"]) + 1
+        terms = set(tokenize(self.query))
+        lexical = [0.0] * total
+        if terms and total:
+            frequencies = Counter()
+            for item in self.items:
+                frequencies.update(terms.intersection(item["tokens"]))
+            average = sum(len(item["tokens"]) for item in self.items) / total or 1.0
+            for index, item in enumerate(self.items):
+                counts = Counter(token for token in item["tokens"] if token in terms)
+                length_norm = 1 - b + b * len(item["tokens"]) / average
+                for token, freq in counts.items():
+                    idf = math.log(1 + (total - frequencies[token] + 0.5) / (frequencies[token] + 0.5))
+                    lexical[index] += idf * freq * (k1 + 1) / (freq + k1 * length_norm)
+        best = max(lexical, default=0.0) or 1.0
+        kinds = Counter(item["kind"] for item in self.items)
+        positions: Counter = Counter()
+        repeats: Counter = Counter()
+        for index, item in enumerate(self.items):
+            # Положение считается внутри своего вида: элементы идут в items после текста
+            position = positions[item["kind"]] / kinds[item["kind"]]
+            positions[item["kind"]] += 1
+            # Одинаковые строки ("В корзину" × 500) не должны вытеснять всё остальное
+            repeats[item["line"]] += 1
+            item["score"] = (
+                LEXICAL_WEIGHT * lexical[index] / best
+                + POSITION_PRIOR * (1 - position)
+                + (INTERACTIVE_PRIOR if item["kind"] == "element" else 0.0)
+                + (HEADING_PRIOR if item["heading"] else 0.0)
+            ) / repeats[item["line"]]
+            item["relevant"] = lexical[index] > 0
+
+    def page(self, number: int, budget_tokens: int) -> List[int]:
+        """Индексы элементов страницы number (с 1) при бюджете budget_tokens."""
+        while len(self._pages) < number and self._remaining:
+            chosen, rest, spent = [], [], 0
+            for index in self._remaining:
+                cost = self.items[index]["cost"]
+                # Первый элемент страницы берётся всегда — даже если он один больше бюджета
+                if spent + cost <= budget_tokens or not chosen:
+                    chosen.append(index)
+                    spent += cost
+                else:
+                    rest.append(index)
+            self._pages.append(sorted(chosen))
+            self._remaining = rest
+        return self._pages[number - 1] if number <= len(self._pages) else []
+
+    def render(self, budget_tokens: int, number: int = 1) -> str:
+        indices = self.page(number, budget_tokens)
+        # Страницы не сбрасываются при смене бюджета — их границы задаёт первый запрос
+        remaining_cost = sum(self.items[i]["cost"] for i in self._remaining)
+        total_pages = len(self._pages) + math.ceil(remaining_cost / max(1, budget_tokens))
+
+        text_lines: List[str] = []
+        element_lines: List[str] = []
+        # Текстовые блоки идут в items первыми, индексы 0..text_count-1
+        text_count = sum(1 for item in self.items if item["kind"] == "text")
+        last = -1
+        for index in indices:
+            item = self.items[index]
+            if item["kind"] == "element":
+                element_lines.append(item["line"])
+                continue
+            # Пропущенные блоки между выбранными — одной строкой-маркером
+            if index - last > 1:
+                text_lines.append(f"[… пропущено блоков: {index - last - 1}]")
+            text_lines.append(item["line"])
+            last = index
+        if text_lines and text_count - last > 1:
+            text_lines.append(f"[… пропущено блоков: {text_count - last - 1}]")
+
+        later = [self.items[i] for i in self._remaining] + [
+            self.items[i] for pages in self._pages[number:] for i in pages
+        ]
+        header = f"(по релевантности к запросу, страница {number}"
+        header += f" из ~{total_pages})" if total_pages > 1 else ")"
+        parts = [
+            f"[VISIBLE TEXT] {header}:",
+            "\n".join(text_lines) or "[нет текста на этой странице]",
+            "",
+            "[INTERACTIVE ELEMENTS]:",
+            "\n".join(element_lines) or "[no interactive elements summary]",
+        ]
+        if later or number > 1:
+            parts.append("")
+            parts.append(self._omitted_marker(later, number))
+        return "\n".join(parts)
+
+    @staticmethod
+    def _omitted_marker(later: List[dict], number: int) -> str:
+        texts = [item for item in later if item["kind"] == "text"]
+        elements = [item for item in later if item["kind"] == "element"]
+        relevant = sum(1 for item in later if item["relevant"])
+        marker = (
+            f"[OMITTED]: текстовых блоков {len(texts)} (~{sum(i['cost'] for i in texts)} токенов), "
+            f"элементов {len(elements)} (~{sum(i['cost'] for i in elements)} токенов)"
+        )
+        if relevant:
+            marker += f", из них совпадают с запросом: {relevant}"
+        if later:
+            marker += (
+                f". Следующая страница: "
+                f"{json.dumps({'function': 'get_page_state', 'args': {'page': number + 1}})}"
+            )
+        if number > 1:
+            shown = "1" if number == 2 else f"1–{number - 1}"
+            marker += f". Уже показаны страницы: {shown}"
+        return marker
+
+
+def budgeted_page_state(
+    snapshot: PageSnapshot,
+    query: str = "",
+    budget_tokens: int = 6000,
+    page: int = 1,
+) -> str:
+    """Состояние страницы под бюджет; ранжирование кэшируется в снимке по запросу."""
+    state: Optional[BudgetedPageState] = snapshot.memoize(
+        ("budgeted_state", query or ""), lambda: BudgetedPageState(snapshot, query)
+    )
+    return state.render(budget_tokens, max(1, page))
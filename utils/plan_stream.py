@@ -0,0 +1,103 @@
+import json
+import re
+from typing import Optional, List
+
+
+class PlanStreamParser:
+    """
+    Инкрементальный разбор ответа планирующей модели по мере генерации.
+
+    feed(delta) принимает очередной кусок текста и возвращает список объектов
+    из action_sequence, которые закрылись в этом куске (dict, как в JSON;
+    None — если объект действия не удалось разобрать).
+    Значение "status" верхнего уровня доступно в status, как только строка
+    закрыта. Весь полученный текст — в text. Если хотя бы одно действие
+    закрылось раньше, чем стал известен status, выставляется status_late —
+    такие ответы нельзя исполнять на лету.
+
+    Разбор посимвольный и за O(длина ответа): строки/экранирование учитываются,
+    поэтому скобки внутри строковых значений не ломают вложенность.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.status: Optional[str] = None
+        self.status_late = False
+        self._pos = 0
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._key: Optional[str] = None
+        self._after_colon = False
+        self._action_start: Optional[int] = None
+
+    def feed(self, delta: str) -> List[dict]:
+        self.text += delta
+        actions: List[dict] = []
+        text = self.text
+
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._stack == ["{"]:
+                        self._top_level_string(text[self._string_start:i + 1])
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch in "{[":
+                if (
+                    ch == "{"
+                    and self._stack == ["{", "["]
+                    and self._key == "action_sequence"
+                ):
+                    self._action_start = i
+                self._stack.append(ch)
+            elif ch in "}]":
+                if self._stack:
+                    self._stack.pop()
+                if (
+                    ch == "}"
+                    and self._action_start is not None
+                    and self._stack == ["{", "["]
+                ):
+                    action = self._parse_object(text[self._action_start:i + 1])
+                    self._action_start = None
+                    if self.status is None:
+                        self.status_late = True
+                    actions.append(action)
+            elif len(self._stack) == 1:
+                if ch == ":":
+                    self._after_colon = True
+                elif ch == ",":
+                    self._after_colon = False
+
+        self._pos = len(text)
+        return actions
+
+    def _top_level_string(self, literal: str):
+        try:
+            value = json.loads(literal)
+        except ValueError:
+            return
+        if not self._after_colon:
+            self._key = value
+        elif self._key == "status":
+            self.status = value
+
+    @staticmethod
+    def _parse_object(raw: str) -> Optional[dict]:
+        # Висячие запятые модель иногда оставляет — чиним так же, как для всего ответа
+        try:
+            value = json.loads(re.sub(r',(\s*[\]}])', r'\1', raw))
+        except ValueError:
+            return None
+        return value if isinstance(value, dict) else None
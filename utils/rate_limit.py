@@ -0,0 +1,193 @@
+import email.utils
+import random
+import re
+import threading
+import time
+from typing import Optional, Mapping
+
+
+class RateLimitTimeout(Exception):
+    """Лимит не освободился до дедлайна запроса."""
+
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Длительность из заголовков OpenAI: "20ms", "1s", "6m0s", "1h2m3.5s" → секунды."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def parse_retry_after(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """Сколько ждать по retry-after-ms / Retry-After (секунды или HTTP-дата)."""
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        moment = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(moment.timestamp() - time.time(), 0.0)
+
+
+class TokenBucket:
+    """Ведро на capacity единиц в минуту с непрерывным пополнением."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        rate = self.capacity / 60.0
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        # Запрос больше ёмкости ждёт полного ведра, а не вечно
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / (self.capacity / 60.0)
+
+
+class RateLimiter:
+    """
+    Клиентский лимит запросов к API: два token bucket'а — запросы/мин и токены/мин.
+
+    - acquire() перед запросом ждёт, пока хватит обоих вёдер (и пока не
+      истечёт пауза, назначенная сервером);
+    - update_from_headers() подстраивает вёдра под x-ratelimit-* ответа;
+    - penalize() — пауза для всех вызывающих после 429 с Retry-After;
+    - settle() — поправка на фактический расход токенов из usage;
+    - refund() — возврат резерва попытки, завершившейся ошибкой.
+    Потокобезопасен; общий экземпляр на модель — shared_rate_limiter().
+    """
+
+    def __init__(self, requests_per_minute: float = 500, tokens_per_minute: float = 200000):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+        self.stats = {"acquired": 0, "waited_seconds": 0.0, "penalties": 0}
+
+    def acquire(
+        self,
+        tokens: int,
+        deadline: Optional[float] = None,
+        cancel: Optional[threading.Event] = None,
+    ) -> Optional[float]:
+        """
+        Резервирует 1 запрос и tokens токенов; возвращает время ожидания, сек.
+        None — ожидание прервано cancel, ничего не зарезервировано.
+        """
+        started = time.monotonic()
+        while True:
+            if cancel is not None and cancel.is_set():
+                return None
+            with self._lock:
+                now = time.monotonic()
+                self.requests.refill(now)
+                self.tokens.refill(now)
+                wait = max(
+                    self.blocked_until - now,
+                    self.requests.wait_time(1),
+                    self.tokens.wait_time(tokens),
+                )
+                if wait <= 0:
+                    self.requests.tokens -= 1
+                    self.tokens.tokens -= min(tokens, self.tokens.capacity)
+                    waited = now - started
+                    self.stats["acquired"] += 1
+                    self.stats["waited_seconds"] += waited
+                    return waited
+            if deadline is not None and time.monotonic() + wait > deadline:
+                raise RateLimitTimeout(f"Rate limit would not free up before deadline (wait {wait:.1f}s)")
+            if cancel is not None:
+                if cancel.wait(wait):
+                    return None
+            else:
+                time.sleep(wait)
+
+    def settle(self, estimated: int, actual: Optional[int]):
+        """Возвращает в ведро переоценку (или досписывает недооценку) токенов."""
+        if actual is None:
+            return
+        with self._lock:
+            self.tokens.tokens = min(self.tokens.capacity, self.tokens.tokens + estimated - actual)
+
+    def refund(self, tokens: int):
+        """Возвращает в ведро токены, зарезервированные acquire() под неудавшуюся попытку."""
+        with self._lock:
+            self.tokens.tokens = min(self.tokens.capacity, self.tokens.tokens + min(tokens, self.tokens.capacity))
+
+    def penalize(self, seconds: float):
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.stats["penalties"] += 1
+
+    def update_from_headers(self, headers: Optional[Mapping[str, str]]):
+        if not headers:
+            return
+        now = time.monotonic()
+        with self._lock:
+            for bucket, name in ((self.requests, "requests"), (self.tokens, "tokens")):
+                limit = headers.get(f"x-ratelimit-limit-{name}")
+                remaining = headers.get(f"x-ratelimit-remaining-{name}")
+                try:
+                    if limit is not None:
+                        bucket.capacity = float(limit)
+                    if remaining is not None:
+                        bucket.refill(now)
+                        bucket.tokens = min(bucket.tokens, float(remaining))
+                except ValueError:
+                    continue
+                if remaining is not None and bucket.tokens <= 0:
+                    reset = parse_duration(headers.get(f"x-ratelimit-reset-{name}"))
+                    if reset:
+                        self.blocked_until = max(self.blocked_until, now + reset)
+
+    @staticmethod
+    def backoff(attempt: int, base: float = 1.0, cap: float = 30.0) -> float:
+        """Экспоненциальная задержка с полным джиттером: U(0, min(cap, base·2^attempt))."""
+        return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+_shared: dict[str, RateLimiter] = {}
+_shared_lock = threading.Lock()
+
+
+def shared_rate_limiter(
+    key: str,
+    requests_per_minute: float = 500,
+    tokens_per_minute: float = 200000,
+) -> RateLimiter:
+    """Один RateLimiter на ключ (модель) на весь процесс — для всех AssistantAI и потоков."""
+    with _shared_lock:
+        limiter = _shared.get(key)
+        if limiter is None:
+            limiter = _shared[key] = RateLimiter(requests_per_minute, tokens_per_minute)
+        return limiter
@@ -0,0 +1,105 @@
+import json
+import os
+import threading
+import time
+from typing import Optional, Iterator
+
+from utils.llm_cache import LLMCache
+
+
+class ReplayMiss(Exception):
+    """В режиме replay для запроса нет записи."""
+
+
+class ReplayStore:
+    """
+    Запись и воспроизведение ответов модели для офлайн-прогонов и бенчмарков.
+
+    Файл — JSONL, одна запись на строку:
+        {"key", "model", "content", "latency", "usage": {"prompt_tokens", "completion_tokens"}}
+    key — тот же хэш (модель, сообщения), что у LLMCache, поэтому запись
+    находится и при незначимых различиях в пробелах. При повторной записи
+    того же ключа действует последняя строка.
+
+    mode:
+        "record" — запросы идут в API, ответы и задержки дописываются в файл;
+        "replay" — ответы берутся из файла, при отсутствии — ReplayMiss;
+                   с replay_latency=True выдерживается записанная задержка.
+    """
+
+    def __init__(self, path: str, mode: str = "replay", replay_latency: bool = False):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown replay mode: {mode!r} (expected record or replay)")
+        self.path = path
+        self.mode = mode
+        self.replay_latency = replay_latency
+        self._entries: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self.stats = {"recorded": 0, "replayed": 0, "misses": 0}
+        self.load()
+
+    make_key = staticmethod(LLMCache.make_key)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as file:
+            for line in file:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(entry, dict) and "key" in entry and "content" in entry:
+                    self._entries[entry["key"]] = entry
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            return self._entries.get(key)
+
+    def lookup(self, model: str, messages: list[dict], wait: bool = True) -> dict:
+        """
+        Запись для запроса (режим replay). При replay_latency и wait=True
+        выдерживает записанную задержку (потоковый режим распределяет её сам).
+        """
+        entry = self.get(self.make_key(model, messages))
+        if entry is None:
+            with self._lock:
+                self.stats["misses"] += 1
+            raise ReplayMiss(f"No recorded response for model {model!r} in {self.path}")
+        if self.replay_latency and wait:
+            time.sleep(entry.get("latency") or 0.0)
+        with self._lock:
+            self.stats["replayed"] += 1
+        return entry
+
+    def record(self, model: str, messages: list[dict], content: str, latency: float, usage=None):
+        entry = {
+            "key": self.make_key(model, messages),
+            "model": model,
+            "content": content,
+            "latency": round(latency, 4),
+            "usage": {
+                "prompt_tokens": getattr(usage, "prompt_tokens", None),
+                "completion_tokens": getattr(usage, "completion_tokens", None),
+            },
+        }
+        with self._lock:
+            self._entries[entry["key"]] = entry
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.stats["recorded"] += 1
+
+
+def split_content(content: str, piece_chars: int = 24) -> Iterator[str]:
+    """Режет ответ на куски, похожие на дельты потокового ответа."""
+    for start in range(0, len(content), piece_chars):
+        yield content[start:start + piece_chars]
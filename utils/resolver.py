@@ -0,0 +1,261 @@
+import functools
+import json
+import math
+import re
+import time
+from collections import Counter
+from typing import Optional, List
+
+from utils.snapshot import PageSnapshot, describe_interactive, is_editable
+
+
+_WORD_RE = re.compile(r"\w+", re.U)
+
+# Окончания, которые срезаются до транслитерации: "папку"/"папка" → "папк"
+_RU_ENDING_RE = re.compile(r"[аеёиоуыэюяйь]+$")
+
+_TRANSLIT = str.maketrans({
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e", "ж": "zh",
+    "з": "z", "и": "i", "й": "i", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o",
+    "п": "p", "р": "r", "с": "s", "т": "t", "у": "u", "ф": "f", "х": "h", "ц": "c",
+    "ч": "ch", "ш": "sh", "щ": "sch", "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "yu",
+    "я": "ya",
+})
+
+# Слова запроса, которые не описывают сам элемент
+STOP_WORDS = {
+    "найди", "найти", "найдите", "где", "покажи", "нужно", "нужен", "нужна", "элемент",
+    "элемента", "страница", "странице", "страницы", "на", "в", "во", "с", "со", "и",
+    "для", "по", "к", "от", "это", "этот", "эту", "который", "которая", "которое", "мне",
+    "верни", "xpath", "id", "find", "locate", "get", "the", "a", "an", "to", "of", "on",
+    "in", "for", "and", "element", "page", "please", "with", "that", "which", "return",
+    "папка", "папку", "иконка", "иконку", "значок", "folder", "icon",
+}
+
+# Слова запроса → роль элемента (учитывается как бонус/штраф, а не как текст)
+ROLE_WORDS = {
+    "ссылка": "link", "ссылку": "link", "ссылки": "link", "link": "link",
+    "кнопка": "button", "кнопку": "button", "кнопки": "button", "button": "button",
+    "чекбокс": "checkbox", "флажок": "checkbox", "галочку": "checkbox", "checkbox": "checkbox",
+    "поле": "textbox", "поля": "textbox", "input": "textbox", "field": "textbox",
+    "textbox": "textbox", "строка": "row", "строку": "row", "row": "row",
+    "вкладка": "tab", "вкладку": "tab", "tab": "tab",
+    "пункт": "menuitem", "menuitem": "menuitem",
+}
+
+# Поля элемента и их вес в документе BM25
+FIELD_WEIGHTS = (("aria", 2), ("tooltip", 2), ("label", 2), ("title", 2), ("text", 1))
+
+# Множитель, если запрос целиком совпал с полем (метка весомее текста)
+EXACT_BONUS = {"aria": 1.5, "tooltip": 1.5, "label": 1.5, "title": 1.5, "text": 1.2}
+
+
+@functools.lru_cache(maxsize=65536)
+def normalize_token(token: str) -> str:
+    """Токен → общая латинская форма: "Спам" и "spam" совпадают, окончания срезаны."""
+    token = token.lower().replace("ё", "е")
+    if not token.isascii():
+        token = _RU_ENDING_RE.sub("", token) or token
+        token = token.translate(_TRANSLIT)
+    return token[:8]
+
+
+def tokenize(text: str) -> List[str]:
+    return [normalize_token(word) for word in _WORD_RE.findall(text or "") if len(word) > 1 or word.isdigit()]
+
+
+def parse_prompt(prompt: str) -> tuple:
+    """(роли из слов-ролей, нормализованные значимые слова) запроса get_details."""
+    roles = set()
+    terms: List[str] = []
+    for word in _WORD_RE.findall((prompt or "").lower()):
+        if word in ROLE_WORDS:
+            roles.add(ROLE_WORDS[word])
+        elif word not in STOP_WORDS and (len(word) > 1 or word.isdigit()):
+            terms.append(normalize_token(word))
+    return roles, terms
+
+
+def element_role(el) -> str:
+    role = el.get("role")
+    if role:
+        return role
+    tag = el.tag
+    if tag == "a":
+        return "link"
+    if tag == "input":
+        kind = (el.get("type") or "text").lower()
+        if kind in ("checkbox", "radio"):
+            return kind
+        if kind in ("button", "submit", "reset", "image"):
+            return "button"
+        return "textbox"
+    if tag in ("textarea", "select"):
+        return "textbox"
+    return tag
+
+
+def _trigrams(token: str) -> set:
+    padded = f" {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ElementResolver:
+    """
+    Локальный поиск элемента по запросу get_details — без обращения к LLM.
+
+    По видимым интерактивным элементам снимка строится инвертированный индекс
+    токенов из aria-label, data-tooltip, data-label, title и текста (метки
+    весят вдвое больше текста, полное совпадение запроса с полем — бонус).
+    Токены приводятся к общей латинской форме, поэтому "Спам" находит
+    "Spam". Кандидаты ранжируются по BM25; слова запроса, которых нет в
+    словаре, сопоставляются нечётко (похожесть по триграммам). Слова-роли
+    ("ссылку", "checkbox") не ищутся в тексте, а ограничивают кандидатов
+    элементами с такой ролью (element_role): лучше отдать запрос модели,
+    чем вернуть ссылку вместо чекбокса.
+
+    Ответ возвращается, только если уверенность не ниже min_confidence:
+        уверенность = покрытие запроса лучшим кандидатом (доля IDF-веса)
+                      × отрыв от второго кандидата (насыщается на margin).
+    Иначе None — и вызывающий идёт к LLM. Счётчики — в stats.
+    """
+
+    def __init__(
+        self,
+        min_confidence: float = 0.6,
+        margin: float = 0.3,
+        fuzzy_threshold: float = 0.55,
+        k1: float = 1.2,
+        b: float = 0.75,
+    ):
+        self.min_confidence = min_confidence
+        self.margin = margin
+        self.fuzzy_threshold = fuzzy_threshold
+        self.k1 = k1
+        self.b = b
+        self.stats = {"queries": 0, "resolved": 0, "fallbacks": 0, "seconds": 0.0}
+
+    def _index(self, snapshot: PageSnapshot) -> dict:
+        def build():
+            docs = []
+            postings: dict = {}
+            for el, fields in snapshot.interactive_fields():
+                tokens: List[str] = []
+                for name, weight in FIELD_WEIGHTS:
+                    value = fields.get(name)
+                    if value:
+                        tokens.extend(tokenize(value) * weight)
+                if not tokens:
+                    continue
+                counts = Counter(tokens)
+                doc_id = len(docs)
+                docs.append({
+                    "el": el,
+                    "fields": fields,
+                    "length": len(tokens),
+                    "role": element_role(el),
+                    # Наборы токенов каждого поля — для бонуса за точное совпадение
+                    "exact": {name: frozenset(tokenize(fields[name])) for name, _ in FIELD_WEIGHTS if fields.get(name)},
+                })
+                for token, freq in counts.items():
+                    postings.setdefault(token, []).append((doc_id, freq))
+            average = sum(d["length"] for d in docs) / len(docs) if docs else 0.0
+            return {"docs": docs, "postings": postings, "average": average}
+        return snapshot.memoize(("resolver_index",), build)
+
+    def _expand(self, token: str, postings: dict) -> List[tuple]:
+        """[(токен словаря, вес)]: точное совпадение или нечёткие соседи."""
+        if token in postings:
+            return [(token, 1.0)]
+        grams = _trigrams(token)
+        matches = []
+        for candidate in postings:
+            if abs(len(candidate) - len(token)) > 3:
+                continue
+            other = _trigrams(candidate)
+            similarity = len(grams & other) / len(grams | other)
+            if similarity >= self.fuzzy_threshold:
+                matches.append((candidate, similarity))
+        return matches
+
+    def resolve(self, snapshot: PageSnapshot, prompt: str) -> Optional[str]:
+        """JSON в формате analyze_html_chunked или None, если уверенности не хватает."""
+        started = time.perf_counter()
+        self.stats["queries"] += 1
+        try:
+            result = self._resolve(snapshot, prompt)
+        finally:
+            self.stats["seconds"] += time.perf_counter() - started
+        self.stats["resolved" if result is not None else "fallbacks"] += 1
+        return result
+
+    def _resolve(self, snapshot: PageSnapshot, prompt: str) -> Optional[str]:
+        index = self._index(snapshot)
+        docs, postings = index["docs"], index["postings"]
+        if not docs:
+            return None
+
+        roles, terms = parse_prompt(prompt)
+        if not terms:
+            return None
+
+        total_docs = len(docs)
+        scores: Counter = Counter()
+        matched: dict = {}
+        query_weight = 0.0
+        for term in dict.fromkeys(terms):
+            expansions = self._expand(term, postings)
+            # Вес термина запроса — IDF лучшего совпадения (или максимальный, если совпадений нет)
+            best_idf = math.log(1 + total_docs)
+            term_weight = 0.0
+            for token, similarity in expansions:
+                entries = postings[token]
+                idf = math.log(1 + (total_docs - len(entries) + 0.5) / (len(entries) + 0.5))
+                term_weight = max(term_weight, idf)
+                for doc_id, freq in entries:
+                    length_norm = 1 - self.b + self.b * docs[doc_id]["length"] / index["average"]
+                    score = idf * freq * (self.k1 + 1) / (freq + self.k1 * length_norm) * similarity
+                    scores[doc_id] += score
+                    matched.setdefault(doc_id, {})
+                    matched[doc_id][term] = max(matched[doc_id].get(term, 0.0), idf * similarity)
+            query_weight += term_weight or best_idf
+
+        if roles:
+            scores = Counter({doc_id: score for doc_id, score in scores.items() if docs[doc_id]["role"] in roles})
+        if not scores:
+            return None
+        wanted = frozenset(terms)
+        for doc_id in scores:
+            doc = docs[doc_id]
+            exact = [EXACT_BONUS[name] for name, tokens in doc["exact"].items() if tokens == wanted]
+            if exact:
+                scores[doc_id] *= max(exact)
+
+        ranked = scores.most_common(2)
+        best_id, best = ranked[0]
+        second = ranked[1][1] if len(ranked) > 1 else 0.0
+        coverage = min(1.0, sum(matched[best_id].values()) / query_weight) if query_weight else 0.0
+        lead = (best - second) / best if best else 0.0
+        confidence = coverage * min(1.0, lead / self.margin)
+        if confidence < self.min_confidence:
+            return None
+
+        doc = docs[best_id]
+        el = doc["el"]
+        fields = doc["fields"]
+        ba_id = fields.get("id")
+        element = {
+            "description": describe_interactive(el.tag, fields) or el.tag,
+            "id": int(ba_id) if (ba_id or "").isdigit() else None,
+            "xpath": snapshot.locator_index().locator(el),
+            "action": "enter" if is_editable(el) else "click",
+        }
+        return json.dumps(
+            {
+                "found": True,
+                "elements": [element],
+                "page_context": "Найдено локально по aria-label/tooltip/тексту без запроса к модели",
+                "meta": {"resolver": "local", "confidence": round(confidence, 3)},
+            },
+            ensure_ascii=False,
+        )
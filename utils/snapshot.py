@@ -0,0 +1,791 @@
+import copy
+import json
+import re
+from difflib import SequenceMatcher
+from typing import Optional, List, Literal, Callable, Any
+
+from lxml import etree
+from lxml import html as lxml_html
+
+from utils.tracing import span
+from utils.locators import LocatorIndex
+
+
+# Теги, которые никогда не несут полезной для LLM информации
+JUNK_TAGS = ("script", "style", "noscript", "svg", "head", "meta", "link")
+
+_PARSER = lxml_html.HTMLParser(encoding="utf-8")
+
+# Всё, по чему модель может захотеть кликнуть или что-то ввести.
+# Один проход по дереву с общим предикатом — объединение "//a | //button | ..."
+# обходило документ на каждую ветку
+INTERACTIVE_XPATH = (
+    "//*[self::a or self::button or self::input or self::select or self::textarea"
+    " or self::summary or self::label or @role or @data-tooltip or @data-label"
+    " or @data-ba-id or @contenteditable or @onclick or @tabindex]"
+)
+
+# Кусок меньше этой доли бюджета не отправляется отдельно — он приклеивается к соседнему
+MIN_CHUNK_RATIO = 0.25
+
+NON_TEXT_INPUT_TYPES = ("hidden", "checkbox", "radio", "button", "submit", "image", "reset", "file")
+EDITABLE_ROLES = ("textbox", "searchbox", "combobox")
+
+
+class LocatorError(Exception):
+    """
+    Локатор не прошёл проверку по снимку страницы.
+
+    reason: "invalid_xpath" | "no_match" | "multiple" | "not_interactable" | "not_editable".
+    candidates — ближайшие подходящие элементы ({"id", "xpath", "description"}).
+    """
+
+    def __init__(self, reason: str, xpath: str, matches: int = 0, candidates: Optional[List[dict]] = None):
+        self.reason = reason
+        self.xpath = xpath
+        self.matches = matches
+        self.candidates = candidates or []
+        super().__init__(json.dumps(self.to_dict(), ensure_ascii=False))
+
+    def to_dict(self) -> dict:
+        return {
+            "error": self.reason,
+            "xpath": self.xpath,
+            "matches": self.matches,
+            "candidates": self.candidates,
+        }
+
+
+def normalize_whitespace(text: str) -> str:
+    return " ".join(text.split())
+
+
+def truncate(text: str, max_chars: int, sep: str = "\n") -> str:
+    if len(text) > max_chars:
+        return text[:max_chars] + f"{sep}[...TRUNCATED...]"
+    return text
+
+
+def is_hidden(el) -> bool:
+    """Элемент заведомо скрыт (hidden, aria-hidden, display:none и т.п.)."""
+    if el.get("hidden") is not None:
+        return True
+    if el.get("aria-hidden") == "true":
+        return True
+    style = (el.get("style") or "").lower().replace(" ", "")
+    return (
+        "display:none" in style
+        or "visibility:hidden" in style
+        or "opacity:0" in style
+    )
+
+
+def drop_element(el):
+    """Удаляет элемент из дерева, сохраняя его tail-текст (как decompose в BeautifulSoup)."""
+    parent = el.getparent()
+    if parent is None:
+        return
+    if el.tail:
+        previous = el.getprevious()
+        if previous is not None:
+            previous.tail = (previous.tail or "") + el.tail
+        else:
+            parent.text = (parent.text or "") + el.tail
+    parent.remove(el)
+
+
+def strip_junk(root):
+    """Удаляет мусорные теги, комментарии и processing instructions (in-place)."""
+    junk = [
+        el for el in root.iter()
+        if not isinstance(el.tag, str) or el.tag in JUNK_TAGS
+    ]
+    for el in junk:
+        drop_element(el)
+    return root
+
+
+def strip_hidden(root):
+    """Удаляет заведомо скрытые элементы (in-place)."""
+    hidden = [el for el in root.iter() if isinstance(el.tag, str) and is_hidden(el)]
+    for el in hidden:
+        drop_element(el)
+    return root
+
+
+def parse_html(html: str):
+    """Единственная точка парсинга HTML в lxml-дерево. Пустой HTML → None."""
+    if isinstance(html, bytes):
+        data = html
+    else:
+        data = (html or "").encode("utf-8", errors="ignore")
+    if not data.strip():
+        return None
+    PageSnapshot.parse_count += 1
+    try:
+        return lxml_html.document_fromstring(data, parser=_PARSER)
+    except (etree.ParserError, ValueError):
+        return None
+
+
+def is_editable(el) -> bool:
+    tag = el.tag if isinstance(el.tag, str) else ""
+    if tag == "input":
+        return (el.get("type") or "text").lower() not in NON_TEXT_INPUT_TYPES
+    if tag in ("textarea", "select"):
+        return True
+    if el.get("contenteditable") is not None and el.get("contenteditable") != "false":
+        return True
+    return el.get("role") in EDITABLE_ROLES
+
+
+def leading_text(el, max_chars: int = 80) -> str:
+    """normalize_whitespace(текст элемента)[:max_chars] без обхода всего поддерева."""
+    parts: List[str] = []
+    visible = 0
+    for piece in el.itertext():
+        parts.append(piece)
+        # После max_chars непробельных символов префикс результата уже не изменится
+        visible += len("".join(piece.split()))
+        if visible >= max_chars:
+            break
+    return normalize_whitespace(" ".join(parts))[:max_chars]
+
+
+def element_fields(el) -> dict:
+    """Описательные поля элемента для подсказок модели."""
+    return {
+        "text": leading_text(el),
+        "aria": el.get("aria-label"),
+        "tooltip": el.get("data-tooltip"),
+        "label": el.get("data-label"),
+        "title": el.get("title") or el.get("placeholder") or el.get("name"),
+        "href": el.get("href"),
+        "id": el.get("data-ba-id"),
+    }
+
+
+def describe_interactive(prefix: str, fields: dict) -> Optional[str]:
+    """
+    Строка для списка интерактивных элементов:
+    "PREFIX [id=17]: aria=... | tooltip=... | label=... | title=... | text=... | href=...".
+    fields — text/aria/tooltip/label/title/href (+ опционально id = data-ba-id и xpath).
+    """
+    text = (fields.get("text") or "")[:80]
+    aria = (fields.get("aria") or "")[:80]
+    tooltip = (fields.get("tooltip") or "")[:80]
+    label = (fields.get("label") or "")[:80]
+    title = (fields.get("title") or "")[:80]
+    href = (fields.get("href") or "")[:120]
+
+    desc_parts = []
+    if aria:
+        desc_parts.append(f"aria={aria}")
+    if tooltip:
+        desc_parts.append(f"tooltip={tooltip}")
+    if label:
+        desc_parts.append(f"label={label}")
+    if title:
+        desc_parts.append(f"title={title}")
+    if text and text not in (aria, tooltip, label, title):
+        desc_parts.append(f"text={text}")
+    if href:
+        desc_parts.append(f"href={href}")
+
+    if not desc_parts:
+        return None
+
+    if fields.get("xpath"):
+        desc_parts.append(f"xpath={fields['xpath']}")
+    if fields.get("id"):
+        prefix = f"{prefix} [id={fields['id']}]"
+    return f"{prefix}: " + " | ".join(desc_parts)
+
+
+def is_pruned(el) -> bool:
+    """Узел не попадает в видимое дерево (мусорный тег, комментарий или скрытый элемент)."""
+    return not isinstance(el.tag, str) or el.tag in JUNK_TAGS or is_hidden(el)
+
+
+def visible_copy(el, origin: dict):
+    """
+    Копия поддерева el без мусорных и скрытых узлов (как strip_junk + strip_hidden).
+    В origin записывается соответствие копия → исходный элемент.
+    """
+    clone = _PARSER.makeelement(el.tag, dict(el.attrib))
+    clone.text = el.text
+    clone.tail = el.tail
+    origin[clone] = el
+    last = None
+    for child in el:
+        if is_pruned(child):
+            # tail удалённого узла остаётся в тексте, как в drop_element
+            if child.tail:
+                if last is not None:
+                    last.tail = (last.tail or "") + child.tail
+                else:
+                    clone.text = (clone.text or "") + child.tail
+            continue
+        last = visible_copy(child, origin)
+        clone.append(last)
+    return clone
+
+
+class HtmlChunk:
+    """
+    Кусок видимой части страницы из целых поддеревьев.
+
+    path   — абсолютный xpath ближайшего общего предка членов чанка в ПОЛНОМ дереве;
+    tree   — копия: скелет предков (только теги с атрибутами) + члены чанка,
+             каждый под копией своего родителя;
+    html   — сериализованный tree;
+    origin — копия → исходный элемент полного дерева (для абсолютных xpath).
+    """
+
+    def __init__(self, path: str, tree, origin: dict):
+        self.path = path
+        self.tree = tree
+        self.origin = origin
+        self.html = normalize_whitespace(lxml_html.tostring(tree, encoding="unicode"))
+
+
+def _merge_groups(groups: List[List], sizes: dict, max_chars: int) -> List[List]:
+    """
+    Склеивает соседние группы поддеревьев: жадно, пока влезают в max_chars,
+    затем группы меньше MIN_CHUNK_RATIO бюджета — к меньшему из соседей.
+    """
+    merged: List[list] = []
+    for group in groups:
+        size = sum(sizes[member] for member in group)
+        if merged and merged[-1][1] + size <= max_chars:
+            merged[-1][0].extend(group)
+            merged[-1][1] += size
+        else:
+            merged.append([list(group), size])
+
+    min_chars = max_chars * MIN_CHUNK_RATIO
+    index = 0
+    while len(merged) > 1 and index < len(merged):
+        members, size = merged[index]
+        if size >= min_chars:
+            index += 1
+            continue
+        previous = merged[index - 1] if index > 0 else None
+        following = merged[index + 1] if index + 1 < len(merged) else None
+        if following is None or (previous is not None and previous[1] <= following[1]):
+            previous[0].extend(members)
+            previous[1] += size
+        else:
+            following[0][:0] = members
+            following[1] += size
+        # На место index встаёт следующая группа — она проверяется на этой же позиции
+        del merged[index]
+    return [members for members, _ in merged]
+
+
+def _emit_chunk(members: List) -> HtmlChunk:
+    """
+    Кусок из поддеревьев members (в порядке документа, родители могут быть
+    разными): копии членов под скелетом их предков, общим для всего куска.
+    """
+    origin: dict = {}
+    skeleton: dict = {}
+    top = None
+    for member in members:
+        parent = member.getparent()
+        holder = None
+        if parent is not None:
+            for ancestor in reversed([parent] + list(parent.iterancestors())):
+                if ancestor in skeleton:
+                    continue
+                clone = _PARSER.makeelement(ancestor.tag, dict(ancestor.attrib))
+                origin[clone] = ancestor
+                skeleton[ancestor] = clone
+                up = ancestor.getparent()
+                if up is None:
+                    top = clone
+                else:
+                    skeleton[up].append(clone)
+            holder = skeleton[parent]
+            if not len(holder) and member is next((c for c in parent if not is_pruned(c)), None):
+                holder.text = parent.text
+        clone = visible_copy(member, origin)
+        if holder is None:
+            top = clone
+        else:
+            holder.append(clone)
+    for holder in skeleton.values():
+        # tail последнего члена не должен вылезать за пределы куска
+        if len(holder):
+            holder[-1].tail = None
+
+    parents = [member.getparent() for member in members]
+    path = ""
+    if all(parent is not None for parent in parents):
+        common = parents[0]
+        for parent in parents[1:]:
+            line = {parent, *parent.iterancestors()}
+            while common not in line:
+                common = common.getparent()
+        path = common.getroottree().getpath(common)
+    return HtmlChunk(path, top, origin)
+
+
+def _relax_xpath(xpath: str) -> str:
+    """
+    xpath без позиционных предикатов ([3], [last()]).
+
+    Без них "a//b" эквивалентно "a/descendant::b", а последнее libxml2 считает
+    за линейное время (у "//" внутри пути слияние множеств узлов квадратичное).
+    Строковые литералы не трогаем.
+    """
+    parts = re.split(r"('[^']*'|\"[^\"]*\")", xpath)
+    for i in range(0, len(parts), 2):
+        part = re.sub(r"\[\s*(\d+|last\(\))\s*\]", "", parts[i])
+        parts[i] = re.sub(r"(?<=[^\s/(|])//", "/descendant::", part)
+    return "".join(parts)
+
+
+class PageSnapshot:
+    """
+    Снимок состояния страницы.
+
+    HTML парсится lxml ОДИН раз (лениво, при первом обращении к tree), а все
+    представления для LLM выводятся из этого дерева и мемоизируются:
+        * visible_text()        — компактный видимый текст;
+        * interactive_summary() — краткий список интерактивных элементов;
+        * cleaned_html()        — HTML без script/style/... (без фильтра видимости);
+        * visible_html()        — очищенный HTML только видимой части;
+        * html_chunks(...)      — видимая часть, разбитая на куски по границам элементов;
+        * dom_chunk(...)        — выборка куска DOM по CSS/xpath;
+        * locator_index()       — уникальные локаторы элементов полного дерева.
+
+    Деревья, которые возвращают tree / visible_tree(), общие для всех
+    потребителей — их нельзя модифицировать.
+    """
+
+    # Общее число парсингов HTML (для бенчмарков)
+    parse_count = 0
+
+    def __init__(
+        self,
+        html: Optional[str] = "",
+        url: str = "",
+        title: str = "",
+        html_loader: Optional[Callable[[], str]] = None,
+    ):
+        # html=None + html_loader: HTML запрашивается лениво, при первом обращении
+        self._html = html
+        self._html_loader = html_loader
+        self.url = url
+        self.title = title
+        self._tree = None
+        self._parsed = False
+        self._memo: dict = {}
+
+    @property
+    def html(self) -> str:
+        if self._html is None:
+            self._html = (self._html_loader() if self._html_loader else "") or ""
+        return self._html
+
+    @property
+    def html_loaded(self) -> bool:
+        return self._html is not None
+
+    def memoize(self, key: tuple, factory: Callable[[], Any]) -> Any:
+        """Значение, вычисленное для этого снимка один раз."""
+        if key not in self._memo:
+            self._memo[key] = factory()
+        return self._memo[key]
+
+    @property
+    def tree(self):
+        """Полное lxml-дерево страницы (None, если HTML пуст)."""
+        if not self._parsed:
+            html = self.html
+            with span("snapshot.parse", chars=len(html)):
+                self._tree = parse_html(html)
+            self._parsed = True
+        return self._tree
+
+    def locator_index(self) -> LocatorIndex:
+        """LocatorIndex полного дерева — один проход на снимок."""
+        return self.memoize(("locator_index",), lambda: LocatorIndex(self.tree))
+
+    def cleaned_tree(self):
+        """Копия дерева без мусорных тегов и комментариев."""
+        def build():
+            if self.tree is None:
+                return None
+            return strip_junk(copy.deepcopy(self.tree))
+        return self.memoize(("cleaned_tree",), build)
+
+    def _visible(self) -> tuple:
+        def build():
+            if self.tree is None:
+                return None, {}
+            origin: dict = {}
+            return visible_copy(self.tree, origin), origin
+        return self.memoize(("visible_tree",), build)
+
+    def visible_tree(self):
+        """Копия дерева без мусорных тегов и заведомо скрытых элементов."""
+        return self._visible()[0]
+
+    def visible_origin(self) -> dict:
+        """Элемент visible_tree() → исходный элемент tree (для xpath по полному дереву)."""
+        return self._visible()[1]
+
+    def cleaned_html(self, max_chars: Optional[int] = None) -> str:
+        def build():
+            tree = self.cleaned_tree()
+            if tree is None:
+                return ""
+            return normalize_whitespace(lxml_html.tostring(tree, encoding="unicode"))
+        cleaned = self.memoize(("cleaned_html",), build)
+        return truncate(cleaned, max_chars) if max_chars else cleaned
+
+    def visible_html(self, max_chars: Optional[int] = None) -> str:
+        def build():
+            tree = self.visible_tree()
+            if tree is None:
+                return ""
+            return normalize_whitespace(lxml_html.tostring(tree, encoding="unicode"))
+        visible = self.memoize(("visible_html",), build)
+        return truncate(visible, max_chars) if max_chars else visible
+
+    def html_chunks(self, max_chars: int = 60000) -> List[HtmlChunk]:
+        """
+        Видимая часть страницы, упакованная в куски по ~max_chars символов.
+
+        Дерево обходится один раз: сначала снизу вверх считается размер каждого
+        видимого поддерева, затем поддеревья целиком жадно упаковываются в группы.
+        Поддерево больше бюджета разбивается по своим детям. Соседние группы
+        (в том числе разных родителей) склеиваются, пока влезают в бюджет, а
+        остатки меньше MIN_CHUNK_RATIO бюджета — к меньшему соседу даже сверх
+        него: каждый кусок — отдельный запрос к модели. Теги и атрибуты никогда
+        не режутся, а xpath внутри куска строятся по полному дереву.
+        """
+        return self.memoize(("html_chunks", max_chars), lambda: self._build_chunks(max_chars))
+
+    def _build_chunks(self, max_chars: int) -> List[HtmlChunk]:
+        root = self.tree
+        if root is None or is_pruned(root):
+            return []
+
+        sizes: dict = {}
+
+        def measure(el) -> int:
+            # Оценка длины сериализации: теги, атрибуты, текст, tail
+            size = 2 * len(el.tag) + 5 + len(el.text or "") + len(el.tail or "")
+            for key, value in el.attrib.items():
+                size += len(key) + len(value) + 4
+            for child in el:
+                size += len(child.tail or "") if is_pruned(child) else measure(child)
+            sizes[el] = size
+            return size
+
+        measure(root)
+        if sizes[root] <= max_chars or not len(root):
+            return [_emit_chunk([root])]
+
+        # Группы соседних поддеревьев одного родителя в порядке документа
+        groups: List[List] = []
+
+        def pack(el):
+            group: List = []
+            group_size = 0
+            for child in el:
+                if is_pruned(child):
+                    continue
+                size = sizes[child]
+                if size > max_chars and len(child):
+                    if group:
+                        groups.append(group)
+                        group, group_size = [], 0
+                    pack(child)
+                    continue
+                if group and group_size + size > max_chars:
+                    groups.append(group)
+                    group, group_size = [], 0
+                group.append(child)
+                group_size += size
+            if group:
+                groups.append(group)
+
+        pack(root)
+        return [_emit_chunk(members) for members in _merge_groups(groups, sizes, max_chars)]
+
+    def visible_text(self, max_chars: int = 20000) -> str:
+        def build():
+            tree = self.visible_tree()
+            if tree is None:
+                return ""
+            return normalize_whitespace(
+                " ".join(s.strip() for s in tree.itertext() if s.strip())
+            )
+        text = self.memoize(("visible_text",), build)
+        return truncate(text, max_chars, sep=" ")
+
+    def interactive_summary(self, max_items: int = 80, max_chars: int = 20000) -> str:
+        """
+        Краткий список интерактивных элементов:
+        - ссылки <a>
+        - кнопки <button>
+        - элементы с role=button/link/checkbox/tab/menuitem/row/option
+        - элементы с data-tooltip / data-label
+        """
+        return self.memoize(
+            ("interactive_summary", max_items, max_chars),
+            lambda: self._build_interactive_summary(max_items, max_chars),
+        )
+
+    def _build_interactive_summary(self, max_items: int, max_chars: int) -> str:
+        tree = self.tree
+        lines: List[str] = []
+
+        def add_line(prefix: str, el):
+            line = describe_interactive(prefix, {
+                "text": "".join(s.strip() for s in el.itertext()),
+                "aria": el.get("aria-label"),
+                "tooltip": el.get("data-tooltip"),
+                "label": el.get("data-label"),
+                "title": el.get("title"),
+                "href": el.get("href"),
+                "id": el.get("data-ba-id"),
+            })
+            if line:
+                lines.append(line)
+
+        if tree is not None:
+            groups = [("LINK", "//a"), ("BUTTON", "//button")]
+            roles = ["button", "link", "checkbox", "tab", "menuitem", "row", "option"]
+            groups += [(f"ROLE[{role}]", f"//*[@role='{role}']") for role in roles]
+            groups += [("TOOLTIP", "//*[@data-tooltip]"), ("LABEL", "//*[@data-label]")]
+
+            for prefix, query in groups:
+                for el in tree.xpath(query):
+                    if len(lines) >= max_items:
+                        break
+                    add_line(prefix, el)
+                if len(lines) >= max_items:
+                    break
+
+        summary = "\n".join(lines) if lines else "[no interactive elements summary]"
+        return truncate(summary, max_chars)
+
+    def dom_chunk(
+        self,
+        mode: Literal["css", "xpath"] = "css",
+        selector: str = "body",
+        max_chars: int = 8000,
+    ) -> str:
+        """
+        Фрагмент DOM по селектору.
+
+        Селектор применяется к ПОЛНОМУ дереву (чтобы индексы в xpath совпадали
+        с реальной страницей), мусорные теги удаляются уже из найденных узлов.
+        """
+        return self.memoize(
+            ("dom_chunk", mode, selector, max_chars),
+            lambda: self._build_dom_chunk(mode, selector, max_chars),
+        )
+
+    def _build_dom_chunk(self, mode: str, selector: str, max_chars: int) -> str:
+        if self.tree is None:
+            return ""
+
+        if mode == "css":
+            try:
+                from lxml.cssselect import CSSSelector
+                nodes = CSSSelector(selector)(self.tree)
+            except Exception as e:
+                return f"[DOM CHUNK] CSS selector error: {e}"
+            if not nodes:
+                return f"[DOM CHUNK] No elements for CSS selector: {selector}"
+        else:
+            try:
+                nodes = self.tree.xpath(selector)
+            except Exception as e:
+                return f"[DOM CHUNK] XPath parse error: {e}"
+            if not nodes:
+                return f"[DOM CHUNK] No elements for XPath: {selector}"
+            if not isinstance(nodes, list):
+                nodes = [nodes]
+
+        parts: List[str] = []
+        for node in nodes:
+            if not isinstance(node, etree._Element):
+                parts.append(str(node))
+                continue
+            if not isinstance(node.tag, str) or node.tag in JUNK_TAGS:
+                continue
+            parts.append(
+                lxml_html.tostring(strip_junk(copy.deepcopy(node)), encoding="unicode")
+            )
+
+        cleaned = truncate(normalize_whitespace("".join(parts)), max_chars)
+        return f"[DOM CHUNK mode={mode} selector={selector}]:\n{cleaned}"
+
+    def resolve_xpath(self, xpath: str, action: Literal["click", "enter"] = "click"):
+        """
+        Проверяет xpath по снимку (без обращения к браузеру) и возвращает
+        единственный подходящий lxml-элемент.
+
+        - несколько совпадений, из которых интерактивно ровно одно → оно;
+        - для enter: если цель не поле ввода, но внутри ровно одно поле → оно.
+        Иначе бросает LocatorError с ближайшими кандидатами.
+        """
+        tree = self.tree
+        if tree is None:
+            raise LocatorError("no_match", xpath)
+        try:
+            matches = tree.xpath(xpath)
+        except etree.XPathError as e:
+            raise LocatorError("invalid_xpath", xpath, candidates=self.closest_elements(xpath)) from e
+        if not isinstance(matches, list):
+            matches = []
+        matches = [m for m in matches if isinstance(m, etree._Element) and isinstance(m.tag, str)]
+
+        if not matches:
+            raise LocatorError("no_match", xpath, candidates=self.closest_elements(xpath))
+
+        usable = [m for m in matches if self.is_interactable(m)]
+        if action == "enter":
+            usable = [self._editable_target(m) for m in usable]
+            usable = [m for m in usable if m is not None]
+
+        if len(usable) == 1:
+            return usable[0]
+        if not usable:
+            reason = "not_editable" if action == "enter" else "not_interactable"
+            raise LocatorError(
+                reason, xpath, matches=len(matches),
+                candidates=[self._candidate(m) for m in matches[:5]] + self.closest_elements(xpath, limit=3),
+            )
+        raise LocatorError(
+            "multiple", xpath, matches=len(matches),
+            candidates=[self._candidate(m) for m in usable[:5]],
+        )
+
+    @staticmethod
+    def is_interactable(el) -> bool:
+        """Элемент и его предки не скрыты, элемент не выключен."""
+        if el.get("disabled") is not None or el.get("aria-disabled") == "true":
+            return False
+        node = el
+        while node is not None:
+            if node.tag in JUNK_TAGS or is_hidden(node):
+                return False
+            node = node.getparent()
+        return True
+
+    @staticmethod
+    def _editable_target(el):
+        if is_editable(el):
+            return el
+        inner = [d for d in el.iterdescendants() if isinstance(d.tag, str) and is_editable(d)]
+        return inner[0] if len(inner) == 1 else None
+
+    def _candidate(self, el) -> dict:
+        fields = element_fields(el)
+        return {
+            "id": int(fields["id"]) if (fields["id"] or "").isdigit() else None,
+            "xpath": self.tree.getroottree().getpath(el),
+            "description": describe_interactive(el.tag, fields) or el.tag,
+        }
+
+    def interactive_fields(self) -> List[tuple]:
+        """[(элемент, element_fields)] для всех видимых интерактивных элементов."""
+        def build():
+            if self.tree is None:
+                return []
+            # То же, что is_interactable, но скрытость предков запоминается:
+            # соседние элементы не проходят заново одну и ту же цепочку
+            blocked: dict = {}
+
+            def hidden_path(node) -> bool:
+                chain = []
+                result = False
+                while node is not None:
+                    if node in blocked:
+                        result = blocked[node]
+                        break
+                    chain.append(node)
+                    if node.tag in JUNK_TAGS or is_hidden(node):
+                        result = True
+                        break
+                    node = node.getparent()
+                for seen in chain:
+                    blocked[seen] = result
+                return result
+
+            return [
+                (el, element_fields(el))
+                for el in self.tree.xpath(INTERACTIVE_XPATH)
+                if el.get("disabled") is None and el.get("aria-disabled") != "true" and not hidden_path(el)
+            ]
+        return self.memoize(("interactive_fields",), build)
+
+    def _interactive_elements(self) -> List[tuple]:
+        """[(элемент, текст для сравнения)] для всех видимых интерактивных элементов."""
+        def build():
+            result = []
+            for el, fields in self.interactive_fields():
+                haystack = " ".join(
+                    str(fields[k]) for k in ("aria", "tooltip", "label", "title", "text") if fields[k]
+                ).lower()
+                if haystack:
+                    result.append((el, haystack))
+            return result
+        return self.memoize(("interactive_elements",), build)
+
+    def closest_elements(self, xpath: str, limit: int = 3) -> List[dict]:
+        """
+        Ближайшие к ошибочному xpath элементы:
+        - совпадения того же xpath без позиционных индексов ([3], [last()]);
+        - элементы, чьи aria/tooltip/title/текст похожи на строковые литералы xpath.
+        """
+        found: List = []
+
+        relaxed = _relax_xpath(xpath)
+        if relaxed != xpath and self.tree is not None:
+            try:
+                relaxed_matches = self.tree.xpath(relaxed)
+            except etree.XPathError:
+                relaxed_matches = []
+            if isinstance(relaxed_matches, list):
+                found.extend(
+                    m for m in relaxed_matches
+                    if isinstance(m, etree._Element) and isinstance(m.tag, str) and self.is_interactable(m)
+                )
+
+        literals = [a or b for a, b in re.findall(r"'([^']+)'|\"([^\"]+)\"", xpath)]
+        literals = [lit.lower() for lit in literals if lit.strip()]
+        if literals and len(found) < limit:
+            scored = []
+            for el, haystack in self._interactive_elements():
+                best = 0.0
+                for lit in literals:
+                    if lit in haystack:
+                        best = 1.0
+                        break
+                    matcher = SequenceMatcher(None, lit, haystack[: len(lit) * 3])
+                    if matcher.real_quick_ratio() > best and matcher.quick_ratio() > best:
+                        best = max(best, matcher.ratio())
+                if best >= 0.5:
+                    scored.append((best, el))
+            scored.sort(key=lambda pair: -pair[0])
+            found.extend(el for _, el in scored)
+
+        candidates: List[dict] = []
+        seen = set()
+        for el in found:
+            if el in seen:
+                continue
+            seen.add(el)
+            candidates.append(self._candidate(el))
+            if len(candidates) >= limit:
+                break
+        return candidates
@@ -0,0 +1,203 @@
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+
+class Span:
+    """Отрезок времени с атрибутами; закрывается при выходе из with."""
+
+    __slots__ = ("tracer", "name", "attrs", "id", "parent", "start", "_started")
+
+    def __init__(self, tracer: "Tracer", name: str, attrs: dict):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.id = 0
+        self.parent: Optional[int] = None
+        self.start = 0.0
+        self._started = 0.0
+
+    def set(self, **attrs) -> "Span":
+        self.attrs.update(attrs)
+        return self
+
+    def __enter__(self) -> "Span":
+        self.tracer._open(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.attrs["error"] = f"{exc_type.__name__}: {exc}"[:300]
+        self.tracer._close(self)
+        return False
+
+
+class _NoopSpan:
+    """Span выключенного трассировщика: ничего не пишет и не считает."""
+
+    __slots__ = ()
+
+    def set(self, **attrs) -> "_NoopSpan":
+        return self
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """
+    Трассировка шагов агента.
+
+        with tracer.span("browser.open", url=url) as span:
+            ...
+            span.set(bytes=len(html))
+
+    Каждый закрытый span — строка JSONL в path:
+        {"name", "id", "parent", "thread", "start" (unix, с), "ms", "attrs"}
+    parent — объемлющий span того же потока. chrome_path дополнительно пишет
+    формат Chrome Trace Event (chrome://tracing, ui.perfetto.dev) при close().
+    Выключенный трассировщик отдаёт общий NOOP_SPAN — накладные расходы
+    сводятся к одной проверке флага.
+    """
+
+    def __init__(self, path: Optional[str] = None, chrome_path: Optional[str] = None):
+        self.path = None
+        self.chrome_path = None
+        self.enabled = False
+        self._file = None
+        self._events: list = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._next_id = 0
+        self._origin = time.perf_counter()
+        self._origin_wall = time.time()
+        if path or chrome_path:
+            self.configure(path, chrome_path)
+
+    def configure(self, path: Optional[str] = None, chrome_path: Optional[str] = None):
+        """Включает трассировку (пустые пути — выключает)."""
+        self.close()
+        self.path = path or None
+        self.chrome_path = chrome_path or None
+        self.enabled = bool(self.path or self.chrome_path)
+        if self.path:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+
+    def span(self, name: str, **attrs):
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, attrs)
+
+    def _open(self, span: Span):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        with self._lock:
+            self._next_id += 1
+            span.id = self._next_id
+        span.parent = stack[-1] if stack else None
+        stack.append(span.id)
+        span._started = time.perf_counter()
+
+    def _close(self, span: Span):
+        finished = time.perf_counter()
+        stack = self._local.stack
+        if stack and stack[-1] == span.id:
+            stack.pop()
+        start = self._origin_wall + (span._started - self._origin)
+        record = {
+            "name": span.name,
+            "id": span.id,
+            "parent": span.parent,
+            "thread": threading.get_ident(),
+            "start": round(start, 6),
+            "ms": round((finished - span._started) * 1000, 3),
+            "attrs": span.attrs,
+        }
+        with self._lock:
+            if self._file is not None:
+                self._file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            if self.chrome_path:
+                self._events.append(record)
+
+    def close(self):
+        """Дописывает Chrome trace и закрывает файлы."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            events, self._events = self._events, []
+        if self.chrome_path and events:
+            write_chrome_trace(events, self.chrome_path)
+
+
+def write_chrome_trace(records: list, path: str):
+    """Записи JSONL → Chrome Trace Event Format (complete events, "ph": "X")."""
+    pid = os.getpid()
+    trace = {
+        "traceEvents": [
+            {
+                "name": record["name"],
+                "cat": record["name"].split(".", 1)[0],
+                "ph": "X",
+                "ts": round(record["start"] * 1_000_000),
+                "dur": round(record["ms"] * 1000),
+                "pid": pid,
+                "tid": record["thread"],
+                "args": record["attrs"],
+            }
+            for record in records
+        ],
+        "displayTimeUnit": "ms",
+    }
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(trace, file, ensure_ascii=False, default=str)
+
+
+def jsonl_to_chrome_trace(jsonl_path: str, path: str):
+    """Конвертирует готовый JSONL-трейс в Chrome trace."""
+    with open(jsonl_path, "r", encoding="utf-8") as file:
+        records = [json.loads(line) for line in file if line.strip()]
+    write_chrome_trace(records, path)
+
+
+# Общий трассировщик процесса; выключен, пока не вызван configure()
+tracer = Tracer()
+atexit.register(tracer.close)
+
+
+def span(name: str, **attrs):
+    return tracer.span(name, **attrs)
+
+
+def configure(path: Optional[str] = None, chrome_path: Optional[str] = None):
+    tracer.configure(path, chrome_path)
+
+
+def traced(name: str):
+    """Декоратор: вызов функции — span name (при выключенной трассировке — прямой вызов)."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            with Span(tracer, name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
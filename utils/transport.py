@@ -0,0 +1,83 @@
+import importlib.util
+import threading
+import time
+from typing import Optional
+
+import httpx
+
+
+# Значения по умолчанию для HTTP-транспорта клиента OpenAI
+DEFAULT_TRANSPORT_OPTIONS = {
+    # Пусто — без прокси (прямое соединение)
+    "proxy": "",
+    "http2": False,
+    "max_connections": 20,
+    "max_keepalive_connections": 10,
+    # Сколько секунд держать простаивающее соединение открытым
+    "keepalive_expiry": 120.0,
+    "connect_timeout": 10.0,
+    # Генерация длинного ответа идёт долго — read-таймаут самый большой
+    "read_timeout": 180.0,
+    "write_timeout": 30.0,
+    "pool_timeout": 30.0,
+}
+
+
+def _client_kwargs(options: Optional[dict]) -> dict:
+    settings = {**DEFAULT_TRANSPORT_OPTIONS, **(options or {})}
+    http2 = bool(settings["http2"])
+    if http2 and importlib.util.find_spec("h2") is None:
+        print("⚠️ HTTP/2 недоступен (pip install 'httpx[http2]'), используется HTTP/1.1")
+        http2 = False
+    kwargs = {
+        "http2": http2,
+        "limits": httpx.Limits(
+            max_connections=settings["max_connections"],
+            max_keepalive_connections=settings["max_keepalive_connections"],
+            keepalive_expiry=settings["keepalive_expiry"],
+        ),
+        "timeout": httpx.Timeout(
+            connect=settings["connect_timeout"],
+            read=settings["read_timeout"],
+            write=settings["write_timeout"],
+            pool=settings["pool_timeout"],
+        ),
+    }
+    if settings["proxy"]:
+        kwargs["proxy"] = httpx.Proxy(settings["proxy"])
+    return kwargs
+
+
+def build_http_client(options: Optional[dict] = None) -> httpx.Client:
+    """
+    httpx.Client для OpenAI с пулом keep-alive соединений и раздельными таймаутами.
+    options — ключи DEFAULT_TRANSPORT_OPTIONS, недостающие берутся по умолчанию.
+    """
+    return httpx.Client(**_client_kwargs(options))
+
+
+def build_async_http_client(options: Optional[dict] = None) -> httpx.AsyncClient:
+    """То же для AsyncOpenAI: одинаковые прокси, лимиты пула и таймауты."""
+    return httpx.AsyncClient(**_client_kwargs(options))
+
+
+def warm_up(client: httpx.Client, url: str, timeout: float = 10.0) -> Optional[float]:
+    """
+    Заранее открывает соединение (DNS, прокси, TLS) к url, чтобы первый
+    запрос к модели не платил за установку. Код ответа не важен — соединение
+    остаётся в пуле. Возвращает время в секундах или None при ошибке.
+    """
+    started = time.perf_counter()
+    try:
+        client.head(url, timeout=timeout)
+    except httpx.HTTPError as e:
+        print(f"⚠️ Не удалось заранее подключиться к {url}: {e}")
+        return None
+    return time.perf_counter() - started
+
+
+def warm_up_in_background(client: httpx.Client, url: str, timeout: float = 10.0) -> threading.Thread:
+    """warm_up в фоновом потоке — пока запускается браузер."""
+    thread = threading.Thread(target=warm_up, args=(client, url, timeout), daemon=True)
+    thread.start()
+    return thread